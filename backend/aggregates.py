@@ -0,0 +1,536 @@
+"""
+Modelo de agregação do Data Mart.
+
+Declara as métricas e dimensões dos fatos (fct_sales / fct_product_sales)
+e as tabelas pré-agregadas (rollups) que o ETL constrói a partir deles.
+
+A API descreve cada relatório como uma AggregateQuery (dimensões, métricas
+e filtros) e o AggregateRouter escolhe a MENOR tabela que consegue
+responder: um rollup que tenha todas as dimensões/filtros pedidos ou,
+se nenhum servir, o próprio fato. Rankings de produtos (top/bottom-K)
+que o ETL já deixou prontos em 'rank_products' viram uma leitura por chave.
+
+Os fatos guardam chaves inteiras no lugar dos nomes (ver star.py): sobre
+o fato, a agregação é feita pelas chaves e as dimensões só são juntadas
+ao resultado agregado. Rollups, rankings e as demais tabelas derivadas
+guardam os nomes.
+"""
+import os
+import threading
+from dataclasses import dataclass, replace
+from typing import Optional
+
+from star import lookups
+
+
+@dataclass(frozen=True)
+class Measure:
+    """
+    Uma métrica do relatório.
+    'fact_sql' é a expressão sobre o fato; 'rollup_sql' é a mesma métrica
+    recalculada a partir das colunas do rollup listadas em 'requires'.
+    """
+    fact_sql: str
+    rollup_sql: str
+    requires: tuple
+
+
+@dataclass(frozen=True)
+class Fact:
+    table: str
+    # Dimensão -> expressão SQL. Dimensões "virtuais" (ex.: forma_pagamento)
+    # dependem de outra coluna, listada em 'dimension_columns'.
+    dimensions: dict
+    dimension_columns: dict
+    # Colunas aditivas guardadas nos rollups: nome -> agregação sobre o fato
+    rollup_columns: dict
+    measures: dict
+
+
+@dataclass(frozen=True)
+class Rollup:
+    table: str
+    fact: str
+    dimensions: tuple
+
+
+@dataclass(frozen=True)
+class AggregateQuery:
+    """
+    Um relatório de agregação.
+    'measures' aceita o nome da métrica ou (métrica, alias).
+    'filters' são dimensões comparadas por igualdade, na ordem dos parâmetros (?).
+    Também aceitam (dimensão, operador) ou (dimensão, "in", n_valores).
+    """
+    fact: str
+    dimensions: tuple = ()
+    measures: tuple = ()
+    filters: tuple = ()
+    order_by: tuple = ()
+    limit: Optional[int] = None
+
+
+# --- Fatos ---
+FACTS = {
+    "sales": Fact(
+        table="fct_sales",
+        dimensions={
+            "store_name": "store_name",
+            "channel_name": "channel_name",
+            "mes_ano": "mes_ano",
+            "data_venda": "data_venda",
+            "payment_type": "payment_type",
+            "forma_pagamento": "COALESCE(payment_type, 'Não Identificado')",
+            "channel_type": "channel_type",
+            "store_city": "store_city",
+            "dia_da_semana_nome": "dia_da_semana_nome",
+            "hora_do_dia": "hora_do_dia",
+            "periodo_do_dia": "periodo_do_dia",
+            "delivery_neighborhood": "delivery_neighborhood",
+            "delivery_city": "delivery_city",
+        },
+        dimension_columns={
+            "forma_pagamento": "payment_type",
+        },
+        rollup_columns={
+            "faturamento": "SUM(sale_total_amount)",
+            "total_vendas": "COUNT(sale_id)",
+            "total_descontos": "SUM(total_discount)",
+            "delivery_seconds_sum": "SUM(delivery_seconds)",
+            "delivery_count": "COUNT(delivery_seconds)",
+        },
+        measures={
+            "faturamento": Measure("SUM(sale_total_amount)", "SUM(faturamento)", ("faturamento",)),
+            "total_vendas": Measure("COUNT(sale_id)", "SUM(total_vendas)", ("total_vendas",)),
+            "total_descontos": Measure("SUM(total_discount)", "SUM(total_descontos)", ("total_descontos",)),
+            "ticket_medio": Measure(
+                "AVG(sale_total_amount)",
+                "SUM(faturamento) / NULLIF(SUM(total_vendas), 0)",
+                ("faturamento", "total_vendas"),
+            ),
+            "tempo_entrega": Measure(
+                "AVG(delivery_seconds / 60)",
+                "SUM(delivery_seconds_sum) / NULLIF(SUM(delivery_count), 0) / 60",
+                ("delivery_seconds_sum", "delivery_count"),
+            ),
+        },
+    ),
+    "product_sales": Fact(
+        table="fct_product_sales",
+        dimensions={
+            "store_name": "store_name",
+            "channel_name": "channel_name",
+            "mes_ano": "mes_ano",
+            "data_venda": "data_venda",
+            "product_name": "product_name",
+            "product_category": "product_category",
+            "channel_type": "channel_type",
+        },
+        dimension_columns={},
+        rollup_columns={
+            "faturamento": "SUM(product_total_price)",
+            "quantidade": "SUM(product_quantity)",
+        },
+        measures={
+            "faturamento": Measure("SUM(product_total_price)", "SUM(faturamento)", ("faturamento",)),
+            "quantidade": Measure("SUM(product_quantity)", "SUM(quantidade)", ("quantidade",)),
+        },
+    ),
+}
+
+# --- Rollups (construídos pelo ETL depois dos fatos) ---
+ROLLUPS = [
+    Rollup("agg_sales_store_day_channel", "sales", ("store_name", "data_venda", "mes_ano", "channel_name")),
+    Rollup("agg_sales_payment_month", "sales", ("payment_type", "mes_ano")),
+    Rollup("agg_products_store_month", "product_sales", ("store_name", "mes_ano", "product_name")),
+    Rollup("agg_products_channel_month", "product_sales", ("channel_name", "mes_ano", "product_name")),
+]
+
+ROLLUPS_BY_TABLE = {rollup.table: rollup for rollup in ROLLUPS}
+
+
+def build_rollup_sql(rollup: Rollup) -> str:
+    """SQL que (re)cria o rollup a partir do fato (agregado pelas chaves, com os nomes)."""
+    return f"""
+    CREATE OR REPLACE TABLE {rollup.table} AS
+    {compile_partial(rollup.fact, list(rollup.dimensions))}
+    ORDER BY {", ".join(rollup.dimensions)};
+    """
+
+
+# --- Rankings de produtos (top/bottom-K, construídos pelo ETL) ---
+RANKING_TABLE = "rank_products"
+RANKING_TOP_K = int(os.getenv("RANKING_TOP_K", "20"))
+RANKING_KEYS = ("store_name", "channel_name", "mes_ano")
+# Escopo -> dimensões que identificam cada ranking
+RANKING_SCOPES = {
+    "global": (),
+    "store": ("store_name",),
+    "channel": ("channel_name",),
+    "month": ("mes_ano",),
+    "store_month": ("store_name", "mes_ano"),
+}
+RANKING_METRICS = ("faturamento", "quantidade")
+RANKING_DIRECTIONS = {"top": "DESC", "bottom": "ASC"}
+
+
+def build_ranking_sql(top_k: int = RANKING_TOP_K) -> str:
+    """
+    SQL que (re)cria 'rank_products': os K primeiros e os K últimos produtos
+    por faturamento e por quantidade em cada escopo. Uma varredura das
+    parciais loja × canal × mês × produto (GROUPING SETS); o desempate é
+    product_name ASC, como nos relatórios.
+    """
+    fact = FACTS["product_sales"]
+    keys = ", ".join(RANKING_KEYS)
+    grouping_sets = ", ".join(f"({', '.join((*dims, 'product_name'))})" for dims in RANKING_SCOPES.values())
+    scope_cases = " ".join(
+        "WHEN " + " AND ".join(
+            f"GROUPING({key}) = {0 if key in dims else 1}" for key in RANKING_KEYS
+        ) + f" THEN '{scope}'"
+        for scope, dims in RANKING_SCOPES.items()
+    )
+    measures = ", ".join(f"SUM({name}) AS {name}" for name in fact.rollup_columns)
+    rankings = "\n        UNION ALL\n".join(
+        f"""        SELECT *, '{metric}' AS metric, '{direction}' AS direction,
+            ROW_NUMBER() OVER (PARTITION BY scope, {keys} ORDER BY {metric} {order}, product_name ASC) AS rank
+        FROM totals
+        QUALIFY rank <= {int(top_k)}"""
+        for metric in RANKING_METRICS
+        for direction, order in RANKING_DIRECTIONS.items()
+    )
+    return f"""
+    CREATE OR REPLACE TABLE {RANKING_TABLE} AS
+    WITH totals AS (
+        SELECT
+            CASE {scope_cases} END AS scope,
+            {keys}, product_name,
+            {measures}
+        FROM ({compile_partial("product_sales", [*RANKING_KEYS, "product_name"])}) AS p
+        GROUP BY GROUPING SETS ({grouping_sets})
+    )
+    SELECT * FROM (
+{rankings}
+    )
+    ORDER BY scope, metric, direction, {keys}, rank;
+    """
+
+
+def _ranking_lookup(query: "AggregateQuery") -> Optional[str]:
+    """
+    Se a query é um "top/bottom-K de produtos" que o ETL já ranqueou,
+    devolve o SELECT por chave em 'rank_products' (senão, None).
+    """
+    if query.fact != "product_sales" or query.dimensions != ("product_name",):
+        return None
+    if query.limit is None or query.limit > RANKING_TOP_K or not query.order_by:
+        return None
+    metric, order = query.order_by[0]
+    if metric not in RANKING_METRICS or tuple(query.order_by[1:]) != (("product_name", "ASC"),):
+        return None
+    if any(_measure_name_alias(m)[0] not in RANKING_METRICS for m in query.measures):
+        return None
+    filters = [filter_parts(f) for f in query.filters]
+    if any(op != "=" for _, op, _ in filters):
+        return None
+    filter_dims = tuple(dimension for dimension, _, _ in filters)
+    scope = next((name for name, dims in RANKING_SCOPES.items() if set(dims) == set(filter_dims)), None)
+    if scope is None or len(set(filter_dims)) != len(filter_dims):
+        return None
+
+    direction = next(d for d, o in RANKING_DIRECTIONS.items() if o == order.upper())
+    select = ["product_name"]
+    for measure in query.measures:
+        name, alias = _measure_name_alias(measure)
+        select.append(name if name == alias else f"{name} AS {alias}")
+    where = [f"scope = '{scope}'", f"metric = '{metric}'", f"direction = '{direction}'"]
+    where += [f"{dimension} = ?" for dimension in filter_dims]
+    where.append(f"rank <= {int(query.limit)}")
+    return (f"SELECT {', '.join(select)} FROM {RANKING_TABLE} "
+            f"WHERE {' AND '.join(where)} ORDER BY rank;")
+
+
+def _measure_name_alias(measure) -> tuple:
+    return (measure, measure) if isinstance(measure, str) else measure
+
+
+FILTER_OPERATORS = ("=", "!=", ">", ">=", "<", "<=", "in")
+
+
+def filter_parts(flt) -> tuple:
+    """Normaliza um filtro para (dimensão, operador, n_valores)."""
+    if isinstance(flt, str):
+        return flt, "=", 1
+    if len(flt) == 2:
+        return flt[0], flt[1], 1
+    return tuple(flt)
+
+
+def _filter_sql(fact: Fact, flt) -> str:
+    dimension, op, n_values = filter_parts(flt)
+    if op == "in":
+        return f"{fact.dimensions[dimension]} IN ({', '.join(['?'] * n_values)})"
+    return f"{fact.dimensions[dimension]} {op} ?"
+
+
+def _fact_filter_sql(fact: Fact, flt) -> str:
+    """Filtro sobre o fato: nomes de dimensão viram as chaves que casam."""
+    dimension = filter_parts(flt)[0]
+    dim = lookups(fact.table).get(fact.dimension_columns.get(dimension, dimension))
+    if dim is None:
+        return _filter_sql(fact, flt)
+    return f"{dim.key} IN (SELECT {dim.key} FROM {dim.table} WHERE {_filter_sql(fact, flt)})"
+
+
+def required_columns(query: AggregateQuery) -> set:
+    fact = FACTS[query.fact]
+    filter_dims = [filter_parts(f)[0] for f in query.filters]
+    return {fact.dimension_columns.get(d, d) for d in (*query.dimensions, *filter_dims)}
+
+
+def _covers(rollup: Rollup, query: AggregateQuery) -> bool:
+    if rollup.fact != query.fact:
+        return False
+    fact = FACTS[query.fact]
+    needed_measures = {
+        column
+        for measure in query.measures
+        for column in fact.measures[_measure_name_alias(measure)[0]].requires
+    }
+    return (required_columns(query) <= set(rollup.dimensions)
+            and needed_measures <= set(fact.rollup_columns))
+
+
+def compile_partial(fact_name: str, columns: list, source: Optional[Rollup] = None, filters: tuple = ()) -> str:
+    """
+    Parciais aditivas (as colunas de rollup) agrupadas por 'columns'.
+    O resultado tem o mesmo formato de um rollup e pode ser somado a
+    outras parciais (ex.: a fatia ao vivo do modo híbrido, os shards).
+    'filters' (como em AggregateQuery, com ?) são aplicados antes de agrupar.
+    """
+    fact = FACTS[fact_name]
+    if source is None:
+        return _compile_fact_partial(fact, columns, filters)
+    additive = [f"SUM({name}) AS {name}" for name in fact.rollup_columns]
+    sql = "SELECT " + ", ".join([*columns, *additive]) + f" FROM {source.table}"
+    if filters:
+        sql += " WHERE " + " AND ".join(_filter_sql(fact, f) for f in filters)
+    if columns:
+        sql += " GROUP BY " + ", ".join(columns)
+    return sql
+
+
+def _compile_fact_partial(fact: Fact, columns: list, filters: tuple) -> str:
+    """
+    compile_partial sobre o fato: agrupa pelas chaves (e colunas do próprio
+    fato) e só então junta as dimensões para trazer os nomes.
+    """
+    fact_lookups = lookups(fact.table)
+    dims = list(dict.fromkeys(fact_lookups[c] for c in columns if c in fact_lookups))
+    group = [dim.key for dim in dims] + [c for c in columns if c not in fact_lookups]
+    additive = [f"{expr} AS {name}" for name, expr in fact.rollup_columns.items()]
+    sql = "SELECT " + ", ".join([*group, *additive]) + f" FROM {fact.table}"
+    if filters:
+        sql += " WHERE " + " AND ".join(_fact_filter_sql(fact, f) for f in filters)
+    if group:
+        sql += " GROUP BY " + ", ".join(group)
+    if not dims:
+        return sql
+
+    select = [f"{fact_lookups[c].table}.{c}" if c in fact_lookups else f"p.{c}" for c in columns]
+    select += [f"p.{name}" for name in fact.rollup_columns]
+    joins = " ".join(f"LEFT JOIN {dim.table} ON p.{dim.key} = {dim.table}.{dim.key}" for dim in dims)
+    return f"SELECT {', '.join(select)} FROM ({sql}) p {joins}"
+
+
+def compile_aggregate(query: AggregateQuery, source: Optional[Rollup] = None, table: Optional[str] = None) -> str:
+    """
+    Gera o SQL (com ? para os filtros) sobre o fato ou sobre o rollup dado.
+    'table' lê de outra tabela com as colunas do fato, já com os nomes das
+    dimensões (ex.: um recorte temporário, os arquivos do lake).
+    """
+    fact = FACTS[query.fact]
+    if source is None and table is None:
+        # Fato: parciais pelas chaves (já filtradas), nomes juntados depois
+        columns = sorted({fact.dimension_columns.get(d, d) for d in query.dimensions})
+        partial = compile_partial(query.fact, columns, filters=query.filters)
+        return f"WITH star AS ({partial})\n    " + compile_aggregate(
+            replace(query, filters=()), source=Rollup("star", query.fact, tuple(columns))
+        )
+    table = table or source.table
+
+    select = [
+        f"{fact.dimensions[d]} AS {d}" if fact.dimensions[d] != d else d
+        for d in query.dimensions
+    ]
+    for measure in query.measures:
+        name, alias = _measure_name_alias(measure)
+        m = fact.measures[name]
+        select.append(f"{m.rollup_sql if source else m.fact_sql} AS {alias}")
+
+    sql = "SELECT\n        " + ",\n        ".join(select) + f"\n    FROM {table}"
+    if query.filters:
+        sql += "\n    WHERE " + " AND ".join(_filter_sql(fact, f) for f in query.filters)
+    if query.dimensions:
+        sql += "\n    GROUP BY " + ", ".join(query.dimensions)
+    if query.order_by:
+        sql += "\n    ORDER BY " + ", ".join(f"{column} {direction}" for column, direction in query.order_by)
+    if query.limit is not None:
+        sql += f"\n    LIMIT {int(query.limit)}"
+    return sql + ";"
+
+
+# Períodos comparados por compile_comparison, na ordem dos parâmetros
+COMPARISON_PERIODS = ("atual", "anterior")
+
+
+def compile_comparison(query: AggregateQuery, source: Optional[Rollup] = None,
+                       period_column: str = "data_venda") -> str:
+    """
+    Comparação de períodos numa varredura só (agregação condicional).
+    Parâmetros: início e fim de cada período de COMPARISON_PERIODS e depois
+    os filtros da query (que devem cobrir os dois períodos).
+    Devolve uma linha por métrica: metrica, atual, anterior, delta, delta_pct.
+    """
+    fact = FACTS[query.fact]
+    flags = ", ".join(f"{period_column} BETWEEN ? AND ? AS em_{p}" for p in COMPARISON_PERIODS)
+    if source is None:
+        # Fato: parciais por dia, já filtradas (os ? delas vêm depois dos
+        # períodos, como no WHERE)
+        partial = compile_partial(query.fact, [period_column], filters=query.filters)
+        source = Rollup(f"({partial}) AS star", query.fact, (period_column,))
+        where = "TRUE"
+    else:
+        where = " AND ".join(_filter_sql(fact, f) for f in query.filters) or "TRUE"
+    table = source.table
+
+    # 1) Parciais aditivas de cada período (uma coluna por período)
+    partials = [
+        f"SUM({name}) FILTER (WHERE em_{p}) AS {name}_{p}"
+        for p in COMPARISON_PERIODS
+        for name in fact.rollup_columns
+    ]
+    # 2) Uma linha por período, no formato de um rollup
+    periods = "\n        UNION ALL\n".join(
+        f"        SELECT '{p}' AS periodo, "
+        + ", ".join(f"{name}_{p} AS {name}" for name in fact.rollup_columns)
+        + " FROM partials"
+        for p in COMPARISON_PERIODS
+    )
+    # 3) Métricas por período, recalculadas a partir das parciais
+    measures = [_measure_name_alias(m) for m in query.measures]
+    values = ", ".join(
+        f"CAST({fact.measures[name].rollup_sql} AS DOUBLE) AS {alias}" for name, alias in measures
+    )
+    current, previous = COMPARISON_PERIODS
+    rows = "\n        UNION ALL\n".join(
+        f"        SELECT {i} AS ordem, '{alias}' AS metrica, a.{alias} AS atual, b.{alias} AS anterior"
+        f" FROM by_period a, by_period b WHERE a.periodo = '{current}' AND b.periodo = '{previous}'"
+        for i, (_, alias) in enumerate(measures)
+    )
+    return f"""
+    WITH scan AS (
+        SELECT *, {flags}
+        FROM {table}
+        WHERE {where}
+    ),
+    partials AS MATERIALIZED (
+        SELECT {", ".join(partials)}
+        FROM scan
+    ),
+    periods AS (
+{periods}
+    ),
+    by_period AS (
+        SELECT periodo, {values}
+        FROM periods
+        GROUP BY periodo
+    )
+    SELECT
+        metrica, atual, anterior,
+        atual - anterior AS delta,
+        ROUND(100 * (atual - anterior) / NULLIF(anterior, 0), 2) AS delta_pct
+    FROM (
+{rows}
+    )
+    ORDER BY ordem;
+    """
+
+
+@dataclass(frozen=True)
+class QueryPlan:
+    sql: str
+    table: str
+    estimated_rows: int
+
+
+class AggregateRouter:
+    """
+    Escolhe, para cada AggregateQuery, a menor tabela do mart que a cobre.
+    O catálogo (tabelas existentes e tamanhos) é lido uma vez por versão
+    do mart; o SQL compilado também fica guardado por versão.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._table_rows = {}
+        self._compiled = {}
+
+    def _load_catalog(self, cursor, version):
+        rows = cursor.execute("SELECT table_name, estimated_size FROM duckdb_tables()").fetchall()
+        self._table_rows = dict(rows)
+        self._compiled = {}
+        self._version = version
+
+    def choose_source(self, query: AggregateQuery) -> Optional[Rollup]:
+        """Menor rollup existente que cobre a query (None = usar o fato)."""
+        candidates = [
+            r for r in ROLLUPS
+            if r.table in self._table_rows and _covers(r, query)
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda r: self._table_rows[r.table])
+
+    def plan(self, query: AggregateQuery, cursor, version) -> "QueryPlan":
+        """SQL + tabela escolhida + linhas que ela tem (estimativa do scan)."""
+        with self._lock:
+            if version is None or version != self._version:
+                self._load_catalog(cursor, version)
+            plan = self._compiled.get(query)
+            if plan is None and RANKING_TABLE in self._table_rows:
+                lookup = _ranking_lookup(query)
+                if lookup is not None:
+                    plan = self._compiled[query] = QueryPlan(
+                        sql=lookup, table=RANKING_TABLE, estimated_rows=self._table_rows[RANKING_TABLE]
+                    )
+            if plan is None:
+                source = self.choose_source(query)
+                table = source.table if source else FACTS[query.fact].table
+                plan = self._compiled[query] = QueryPlan(
+                    sql=compile_aggregate(query, source),
+                    table=table,
+                    estimated_rows=self._table_rows.get(table, 0),
+                )
+            return plan
+
+    def source_for(self, query: AggregateQuery, cursor, version) -> Optional[Rollup]:
+        """Menor rollup que cobre a query (sem considerar os rankings)."""
+        with self._lock:
+            if version is None or version != self._version:
+                self._load_catalog(cursor, version)
+            return self.choose_source(query)
+
+    def compile(self, query: AggregateQuery, cursor, version) -> str:
+        return self.plan(query, cursor, version).sql
+
+    def table_rows(self, cursor, version) -> dict:
+        """Tamanho estimado (linhas) de cada tabela do mart."""
+        with self._lock:
+            if version is None or version != self._version:
+                self._load_catalog(cursor, version)
+            return dict(self._table_rows)
+
+
+aggregate_router = AggregateRouter()
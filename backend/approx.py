@@ -0,0 +1,166 @@
+"""
+Respostas aproximadas (?approx=true) a partir de uma amostra estratificada.
+
+O ETL guarda em 'smp_sales' uma amostra de fct_sales estratificada por
+loja × mês (a mesma fração em cada estrato, com um mínimo de linhas por
+estrato) e em 'smp_sales_strata' o tamanho de cada estrato na população
+e na amostra.
+
+Os totais são estimados com peso N_h / n_h por estrato e vêm com a margem
+de erro de 95% (amostragem estratificada sem reposição). Médias são
+estimadas como razão de dois totais (linearização).
+"""
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from star import denormalized_sql
+
+SAMPLE_TABLE = "smp_sales"
+STRATA_TABLE = "smp_sales_strata"
+STRATA = ("store_name", "mes_ano")
+
+# Fração amostrada em cada estrato e mínimo de linhas por estrato (ETL)
+SAMPLE_RATE = float(os.getenv("SAMPLE_RATE", "0.02"))
+SAMPLE_MIN_PER_STRATUM = int(os.getenv("SAMPLE_MIN_PER_STRATUM", "30"))
+
+Z_95 = 1.96
+
+
+def build_sample_sql(rate: float = SAMPLE_RATE, min_per_stratum: int = SAMPLE_MIN_PER_STRATUM) -> list:
+    """SQL que (re)cria a amostra e a tabela de estratos a partir de fct_sales (com os nomes)."""
+    sales = denormalized_sql("fct_sales")
+    strata = ", ".join(STRATA)
+    sample_size = f"LEAST(n_population, GREATEST(CEIL(n_population * {float(rate)}), {int(min_per_stratum)}))"
+    return [
+        f"""
+        CREATE OR REPLACE TABLE {STRATA_TABLE} AS
+        SELECT
+            {strata},
+            COUNT(*) AS n_population,
+            CAST({sample_size} AS BIGINT) AS n_sample,
+            {float(rate)} AS sample_rate
+        FROM {sales} AS f
+        GROUP BY {strata};
+        """,
+        # Amostra determinística: as primeiras n_sample vendas de cada
+        # estrato na ordem de hash(sale_id)
+        f"""
+        CREATE OR REPLACE TABLE {SAMPLE_TABLE} AS
+        SELECT f.* EXCLUDE (rn)
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY {strata} ORDER BY hash(sale_id)) AS rn
+            FROM {sales} AS s
+        ) f
+        JOIN {STRATA_TABLE} st USING ({strata})
+        WHERE f.rn <= st.n_sample
+        ORDER BY {strata};
+        """,
+    ]
+
+
+@dataclass(frozen=True)
+class Total:
+    """Total estimado de 'expr' (por linha da amostra; '1' conta linhas)."""
+    alias: str
+    expr: str
+
+
+@dataclass(frozen=True)
+class Ratio:
+    """Média estimada: total de 'numerator' / total de 'denominator'."""
+    alias: str
+    numerator: str
+    denominator: str
+
+
+@dataclass(frozen=True)
+class EstimateQuery:
+    dimension: str
+    measures: tuple
+    where: str = ""
+    having: str = ""
+    order_by: str = ""
+    limit: Optional[int] = None
+
+
+def _variance(n_sum: str, sq_sum: str) -> str:
+    """Variância do total estimado, somada sobre os estratos."""
+    return (f"SUM(big_n * big_n * (1 - small_n / big_n) "
+            f"* ({sq_sum} - ({n_sum}) * ({n_sum}) / small_n) / GREATEST(small_n - 1, 1) / small_n)")
+
+
+def compile_estimate(query: EstimateQuery) -> str:
+    """
+    SQL da estimativa: uma coluna por métrica (estimativa pontual, com o
+    mesmo nome do relatório exato) + '<métrica>_margem_erro' (±, 95%).
+    """
+    variables = {}  # expressão -> nome da variável (v0, v1, ...)
+    for m in query.measures:
+        for expr in ((m.expr,) if isinstance(m, Total) else (m.numerator, m.denominator)):
+            variables.setdefault(expr, f"v{len(variables)}")
+    ratios = [m for m in query.measures if isinstance(m, Ratio)]
+
+    # 1) Somas por estrato (e por grupo do relatório)
+    sums = [f"SUM({expr}) AS s_{v}, SUM(({expr}) * ({expr})) AS q_{v}" for expr, v in variables.items()]
+    sums += [
+        f"SUM(({m.numerator}) * ({m.denominator})) AS c_{variables[m.numerator]}_{variables[m.denominator]}"
+        for m in ratios
+    ]
+    strata = ", ".join(STRATA)
+    groups = ", ".join(dict.fromkeys((query.dimension, *STRATA)))
+    sql = f"""
+    WITH per_stratum AS (
+        SELECT {groups}, {", ".join(sums)}
+        FROM {SAMPLE_TABLE}
+        {f"WHERE {query.where}" if query.where else ""}
+        GROUP BY {groups}
+    ),
+    weighted AS (
+        SELECT p.*, CAST(st.n_population AS DOUBLE) AS big_n, CAST(st.n_sample AS DOUBLE) AS small_n
+        FROM per_stratum p
+        JOIN {STRATA_TABLE} st USING ({strata})
+    ),"""
+
+    # 2) Totais estimados por grupo
+    totals = [f"SUM(big_n / small_n * s_{v}) AS t_{v}" for v in variables.values()]
+    sql += f"""
+    totals AS (
+        SELECT {query.dimension}, {", ".join(totals)}
+        FROM weighted
+        GROUP BY {query.dimension}
+    )"""
+
+    # 3) Estimativas + margens de erro
+    select = []
+    margins = []
+    for m in query.measures:
+        if isinstance(m, Total):
+            v = variables[m.expr]
+            select.append(f"ANY_VALUE(t.t_{v}) AS {m.alias}")
+            margins.append(f"{Z_95} * SQRT({_variance(f's_{v}', f'q_{v}')}) AS {m.alias}_margem_erro")
+        else:
+            y, x = variables[m.numerator], variables[m.denominator]
+            r = f"(t.t_{y} / NULLIF(t.t_{x}, 0))"
+            select.append(f"ANY_VALUE({r}) AS {m.alias}")
+            # z = y - R·x  =>  Σz = s_y - R·s_x ; Σz² = q_y - 2R·c_xy + R²·q_x
+            z_sum = f"(s_{y} - {r} * s_{x})"
+            z_sq = f"(q_{y} - 2 * {r} * c_{y}_{x} + {r} * {r} * q_{x})"
+            margins.append(
+                f"{Z_95} * SQRT({_variance(z_sum, z_sq)}) / NULLIF(ANY_VALUE(t.t_{x}), 0) AS {m.alias}_margem_erro"
+            )
+
+    sql += f"""
+    SELECT
+        w.{query.dimension},
+        {", ".join(select + margins)}
+    FROM weighted w
+    JOIN totals t USING ({query.dimension})
+    GROUP BY w.{query.dimension}"""
+    if query.having:
+        sql += f"\n    HAVING {query.having}"
+    if query.order_by:
+        sql += f"\n    ORDER BY {query.order_by}"
+    if query.limit is not None:
+        sql += f"\n    LIMIT {int(query.limit)}"
+    return sql + ";"
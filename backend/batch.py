@@ -0,0 +1,111 @@
+"""
+Execução em lote (/api/v2/batch).
+
+Os relatórios do lote são agrupados pela tabela que o AggregateRouter
+escolheu para cada um. Quando dois ou mais relatórios do mesmo grupo
+filtram pelos mesmos valores (ex.: a mesma loja), a tabela é varrida UMA
+vez para uma tabela temporária com esse recorte e cada relatório agrega
+em cima dela. Grupos diferentes rodam em paralelo, em cursores separados.
+"""
+import itertools
+import os
+from dataclasses import dataclass, replace
+from typing import Dict, List, Union
+
+from pydantic import BaseModel, Field
+
+from aggregates import FACTS, ROLLUPS_BY_TABLE, AggregateQuery, QueryPlan, filter_parts, compile_aggregate
+from star import denormalized_sql
+
+BATCH_MAX_REPORTS = int(os.getenv("BATCH_MAX_REPORTS", "20"))
+
+_scan_ids = itertools.count(1)
+
+
+class BatchReport(BaseModel):
+    report: str
+    params: Dict[str, Union[str, int, float]] = {}
+
+
+class BatchRequest(BaseModel):
+    reports: List[BatchReport] = Field(..., min_length=1, max_length=BATCH_MAX_REPORTS)
+
+
+@dataclass
+class BatchItem:
+    index: int
+    query_name: str
+    query: AggregateQuery
+    params: list
+    plan: QueryPlan = None
+
+
+def _equality_filters(item: BatchItem) -> set:
+    """Pares (dimensão, valor) dos filtros de igualdade do item."""
+    pairs = set()
+    values = iter(item.params)
+    for flt in item.query.filters:
+        dimension, op, n_values = filter_parts(flt)
+        taken = [next(values) for _ in range(n_values)]
+        if op == "=":
+            pairs.add((dimension, taken[0]))
+    return pairs
+
+
+def group_by_source(items: list) -> list:
+    """Agrupa os itens (já planejados) pela tabela que vão ler."""
+    groups = {}
+    for item in items:
+        groups.setdefault((item.query.fact, item.plan.table), []).append(item)
+    return list(groups.values())
+
+
+def _residual(item: BatchItem, shared: set) -> tuple:
+    """Query e parâmetros do item sem os filtros já aplicados no recorte."""
+    filters, params = [], []
+    values = iter(item.params)
+    for flt in item.query.filters:
+        dimension, op, n_values = filter_parts(flt)
+        taken = [next(values) for _ in range(n_values)]
+        if op == "=" and (dimension, taken[0]) in shared:
+            continue
+        filters.append(flt)
+        params.extend(taken)
+    return replace(item.query, filters=tuple(filters)), params
+
+
+def execute_group(cursor, group: list, run) -> dict:
+    """
+    Executa um grupo no cursor dado e devolve {index: resultado}.
+    'run(cursor, sql, params, local=False)' executa uma query e devolve o
+    resultado; local=True quando ela lê a tabela temporária do recorte.
+    """
+    shared = set.intersection(*(_equality_filters(item) for item in group)) if len(group) > 1 else set()
+    # Leituras por chave (ex.: rank_products) já são baratas: sem recorte
+    source_table = group[0].plan.table
+    if source_table not in ROLLUPS_BY_TABLE and source_table != FACTS[group[0].query.fact].table:
+        shared = set()
+    if not shared:
+        return {item.index: run(cursor, item.plan.sql, item.params) for item in group}
+
+    # Uma varredura só: o recorte comum vai para uma tabela temporária
+    fact = FACTS[group[0].query.fact]
+    scan_table = f"batch_scan_{next(_scan_ids)}"
+    shared_filters = sorted(shared, key=str)
+    where = " AND ".join(f"{fact.dimensions[dimension]} = ?" for dimension, _ in shared_filters)
+    # O fato guarda chaves: o recorte leva os nomes (como os rollups)
+    scan_source = denormalized_sql(source_table) if source_table == fact.table else source_table
+    cursor.execute(
+        f"CREATE TEMP TABLE {scan_table} AS SELECT * FROM {scan_source} AS f WHERE {where}",
+        [value for _, value in shared_filters],
+    )
+    try:
+        results = {}
+        rollup = ROLLUPS_BY_TABLE.get(source_table)
+        for item in group:
+            query, params = _residual(item, shared)
+            sql = compile_aggregate(query, source=rollup, table=scan_table)
+            results[item.index] = run(cursor, sql, params, local=True)
+        return results
+    finally:
+        cursor.execute(f"DROP TABLE IF EXISTS {scan_table}")
@@ -0,0 +1,64 @@
+"""
+Benchmark: clientes únicos via sketches HLL x COUNT(DISTINCT) exato.
+
+Uso: python bench_hll.py [arquivo.duckdb]
+
+Para cada recorte (total, por loja, por canal, por mês) mede o tempo das
+duas consultas e o erro relativo da estimativa, e confere se está dentro
+do erro esperado do HLL. Também compara o tamanho da tabela de sketches
+com o de uma tabela exata de pares (célula, cliente) distintos.
+"""
+import sys
+import time
+
+import duckdb
+
+import hll
+from star import denormalized_sql
+
+
+def _timed(conn, sql: str, params: list) -> tuple:
+    start = time.perf_counter()
+    rows = conn.execute(sql, params).fetchall()
+    return rows, (time.perf_counter() - start) * 1000
+
+
+def main():
+    duckdb_file = sys.argv[1] if len(sys.argv) > 1 else "analytics.duckdb"
+    conn = duckdb.connect(database=duckdb_file, read_only=True)
+
+    print(f"HLL p={hll.HLL_PRECISION}: erro padrão relativo esperado {hll.HLL_RELATIVE_ERROR:.2%}")
+    sketch_rows = conn.execute(f"SELECT COUNT(*) FROM {hll.HLL_TABLE}").fetchone()[0]
+    pair_rows = conn.execute(f"""
+        SELECT COUNT(*) FROM (
+            SELECT DISTINCT {", ".join(hll.HLL_CELL)}, customer_id
+            FROM {denormalized_sql("fct_sales")} AS f WHERE customer_id IS NOT NULL
+        )
+    """).fetchone()[0]
+    if pair_rows:
+        print(f"linhas: sketches {sketch_rows}, pares (célula, cliente) exatos {pair_rows} "
+              f"({sketch_rows / pair_rows:.1%})")
+    print(f"{'recorte':<14}{'grupos':>8}{'hll ms':>10}{'exato ms':>10}{'erro médio':>12}{'erro máx':>10}{'> 2σ':>6}")
+
+    for group_by in (None, *hll.HLL_GROUPS):
+        approx, approx_ms = _timed(conn, hll.compile_unique_customers(group_by, []), [])
+        exact, exact_ms = _timed(conn, hll.compile_exact_unique_customers(group_by, []), [])
+
+        exact_by_group = {row[:-1]: row[-1] for row in exact}
+        errors = [
+            abs(row[-2] - exact_by_group[row[:-2]]) / exact_by_group[row[:-2]]
+            for row in approx
+            if exact_by_group.get(row[:-2])
+        ]
+        if not errors:
+            print(f"{group_by or 'total':<14}{0:>8}{approx_ms:>10.1f}{exact_ms:>10.1f}{'-':>12}{'-':>10}{'-':>6}")
+            continue
+        outside = sum(e > 2 * hll.HLL_RELATIVE_ERROR for e in errors)
+        print(f"{group_by or 'total':<14}{len(errors):>8}{approx_ms:>10.1f}{exact_ms:>10.1f}"
+              f"{sum(errors) / len(errors):>12.2%}{max(errors):>10.2%}{outside:>6}")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# --- Configuração do Cache de Relatórios ---
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "512"))
+REPORT_CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Cache HTTP (ETag) dos relatórios: max-age em segundos (0 = sempre revalidar)
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "0"))
+HTTP_CACHE_CONTROL = f"private, max-age={HTTP_CACHE_MAX_AGE}, must-revalidate"
+
+MISS = object()
+
+
+def make_etag(version: str, path: str, query: str, accept: str = "") -> str:
+    """ETag fraca: versão do mart + URL (parâmetros ordenados) + Accept."""
+    params = "&".join(sorted(query.split("&"))) if query else ""
+    digest = hashlib.blake2b(f"{version}|{path}|{params}|{accept}".encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """O If-None-Match do cliente contém a ETag atual?"""
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+def _estimate_size(value) -> int:
+    """Tamanho aproximado do resultado (em bytes do JSON)."""
+    if hasattr(value, "approx_bytes"):
+        return value.approx_bytes()
+    if isinstance(value, tuple):
+        return sum(_estimate_size(item) for item in value)
+    return len(json.dumps(value, default=str))
+
+
+class ResultCache:
+    """
+    Cache LRU (em processo) dos resultados dos relatórios.
+
+    As entradas valem para UMA versão do Data Mart: quando o ETL publica
+    uma versão nova, o cache inteiro é descartado.
+    """
+
+    def __init__(self, max_entries: int = REPORT_CACHE_MAX_ENTRIES, max_bytes: int = REPORT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (valor, tamanho)
+        self._bytes = 0
+        self.version = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+            self.version = version
+
+    def get(self, key, version):
+        """Retorna o valor guardado ou MISS. 'version' None = não usar cache."""
+        with self._lock:
+            if version is None:
+                self.misses += 1
+                return MISS
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISS
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, version, value):
+        if version is None:
+            return
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._check_version(version)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "mart_version": self.version,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+report_cache = ResultCache()
@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+from typing import Optional
+
+import duckdb
+
+from metrics import logger, phase
+
+# --- Configuração do Data Mart ---
+DUCKDB_FILE = os.getenv("DUCKDB_FILE", "analytics.duckdb")
+
+# Se ligado, o mart é copiado para um DuckDB em memória na abertura
+# (servimos só leitura, então o arquivo não precisa ficar "preso").
+DUCKDB_IN_MEMORY = os.getenv("DUCKDB_IN_MEMORY", "false").lower() in ("1", "true", "yes")
+
+# Se o arquivo mudou mas não pôde ser reaberto (ETL rodando), espera
+# esse tempo (s) antes de tentar de novo.
+REOPEN_RETRY_SECONDS = float(os.getenv("DUCKDB_REOPEN_RETRY_SECONDS", "2"))
+
+# Versão do mart: uma entrada 'tabela@versão' por tabela carregada pelo ETL
+MART_VERSION_SQL = """
+    SELECT string_agg(table_name || '@' || version, ',' ORDER BY table_name)
+    FROM mart_version
+"""
+
+
+class MartConnection:
+    """
+    Conexão única (por processo) com o Data Mart.
+
+    O arquivo é aberto UMA vez e cada thread recebe o seu próprio cursor
+    (no DuckDB um cursor é uma conexão filha que compartilha o mesmo
+    banco, o buffer cache e o catálogo já carregado).
+
+    Quando o ETL publica uma geração nova (o link DUCKDB_FILE passa a
+    apontar para outro arquivo, ver publish.py), a conexão é reaberta no
+    próximo uso; as queries em andamento terminam no arquivo anterior.
+    """
+
+    def __init__(self, database_file: str = DUCKDB_FILE, in_memory: bool = DUCKDB_IN_MEMORY):
+        self.database_file = database_file
+        self.in_memory = in_memory
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._conn: Optional[duckdb.DuckDBPyConnection] = None
+        self._file_signature = None
+        self._generation = 0
+        self._retry_at = 0.0
+        self.version: Optional[str] = None
+        self.served_file: Optional[str] = None
+
+    def _current_signature(self, path: Optional[str] = None):
+        """Identifica a "versão" do arquivo em disco (inode + mtime, seguindo o link)."""
+        try:
+            stat = os.stat(path or self.database_file)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _open(self, path: str) -> duckdb.DuckDBPyConnection:
+        # O arquivo é anexado a uma instância nova (em memória) em vez de
+        # duckdb.connect(arquivo): o connect reaproveita a instância já
+        # aberta para o mesmo caminho e continuaria lendo o arquivo antigo
+        # depois que o ETL o substitui.
+        conn = duckdb.connect(database=":memory:")
+        path = path.replace("'", "''")
+        conn.execute(f"ATTACH '{path}' AS mart_file (READ_ONLY)")
+
+        if not self.in_memory:
+            conn.execute("USE mart_file")
+            return conn
+
+        # Espelho em memória: copia todas as tabelas e solta o arquivo.
+        conn.execute("COPY FROM DATABASE mart_file TO memory")
+        conn.execute("DETACH mart_file")
+        return conn
+
+    def _read_version(self, conn: duckdb.DuckDBPyConnection, signature) -> str:
+        """
+        Versão publicada pelo ETL (tabela 'mart_version'). Marts antigos,
+        sem essa tabela, usam a assinatura do arquivo como versão.
+        """
+        try:
+            row = conn.execute(MART_VERSION_SQL).fetchone()
+            if row and row[0]:
+                return row[0]
+        except duckdb.Error:
+            pass
+        return f"file-{signature[0]}-{signature[1]}" if signature else "file"
+
+    def _needs_reopen(self, signature) -> bool:
+        if self._conn is None:
+            return True
+        if signature == self._file_signature:
+            return False
+        # O arquivo mudou. Se a última tentativa falhou há pouco, espera.
+        return time.monotonic() >= self._retry_at
+
+    def _ensure_open(self):
+        signature = self._current_signature()
+        if not self._needs_reopen(signature):
+            return
+
+        with self._lock:
+            if not self._needs_reopen(signature):
+                return
+            # O link é resolvido uma vez: a conexão fica presa a ESSA
+            # geração mesmo que o ETL troque o link logo em seguida.
+            path = os.path.realpath(self.database_file)
+            signature = self._current_signature(path)
+            try:
+                with phase("connect"):
+                    conn = self._open(path)
+                    version = self._read_version(conn, signature)
+            except duckdb.Error as e:
+                # Ex.: o ETL ainda está escrevendo o arquivo novo (lock).
+                # Seguimos servindo a versão antiga enquanto ela existir.
+                if self._conn is None:
+                    raise
+                self._retry_at = time.monotonic() + REOPEN_RETRY_SECONDS
+                logger.warning(f"não foi possível reabrir o Data Mart ({e}). Usando a versão anterior.")
+                return
+
+            # A conexão antiga NÃO é fechada aqui: fechar a conexão-mãe
+            # derruba os cursores de queries que ainda estão rodando.
+            # Ela é liberada quando o último cursor antigo for descartado.
+            self._conn = conn
+            self._file_signature = signature
+            self.served_file = path
+            self._generation += 1
+            self._retry_at = 0.0
+            self.version = version
+
+    def file_signature(self):
+        """Assinatura (inode, mtime) do arquivo do mart em disco, ou None."""
+        return self._current_signature()
+
+    def current_version(self) -> Optional[str]:
+        """
+        Versão do mart que está sendo servida, ou None se o arquivo em
+        disco mudou e a conexão ainda vai ser reaberta.
+        Não abre nada: só um os.stat, pode ser chamado no event loop.
+        """
+        if self._needs_reopen(self._current_signature()):
+            return None
+        return self.version
+
+    def cursor(self) -> duckdb.DuckDBPyConnection:
+        """Retorna o cursor do thread atual (criado sob demanda)."""
+        self._ensure_open()
+        local = self._local
+        if getattr(local, "generation", None) != self._generation:
+            with phase("connect"):
+                cursor = self._conn.cursor()
+                if not self.in_memory:
+                    cursor.execute("USE mart_file")
+            local.cursor = cursor
+            local.generation = self._generation
+            local.version = self.version
+        return local.cursor
+
+    def new_cursor(self) -> duckdb.DuckDBPyConnection:
+        """
+        Cursor exclusivo (não é o do thread), para leituras longas que
+        passam por vários threads, como a exportação. Quem pede fecha.
+        """
+        self._ensure_open()
+        with phase("connect"):
+            cursor = self._conn.cursor()
+            if not self.in_memory:
+                cursor.execute("USE mart_file")
+        return cursor
+
+    def cursor_version(self) -> Optional[str]:
+        """Versão do mart vista pelo cursor do thread atual."""
+        return getattr(self._local, "version", None)
+
+    def execute(self, query: str, params: Optional[list] = None):
+        """Executa a query no cursor do thread atual."""
+        return self.cursor().execute(query, params or [])
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = None
+            self._file_signature = None
+            self.served_file = None
+            self._generation += 1
+            self.version = None
+
+
+mart = MartConnection()
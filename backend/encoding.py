@@ -0,0 +1,210 @@
+import contextvars
+import decimal
+import json
+import time
+from typing import Optional
+
+from fastapi import Header, HTTPException, Query
+from fastapi.responses import Response
+
+from metrics import phase, record_rows
+from slowlog import slow_queries
+
+try:
+    import orjson
+except ImportError:  # Sem orjson: cai no json da biblioteca padrão
+    orjson = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # Sem pyarrow: o formato Arrow fica indisponível
+    pa = None
+
+# --- Formatos de Resposta ---
+# records  -> [{"coluna": valor, ...}, ...]              (padrão, o que o frontend usa)
+# columnar -> {"columns": [...], "data": [[...], ...]}  (uma lista por linha, sem repetir as chaves)
+# arrow    -> Arrow IPC stream                           (para clientes que leem Arrow)
+FORMAT_RECORDS = "records"
+FORMAT_COLUMNAR = "columnar"
+FORMAT_ARROW = "arrow"
+
+MEDIA_TYPES = {
+    FORMAT_RECORDS: "application/json",
+    FORMAT_COLUMNAR: "application/vnd.analytics.columnar+json",
+    FORMAT_ARROW: "application/vnd.apache.arrow.stream",
+}
+
+# Formato pedido pela requisição atual (definido por response_format). Com
+# Arrow, o resultado fica na tabela Arrow que o DuckDB entrega, sem passar
+# por tuplas Python.
+result_format: contextvars.ContextVar = contextvars.ContextVar("result_format", default=FORMAT_RECORDS)
+
+
+def _python_values(column) -> list:
+    """Valores de uma coluna Arrow como o fetchall() os entregaria."""
+    values = column.to_pylist()
+    # HUGEINT (ex.: SUM de inteiros) vira decimal(38, 0) no Arrow; no fetchall é int
+    if pa.types.is_decimal(column.type) and column.type.scale == 0:
+        return [None if v is None else int(v) for v in values]
+    return values
+
+
+def arrow_table(cursor):
+    """
+    Resultado do cursor como pyarrow.Table. O .arrow() do DuckDB devolve a
+    tabela nas versões antigas e um RecordBatchReader nas recentes.
+    """
+    result = cursor.arrow()
+    return result.read_all() if isinstance(result, pa.RecordBatchReader) else result
+
+
+class QueryResult:
+    """
+    Resultado "cru" de uma query: nomes das colunas + linhas (tuplas),
+    exatamente como o DuckDB entrega no fetchall(). Sem pandas.
+    Se a requisição pediu Arrow, guarda a tabela Arrow do DuckDB ('table');
+    as tuplas só são montadas se o resultado for pedido em JSON depois
+    (ex.: por outra requisição, via cache).
+    """
+
+    __slots__ = ("columns", "_rows", "table")
+
+    def __init__(self, columns: list, rows: Optional[list] = None, table=None):
+        self.columns = columns
+        self._rows = rows
+        self.table = table
+
+    @property
+    def rows(self) -> list:
+        if self._rows is None:
+            self._rows = list(zip(*(_python_values(column) for column in self.table.columns)))
+        return self._rows
+
+    @classmethod
+    def from_cursor(cls, cursor) -> "QueryResult":
+        with phase("fetch"):
+            if result_format.get() == FORMAT_ARROW and pa is not None:
+                table = arrow_table(cursor)
+                return cls(table.column_names, table=table)
+            rows = cursor.fetchall()
+        return cls([d[0] for d in cursor.description], rows)
+
+    @classmethod
+    def run(cls, cursor, sql: str, params: Optional[list] = None, profile_cursor=None) -> "QueryResult":
+        """
+        Executa a query no cursor e busca o resultado (fases execute + fetch).
+        'profile_cursor' abre outro cursor no mesmo banco, onde o log de
+        queries lentas pode reexecutá-la (None = a query não é reexecutável).
+        """
+        start = time.perf_counter()
+        with phase("execute"):
+            cursor.execute(sql, params or [])
+        result = cls.from_cursor(cursor)
+        slow_queries.observe(sql, params, (time.perf_counter() - start) * 1000, len(result), profile_cursor)
+        return result
+
+    def records(self) -> list:
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in self.rows]
+
+    def __len__(self):
+        return self.table.num_rows if self._rows is None else len(self._rows)
+
+    def approx_bytes(self) -> int:
+        """Tamanho aproximado (usado pelo cache)."""
+        if self._rows is None:
+            return self.table.nbytes
+        return len(dumps({"columns": self.columns, "data": self._rows}))
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(value).__name__}")
+
+
+def dumps(value) -> bytes:
+    """JSON rápido (orjson) com fallback para o json padrão."""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def to_arrow_ipc(result: QueryResult) -> bytes:
+    if pa is None:
+        raise HTTPException(status_code=406, detail="Formato Arrow indisponível: instale 'pyarrow' no servidor.")
+    table = result.table
+    if table is None:
+        # Resultado buscado em tuplas (pedido antes em JSON, snapshot)
+        table = pa.Table.from_pydict({
+            column: [row[i] for row in result.rows]
+            for i, column in enumerate(result.columns)
+        })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+async def response_format(
+    format: Optional[str] = Query(None, description="records (padrão), columnar ou arrow"),
+    accept: Optional[str] = Header(None),
+) -> str:
+    """
+    Dependência: escolhe o formato pela query (?format=) ou pelo Accept.
+    O padrão continua sendo 'records' (lista de objetos). É async para o
+    formato (result_format) valer no contexto do endpoint.
+    """
+    fmt = _requested_format(format, accept)
+    result_format.set(fmt)
+    return fmt
+
+
+def _requested_format(format: Optional[str], accept: Optional[str]) -> str:
+    if format:
+        if format not in MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail=f"Formato inválido: '{format}'. Use records, columnar ou arrow.")
+        return format
+    if accept:
+        for fmt in (FORMAT_ARROW, FORMAT_COLUMNAR):
+            if MEDIA_TYPES[fmt] in accept:
+                return fmt
+    return FORMAT_RECORDS
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> set:
+    """Codificações aceitas pelo cliente no Accept-Encoding (ignora as com q=0)."""
+    accepted = {"identity"}
+    for token in (accept_encoding or "").split(","):
+        name, *params = token.split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name.strip() and q > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def json_payload(result: QueryResult, fmt: str = FORMAT_RECORDS):
+    """O resultado como objeto JSON: lista de registros ou colunar."""
+    if fmt == FORMAT_COLUMNAR:
+        return {"columns": result.columns, "data": result.rows}
+    return result.records()
+
+
+def encode_response(result: QueryResult, fmt: str = FORMAT_RECORDS) -> Response:
+    """Serializa o resultado no formato pedido."""
+    record_rows(len(result))
+    with phase("encode"):
+        if fmt == FORMAT_ARROW:
+            body = to_arrow_ipc(result)
+        else:
+            body = dumps(json_payload(result, fmt))
+    return Response(content=body, media_type=MEDIA_TYPES[fmt])
@@ -1,9 +1,22 @@
 import os
+import time
+from datetime import datetime
+from typing import Optional
 import duckdb
 import pandas as pd
 import psycopg2
 from dotenv import load_dotenv
 
+from aggregates import RANKING_TABLE, RANKING_TOP_K, ROLLUPS, build_ranking_sql, build_rollup_sql
+from hll import HLL_PRECISION, HLL_TABLE, build_hll_sql
+from approx import SAMPLE_RATE, SAMPLE_TABLE, STRATA_TABLE, build_sample_sql
+from database import DUCKDB_FILE as MART_LINK, MART_VERSION_SQL
+from lake import LAKE_DIR, LAKE_ENABLED, write_lake
+from publish import MART_DIR, InvalidMartError, collect_garbage, discard, generation_path, publish, validate_mart
+from shards import MART_SHARDS, SHARD_MAP_TABLE, SHARDED_TABLES, shard_of, shard_path
+from snapshots import SNAPSHOT_DIR, render_snapshots
+from star import DIM_STORE, DIMENSIONS, DIMENSION_TABLES, FACT_DIMENSIONS, build_star_sql, duplicate_keys_sql
+
 # --- QUERY 1 OTIMIZADA: FCT_SALES (Grão: Venda) ---
 FCT_SALES_QUERY = """
 WITH 
@@ -53,8 +66,10 @@ sales_base AS (
         s.delivery_seconds,
 
         -- Dimensões
+        s.store_id,
         st.name AS store_name,
         st.city AS store_city,
+        s.channel_id,
         ch.name AS channel_name,
         ch.type AS channel_type,
         s.customer_id,
@@ -117,7 +132,9 @@ sales_dims AS (
         s.created_at AS sale_created_at,
         TO_CHAR(s.created_at, 'YYYY-MM') AS mes_ano,
         DATE(s.created_at) AS data_venda,
+        s.store_id,
         st.name AS store_name,
+        s.channel_id,
         ch.name AS channel_name,
         ch.type AS channel_type,
         da.neighborhood AS delivery_neighborhood
@@ -145,11 +162,81 @@ JOIN
 ;
 """
 
-def process_etl_in_chunks(db_url: str, duckdb_file: str, query: str, table_name: str, chunk_size: int = 100000):
+# --- QUERY 3: DIM_CUSTOMERS (Grão: Cliente) ---
+# Nome e contato vêm para o mart: o relatório de clientes não precisa
+# mais ir ao Postgres a cada requisição.
+DIM_CUSTOMERS_QUERY = """
+SELECT
+    id AS customer_id,
+    customer_name AS nome_cliente,
+    COALESCE(phone_number, email) AS contato
+FROM customers;
+"""
+
+# --- CUSTOMER_RFM (Recência, Frequência, Valor), calculada no DuckDB ---
+# Cliente "em risco": 3+ compras e nenhuma nos últimos 30 dias (na data do ETL).
+CUSTOMER_RFM_SQL = """
+CREATE OR REPLACE TABLE customer_rfm AS
+WITH stats AS (
+    SELECT
+        customer_id,
+        COUNT(sale_id) AS total_vendas,
+        SUM(sale_total_amount) AS valor_total,
+        MAX(DATE(sale_created_at)) AS ultima_compra_data
+    FROM fct_sales
+    WHERE customer_id IS NOT NULL
+    GROUP BY customer_id
+)
+SELECT
+    s.customer_id,
+    c.nome_cliente,
+    c.contato,
+    s.total_vendas,
+    s.valor_total,
+    s.ultima_compra_data
+FROM stats s
+JOIN dim_customers c ON s.customer_id = c.customer_id
+ORDER BY s.total_vendas DESC, s.customer_id;
+"""
+
+def record_mart_version(conn_duckdb, table_name: str, mart_version: str, row_count: int):
+    """
+    Registra na tabela 'mart_version' que 'table_name' foi carregada nesta
+    versão. A API usa essa tabela para invalidar o cache de relatórios.
+    """
+    conn_duckdb.execute("""
+        CREATE TABLE IF NOT EXISTS mart_version (
+            table_name VARCHAR PRIMARY KEY,
+            version VARCHAR NOT NULL,
+            row_count BIGINT,
+            loaded_at TIMESTAMP DEFAULT current_timestamp
+        )
+    """)
+    conn_duckdb.execute("DELETE FROM mart_version WHERE table_name = ?", [table_name])
+    conn_duckdb.execute(
+        "INSERT INTO mart_version (table_name, version, row_count) VALUES (?, ?, ?)",
+        [table_name, mart_version, row_count]
+    )
+
+def _add_stage(stats: Optional[dict], stage: str, seconds: float, rows: int = 0, nbytes: int = 0):
+    """Acumula tempo, linhas e bytes de uma etapa do ETL em 'stats' (modo benchmark)."""
+    if stats is None:
+        return
+    entry = stats.setdefault("stages", {}).setdefault(stage, {"seconds": 0.0, "rows": 0, "bytes": 0})
+    entry["seconds"] += seconds
+    entry["rows"] += rows
+    entry["bytes"] += nbytes
+
+def process_etl_in_chunks(db_url: str, duckdb_file: str, query: str, table_name: str, chunk_size: int = 100000,
+                          mart_version: Optional[str] = None, stats: Optional[dict] = None):
     """
-    (Esta função está 100% CORRETA e NÃO MUDA)
     Executa o ETL processando os dados em "chunks" (pedaços)
     para evitar o esgotamento de memória RAM.
+    Ao final, grava a linha de versão da tabela em 'mart_version'.
+
+    Se 'stats' for passado (etl_bench.py), acumula nele o tempo, as linhas
+    e os bytes de cada etapa: extract (Postgres -> tuplas), to_pandas
+    (tuplas -> DataFrame), duckdb_insert e verify.
     """
     print(f"\nIniciando processamento para: {table_name}")
     
@@ -164,20 +251,35 @@ def process_etl_in_chunks(db_url: str, duckdb_file: str, query: str, table_name:
         
         print(f"Iniciando extração em chunks de {chunk_size} linhas...")
         
-        chunk_iterator = pd.read_sql_query(
-            query,
-            conn_pg,
-            chunksize=chunk_size
-        )
+        # Cursor nomeado (do lado do servidor): o Postgres entrega um chunk
+        # por vez em vez de mandar o resultado inteiro para a memória
+        cursor_pg = conn_pg.cursor(name=f"etl_{table_name}")
+        cursor_pg.itersize = chunk_size
+        start = time.perf_counter()
+        cursor_pg.execute(query)
+        _add_stage(stats, "extract", time.perf_counter() - start)
         
         total_rows = 0
+        i = 0
         
-        for i, chunk_df in enumerate(chunk_iterator):
-            if chunk_df.empty:
-                print(f"Chunk {i+1} está vazio. Finalizando.")
+        while True:
+            start = time.perf_counter()
+            rows = cursor_pg.fetchmany(chunk_size)
+            _add_stage(stats, "extract", time.perf_counter() - start, len(rows))
+            if not rows:
                 break
+            
+            start = time.perf_counter()
+            columns = [desc[0] for desc in cursor_pg.description]
+            chunk_df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+            seconds = time.perf_counter() - start
+            del rows
+            _add_stage(stats, "to_pandas", seconds, len(chunk_df),
+                       int(chunk_df.memory_usage(deep=True).sum()) if stats is not None else 0)
+            i += 1
                 
-            print(f"  > Processando Chunk {i+1} ({len(chunk_df)} linhas)...")
+            print(f"  > Processando Chunk {i} ({len(chunk_df)} linhas)...")
+            start = time.perf_counter()
             conn_duckdb.register('chunk_temp', chunk_df)
             
             if is_first_chunk:
@@ -186,21 +288,37 @@ def process_etl_in_chunks(db_url: str, duckdb_file: str, query: str, table_name:
                 is_first_chunk = False
             else:
                 conn_duckdb.execute(f"INSERT INTO {table_name} SELECT * FROM chunk_temp")
-                print(f"  ✓ Chunk {i+1} anexado à tabela '{table_name}'.")
+                print(f"  ✓ Chunk {i} anexado à tabela '{table_name}'.")
+            conn_duckdb.unregister('chunk_temp')
+            _add_stage(stats, "duckdb_insert", time.perf_counter() - start, len(chunk_df))
             
             total_rows += len(chunk_df)
 
+        if stats is not None:
+            stats["rows"] = total_rows
+            stats["chunks"] = i
+
         if total_rows == 0:
              print("Nenhum dado foi processado.")
              return
 
+        start = time.perf_counter()
         count_result = conn_duckdb.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()
         if count_result:
             print(f"✓ Verificação: {count_result[0]} linhas totais na tabela '{table_name}'.")
+        _add_stage(stats, "verify", time.perf_counter() - start, count_result[0] if count_result else 0)
+
+        record_mart_version(
+            conn_duckdb, table_name,
+            mart_version or datetime.now().strftime("%Y%m%d%H%M%S"),
+            count_result[0] if count_result else total_rows
+        )
         
     except Exception as e:
         print(f"\n--- ERRO DURANTE O PROCESSO ETL ({table_name}) ---")
         print(f"Erro: {e}")
+        if stats is not None:
+            stats["error"] = str(e)
     
     finally:
         if conn_pg:
@@ -208,8 +326,252 @@ def process_etl_in_chunks(db_url: str, duckdb_file: str, query: str, table_name:
         if conn_duckdb:
             conn_duckdb.close()
 
-def main():
-    """(Esta função está 100% CORRETA e NÃO MUDA)"""
+class EtlStepError(Exception):
+    """Um passo obrigatório do ETL falhou: a geração não é publicada."""
+
+
+def _run_step(step: str, duckdb_file: str, build, read_only: bool = False, required: bool = True):
+    """
+    Abre o mart, roda 'build(conn_duckdb)' e fecha a conexão. A falha de um
+    passo obrigatório interrompe a geração (EtlStepError); a de um passo
+    opcional só é impressa.
+    """
+    conn_duckdb = None
+
+    try:
+        conn_duckdb = duckdb.connect(database=duckdb_file, read_only=read_only)
+        build(conn_duckdb)
+
+    except Exception as e:
+        print(f"\n--- ERRO AO {step.upper()} ---")
+        print(f"Erro: {e}")
+        if required:
+            raise EtlStepError(f"{step}: {e}") from e
+
+    finally:
+        if conn_duckdb:
+            conn_duckdb.close()
+
+def build_star_schema(duckdb_file: str, mart_version: Optional[str] = None):
+    """
+    Reescreve os fatos carregados no esquema estrela compacto (ver star.py):
+    chaves inteiras no lugar dos nomes, dimensões em dim_*, rótulos como
+    ENUM e tipos numéricos estreitos. Roda antes de tudo que lê os fatos.
+    """
+    print("\nCompactando os fatos (esquema estrela)...")
+    version = mart_version or datetime.now().strftime("%Y%m%d%H%M%S")
+
+    def build(conn_duckdb):
+        fact_columns = {
+            fact_table: [row[0] for row in conn_duckdb.execute(f"DESCRIBE {fact_table}").fetchall()]
+            for fact_table in FACT_DIMENSIONS
+        }
+        for statement in build_star_sql(fact_columns):
+            conn_duckdb.execute(statement)
+        # Uma linha por id: senão o JOIN com a dimensão duplicaria vendas
+        for dim in DIMENSIONS:
+            duplicated = [row[0] for row in conn_duckdb.execute(duplicate_keys_sql(dim)).fetchall()]
+            if duplicated:
+                raise ValueError(f"{dim.table}: ids com mais de uma linha: {duplicated}")
+        for table_name in (*FACT_DIMENSIONS, *DIMENSION_TABLES):
+            row_count = conn_duckdb.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+            record_mart_version(conn_duckdb, table_name, version, row_count)
+        print(f"  ✓ Fatos compactados; dimensões: {', '.join(DIMENSION_TABLES)}.")
+
+    _run_step("compactar os fatos", duckdb_file, build)
+
+def build_rollups(duckdb_file: str, mart_version: Optional[str] = None):
+    """
+    Constrói as tabelas pré-agregadas (rollups) a partir dos fatos já
+    carregados. A API responde cada relatório pelo menor rollup que cobre
+    as suas dimensões e filtros (ver aggregates.py).
+    """
+    print("\nConstruindo rollups (tabelas pré-agregadas)...")
+    version = mart_version or datetime.now().strftime("%Y%m%d%H%M%S")
+
+    def build(conn_duckdb):
+        for rollup in ROLLUPS:
+            conn_duckdb.execute(build_rollup_sql(rollup))
+            row_count = conn_duckdb.execute(f"SELECT COUNT(*) FROM {rollup.table}").fetchone()[0]
+            record_mart_version(conn_duckdb, rollup.table, version, row_count)
+            print(f"  ✓ Rollup '{rollup.table}' criado ({row_count} linhas).")
+
+    _run_step("construir rollups", duckdb_file, build)
+
+def build_rankings(duckdb_file: str, mart_version: Optional[str] = None):
+    """
+    Constrói 'rank_products': top/bottom-K produtos (faturamento e
+    quantidade) por loja, canal, mês e loja × mês. Os relatórios de top
+    produtos viram uma leitura por chave (ver aggregates.py).
+    """
+    print(f"\nConstruindo rankings de produtos (K={RANKING_TOP_K})...")
+    version = mart_version or datetime.now().strftime("%Y%m%d%H%M%S")
+
+    def build(conn_duckdb):
+        conn_duckdb.execute(build_ranking_sql())
+        row_count = conn_duckdb.execute(f"SELECT COUNT(*) FROM {RANKING_TABLE}").fetchone()[0]
+        record_mart_version(conn_duckdb, RANKING_TABLE, version, row_count)
+        print(f"  ✓ Tabela '{RANKING_TABLE}' criada ({row_count} linhas).")
+
+    _run_step("construir os rankings", duckdb_file, build)
+
+def build_customer_rfm(duckdb_file: str, mart_version: Optional[str] = None):
+    """
+    Constrói 'customer_rfm' (uma linha por cliente, já com nome e contato)
+    a partir de fct_sales + dim_customers.
+    """
+    print("\nConstruindo customer_rfm...")
+    version = mart_version or datetime.now().strftime("%Y%m%d%H%M%S")
+
+    def build(conn_duckdb):
+        conn_duckdb.execute(CUSTOMER_RFM_SQL)
+        row_count = conn_duckdb.execute("SELECT COUNT(*) FROM customer_rfm").fetchone()[0]
+        record_mart_version(conn_duckdb, "customer_rfm", version, row_count)
+        print(f"  ✓ Tabela 'customer_rfm' criada ({row_count} clientes).")
+
+    _run_step("construir customer_rfm", duckdb_file, build)
+
+def build_sample(duckdb_file: str, mart_version: Optional[str] = None, rate: float = SAMPLE_RATE):
+    """
+    Constrói a amostra estratificada (loja × mês) de fct_sales usada nas
+    respostas aproximadas (?approx=true). A fração vem de SAMPLE_RATE.
+    """
+    print(f"\nConstruindo amostra estratificada ({rate:.1%} por loja × mês)...")
+    version = mart_version or datetime.now().strftime("%Y%m%d%H%M%S")
+
+    def build(conn_duckdb):
+        for sql in build_sample_sql(rate):
+            conn_duckdb.execute(sql)
+        for table in (STRATA_TABLE, SAMPLE_TABLE):
+            row_count = conn_duckdb.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            record_mart_version(conn_duckdb, table, version, row_count)
+            print(f"  ✓ Tabela '{table}' criada ({row_count} linhas).")
+
+    _run_step("construir a amostra", duckdb_file, build)
+
+def build_hll_sketches(duckdb_file: str, mart_version: Optional[str] = None):
+    """
+    Constrói os sketches HyperLogLog de clientes por loja × dia × canal
+    (ver hll.py). A API conta clientes únicos mesclando esses sketches.
+    """
+    print(f"\nConstruindo sketches HLL de clientes (p={HLL_PRECISION})...")
+    version = mart_version or datetime.now().strftime("%Y%m%d%H%M%S")
+
+    def build(conn_duckdb):
+        conn_duckdb.execute(build_hll_sql())
+        row_count = conn_duckdb.execute(f"SELECT COUNT(*) FROM {HLL_TABLE}").fetchone()[0]
+        record_mart_version(conn_duckdb, HLL_TABLE, version, row_count)
+        print(f"  ✓ Tabela '{HLL_TABLE}' criada ({row_count} registradores).")
+
+    _run_step("construir os sketches HLL", duckdb_file, build)
+
+def build_shards(duckdb_file: str, mart_version: Optional[str] = None, n_shards: int = MART_SHARDS):
+    """
+    Divide os fatos por loja em 'n_shards' arquivos ao lado do mart
+    (ver shards.py), cada um com os seus rollups e rankings, e grava o mapa
+    loja -> shard ('shard_map') no mart completo.
+    """
+    print(f"\nConstruindo {n_shards} shards por loja...")
+    version = mart_version or datetime.now().strftime("%Y%m%d%H%M%S")
+
+    def build(conn_duckdb):
+        stores = [row[0] for row in conn_duckdb.execute(f"SELECT DISTINCT store_name FROM {DIM_STORE.table}").fetchall()]
+        conn_duckdb.execute(f"CREATE OR REPLACE TABLE {SHARD_MAP_TABLE} (store_name VARCHAR, shard INTEGER)")
+        # Loja nula (se houver) fica no shard 0
+        conn_duckdb.executemany(
+            f"INSERT INTO {SHARD_MAP_TABLE} VALUES (?, ?)",
+            [[store, shard_of(store, n_shards) if store is not None else 0] for store in stores],
+        )
+        record_mart_version(conn_duckdb, SHARD_MAP_TABLE, version, len(stores))
+
+        for shard in range(n_shards):
+            shard_file = shard_path(duckdb_file, shard)
+            for leftover in (shard_file, f"{shard_file}.wal"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            quoted_file = shard_file.replace("'", "''")
+            conn_duckdb.execute(f"ATTACH '{quoted_file}' AS shard_db")
+            for table_name in SHARDED_TABLES:
+                conn_duckdb.execute(f"""
+                    CREATE TABLE shard_db.{table_name} AS
+                    SELECT * FROM {table_name}
+                    WHERE {DIM_STORE.key} IN (
+                        SELECT d.{DIM_STORE.key} FROM {DIM_STORE.table} d
+                        JOIN {SHARD_MAP_TABLE} m ON d.store_name IS NOT DISTINCT FROM m.store_name
+                        WHERE m.shard = {shard}
+                    )
+                """)
+            # As dimensões vão inteiras para cada shard (são pequenas)
+            for table_name in DIMENSION_TABLES:
+                conn_duckdb.execute(f"CREATE TABLE shard_db.{table_name} AS SELECT * FROM {table_name}")
+            conn_duckdb.execute("DETACH shard_db")
+
+            conn_shard = duckdb.connect(database=shard_file, read_only=False)
+            try:
+                for table_name in (*SHARDED_TABLES, *DIMENSION_TABLES):
+                    row_count = conn_shard.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+                    record_mart_version(conn_shard, table_name, version, row_count)
+            finally:
+                conn_shard.close()
+
+            # Rollups e rankings do shard (mesmo SQL do mart completo)
+            build_rollups(shard_file, mart_version=version)
+            build_rankings(shard_file, mart_version=version)
+            print(f"  ✓ Shard {shard} criado: {shard_file}")
+
+    _run_step("construir os shards", duckdb_file, build)
+
+def build_snapshots(duckdb_file: str, mart_version: Optional[str] = None, snapshot_dir: str = SNAPSHOT_DIR):
+    """
+    Renderiza os relatórios da página inicial em JSON já comprimido
+    (gzip/brotli) e publica o manifesto em 'snapshot_dir' (ver snapshots.py).
+    Roda por último: o snapshot vale para o arquivo do mart como ele ficou.
+    """
+    print(f"\nRenderizando snapshots do dashboard em '{snapshot_dir}'...")
+    version = mart_version or datetime.now().strftime("%Y%m%d%H%M%S")
+
+    def build(conn_duckdb):
+        stat = os.stat(duckdb_file)
+        api_version = conn_duckdb.execute(MART_VERSION_SQL).fetchone()[0]
+        manifest = render_snapshots(
+            conn_duckdb, version, api_version, (stat.st_ino, stat.st_mtime_ns), snapshot_dir
+        )
+        print(f"  ✓ {len(manifest['reports'])} snapshots publicados (versão {manifest['version']}).")
+
+    # Opcional: o manifesto só vale para o arquivo do mart em que foi
+    # renderizado; sem ele, a API responde esses relatórios pelo DuckDB
+    _run_step("renderizar os snapshots", duckdb_file, build, read_only=True, required=False)
+
+def build_lake(duckdb_file: str, mart_version: Optional[str] = None, lake_dir: str = LAKE_DIR):
+    """
+    Exporta fct_sales e fct_product_sales em Parquet particionado por mês
+    (zstd, com estatísticas por row group) e publica o manifesto em
+    'lake_dir' (ver lake.py).
+    """
+    print(f"\nExportando o data lake Parquet em '{lake_dir}'...")
+    version = mart_version or datetime.now().strftime("%Y%m%d%H%M%S")
+
+    def build(conn_duckdb):
+        api_version = conn_duckdb.execute(MART_VERSION_SQL).fetchone()[0]
+        manifest = write_lake(conn_duckdb, version, api_version, lake_dir)
+        for table_name, table in manifest["tables"].items():
+            print(f"  ✓ '{table_name}': {table['rows']} linhas em {table['files']} arquivos "
+                  f"({table['bytes'] / 1e6:.1f} MB).")
+
+    # Opcional: roda depois da publicação do mart; se falhar, o manifesto
+    # (e os arquivos) da versão anterior continuam valendo
+    _run_step("exportar o data lake", duckdb_file, build, read_only=True, required=False)
+
+def main(fct_sales_query: str = FCT_SALES_QUERY, fct_product_sales_query: str = FCT_PRODUCT_SALES_QUERY):
+    """
+    Executa o ETL completo numa geração nova do mart (blue/green):
+    carrega os fatos e clientes do Postgres, compacta no esquema estrela,
+    constrói os derivados (rollups, rankings, RFM, amostra, HLL e shards),
+    valida a geração, renderiza os snapshots, publica trocando o link
+    (MART_LINK), remove as gerações antigas e, se ligado, exporta o lake.
+    Uma geração inválida é descartada e a API segue com a publicada.
+    As queries de extração dos fatos podem ser trocadas (ex.: etl_rapido.py).
+    """
     load_dotenv() 
     
     DB_URL = os.getenv("DATABASE_URL")
@@ -217,21 +579,80 @@ def main():
         print("Erro: DATABASE_URL não definida no .env")
         return
 
-    DUCKDB_FILE = 'analytics.duckdb'
+    # Uma versão por execução do ETL (a API invalida o cache quando ela muda)
+    MART_VERSION = datetime.now().strftime("%Y%m%d%H%M%S")
     
-    if os.path.exists(DUCKDB_FILE):
-        print(f"Removendo arquivo DuckDB antigo: {DUCKDB_FILE}")
-        os.remove(DUCKDB_FILE)
+    # Blue/green: o ETL escreve numa geração NOVA; a API continua lendo a
+    # publicada (MART_LINK) até a troca do link, no fim (ver publish.py)
+    os.makedirs(MART_DIR, exist_ok=True)
+    DUCKDB_FILE = generation_path(MART_VERSION)
+    discard(DUCKDB_FILE)
+    print(f"Construindo a geração nova do mart: {DUCKDB_FILE}")
 
     # --- RODA O ETL PARA AS DUAS TABELAS ---
     # 1. Tabela de Vendas (Grão: Venda)
-    process_etl_in_chunks(DB_URL, DUCKDB_FILE, FCT_SALES_QUERY, table_name='fct_sales')
+    process_etl_in_chunks(DB_URL, DUCKDB_FILE, fct_sales_query, table_name='fct_sales',
+                          mart_version=MART_VERSION)
     
     # 2. Tabela de Produtos Vendidos (Grão: Produto)
-    process_etl_in_chunks(DB_URL, DUCKDB_FILE, FCT_PRODUCT_SALES_QUERY, table_name='fct_product_sales')
+    process_etl_in_chunks(DB_URL, DUCKDB_FILE, fct_product_sales_query, table_name='fct_product_sales',
+                          mart_version=MART_VERSION)
+    
+    # 3. Dimensão de Clientes (Grão: Cliente)
+    process_etl_in_chunks(DB_URL, DUCKDB_FILE, DIM_CUSTOMERS_QUERY, table_name='dim_customers',
+                          mart_version=MART_VERSION)
+    
+    # 3b..8. Derivados + validação: se um passo obrigatório falhar ou a
+    # geração não passar na validação, ela nunca chega à API
+    try:
+        # 3b. Esquema estrela: chaves, dimensões e tipos compactos nos fatos
+        build_star_schema(DUCKDB_FILE, mart_version=MART_VERSION)
+
+        # 4. Rollups (pré-agregados) a partir das duas tabelas
+        build_rollups(DUCKDB_FILE, mart_version=MART_VERSION)
+
+        # 4b. Rankings de produtos (top/bottom-K)
+        build_rankings(DUCKDB_FILE, mart_version=MART_VERSION)
+
+        # 5. RFM de clientes (fct_sales + dim_customers)
+        build_customer_rfm(DUCKDB_FILE, mart_version=MART_VERSION)
+
+        # 6. Amostra estratificada (respostas aproximadas)
+        build_sample(DUCKDB_FILE, mart_version=MART_VERSION)
+
+        # 7. Sketches HLL (clientes únicos)
+        build_hll_sketches(DUCKDB_FILE, mart_version=MART_VERSION)
+
+        # 7b. Shards por loja (scatter-gather na API), se configurados
+        if MART_SHARDS > 1:
+            build_shards(DUCKDB_FILE, mart_version=MART_VERSION, n_shards=MART_SHARDS)
+
+        # 8. Validação
+        api_version = validate_mart(DUCKDB_FILE)
+    except (EtlStepError, InvalidMartError) as e:
+        print(f"\n--- ERRO: GERAÇÃO {MART_VERSION} INVÁLIDA, NÃO PUBLICADA ---")
+        print(f"Erro: {e}")
+        print(f"A API continua servindo '{MART_LINK}' sem alteração.")
+        discard(DUCKDB_FILE)
+        return
+    print(f"\n  ✓ Geração {MART_VERSION} validada.")
+    
+    # 9. Snapshots do dashboard padrão (servidos sem DuckDB)
+    build_snapshots(DUCKDB_FILE, mart_version=MART_VERSION)
+    
+    # 10. Publicação atômica (troca do link) + limpeza das gerações antigas
+    publish(DUCKDB_FILE, MART_VERSION, api_version, link=MART_LINK)
+    print(f"  ✓ '{MART_LINK}' -> '{DUCKDB_FILE}' publicado.")
+    removed = collect_garbage(link=MART_LINK)
+    if removed:
+        print(f"  ✓ Gerações antigas removidas: {', '.join(removed)}")
+    
+    # 11. Data lake Parquet (nós da API sem o arquivo do mart), se ligado
+    if LAKE_ENABLED:
+        build_lake(DUCKDB_FILE, mart_version=MART_VERSION)
     
     print("\n--- Processo ETL v4 (Otimizado) Concluído ---")
-    print(f"Arquivo '{DUCKDB_FILE}' atualizado com 2 tabelas.")
+    print(f"Arquivo '{DUCKDB_FILE}' publicado com 3 tabelas + customer_rfm + {len(ROLLUPS)} rollups (versão {MART_VERSION}).")
     print("Conexão com PostgreSQL fechada.")
     print("Conexão com DuckDB fechada.")
 
@@ -0,0 +1,271 @@
+"""
+Benchmark de vazão do ETL, com tempo por etapa.
+
+1. Sobe um Postgres LOCAL descartável, sem Docker: o pacote opcional
+   'pgserver' (pip install pgserver, traz os binários) ou initdb/pg_ctl do
+   PATH (ou de PG_BIN). Com --db-url usa um Postgres já existente.
+2. Cria o esquema (database-schema.sql) e popula com o generate_data.py na
+   escala pedida (--months, --stores, --products, --customers).
+3. Roda process_etl_in_chunks do etl.py para fct_sales e
+   fct_product_sales e, com --compare, as consultas do etl_rapido.py.
+4. Grava um JSON com, por tabela e por etapa (extract, to_pandas,
+   duckdb_insert, verify): tempo, linhas, linhas/s, bytes e MB/s.
+
+Bytes por etapa: extract = tamanho das linhas no Postgres
+(pg_column_size, medido depois, fora do tempo); to_pandas = memória dos
+DataFrames; duckdb_insert = quanto o arquivo .duckdb cresceu.
+
+Uso:
+    python etl_bench.py --months 1 --compare
+    python etl_bench.py --db-url postgresql://u:p@host/db --skip-seed --chunk-size 50000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import psycopg2
+
+import etl
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA_FILE = os.path.join(ROOT_DIR, "database-schema.sql")
+BENCH_TABLES = ("fct_sales", "fct_product_sales")
+STAGES = ("extract", "to_pandas", "duckdb_insert", "verify")
+
+
+# --- 1. Postgres local ---
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LocalPostgres:
+    """Instância descartável do Postgres num diretório temporário."""
+
+    def __init__(self):
+        self.data_dir = tempfile.mkdtemp(prefix="etl_bench_pg_")
+        self._server = None
+        self._pg_ctl = None
+        self.url = None
+
+    def start(self) -> str:
+        try:
+            import pgserver
+        except ImportError:
+            pgserver = None
+
+        if pgserver is not None:
+            self._server = pgserver.get_server(self.data_dir, cleanup_mode="delete")
+            self.url = self._server.get_uri()
+            return self.url
+
+        bin_dir = os.getenv("PG_BIN", "")
+        initdb = shutil.which("initdb", path=bin_dir or None)
+        self._pg_ctl = shutil.which("pg_ctl", path=bin_dir or None)
+        if not initdb or not self._pg_ctl:
+            raise RuntimeError(
+                "Postgres local não encontrado: instale 'pgserver' (pip install pgserver), "
+                "coloque initdb/pg_ctl no PATH (ou em PG_BIN) ou use --db-url."
+            )
+        port = _free_port()
+        subprocess.run([initdb, "-D", self.data_dir, "-U", "postgres", "-A", "trust"],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([self._pg_ctl, "-D", self.data_dir, "-w", "-l", os.path.join(self.data_dir, "server.log"),
+                        "-o", f"-p {port} -k {self.data_dir} -c listen_addresses=''", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+        self.url = f"postgresql://postgres@/postgres?host={self.data_dir}&port={port}"
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.cleanup()
+        elif self._pg_ctl is not None:
+            subprocess.run([self._pg_ctl, "-D", self.data_dir, "-m", "fast", "stop"],
+                           check=False, stdout=subprocess.DEVNULL)
+            shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+# --- 2. Esquema + dados ---
+
+def seed_database(db_url: str, months: float, stores: int, products: int, items: int, customers: int,
+                  seed: int) -> dict:
+    """Cria o esquema e popula com o gerador do desafio. Devolve as contagens."""
+    sys.path.insert(0, ROOT_DIR)
+    import generate_data
+
+    random.seed(seed)
+    generate_data.fake.seed_instance(seed)
+
+    conn = psycopg2.connect(db_url)
+    try:
+        with open(SCHEMA_FILE, encoding="utf-8") as f:
+            conn.cursor().execute(f.read())
+        conn.commit()
+
+        start = time.perf_counter()
+        sub_brand_ids, channels = generate_data.setup_base_data(conn)
+        store_ids = generate_data.generate_stores(conn, sub_brand_ids, stores)
+        product_list, item_list, option_groups = generate_data.generate_products_and_items(
+            conn, sub_brand_ids, products, items
+        )
+        customer_ids = generate_data.generate_customers(conn, customers)
+        generate_data.generate_sales(conn, store_ids, channels, product_list, item_list,
+                                     option_groups, customer_ids, months)
+        generate_data.create_indexes(conn)
+        seconds = time.perf_counter() - start
+
+        cursor = conn.cursor()
+        cursor.execute("ANALYZE")
+        counts = {}
+        for table in ("sales", "product_sales", "item_product_sales"):
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            counts[table] = cursor.fetchone()[0]
+        conn.commit()
+        return {"seed_s": round(seconds, 3), **counts}
+    finally:
+        conn.close()
+
+
+# --- 3. Benchmark ---
+
+def _pg_bytes(db_url: str, query: str) -> int:
+    """Tamanho (formato do Postgres) das linhas que a consulta devolve."""
+    conn = psycopg2.connect(db_url)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COALESCE(SUM(pg_column_size(q.*)), 0) FROM ({query.strip().rstrip(';')}) q")
+        return int(cursor.fetchone()[0])
+    finally:
+        conn.close()
+
+
+def _stage_report(entry: dict) -> dict:
+    seconds = entry["seconds"]
+    return {
+        "wall_s": round(seconds, 4),
+        "rows": entry["rows"],
+        "rows_per_s": round(entry["rows"] / seconds, 1) if seconds else None,
+        "bytes": entry["bytes"],
+        "mb_per_s": round(entry["bytes"] / seconds / 1e6, 2) if seconds and entry["bytes"] else None,
+    }
+
+
+def bench_variant(db_url: str, queries: dict, duckdb_file: str, chunk_size: int) -> dict:
+    """Roda o ETL das tabelas de 'queries' num .duckdb novo e mede cada etapa."""
+    if os.path.exists(duckdb_file):
+        os.remove(duckdb_file)
+
+    report = {}
+    for table_name, query in queries.items():
+        size_before = os.path.getsize(duckdb_file) if os.path.exists(duckdb_file) else 0
+        stats = {}
+        start = time.perf_counter()
+        etl.process_etl_in_chunks(db_url, duckdb_file, query, table_name, chunk_size=chunk_size,
+                                  mart_version="bench", stats=stats)
+        wall = time.perf_counter() - start
+
+        stages = stats.get("stages", {})
+        if "extract" in stages:
+            stages["extract"]["bytes"] = _pg_bytes(db_url, query)
+        if "duckdb_insert" in stages:
+            stages["duckdb_insert"]["bytes"] = os.path.getsize(duckdb_file) - size_before
+
+        rows = stats.get("rows", 0)
+        report[table_name] = {
+            "rows": rows,
+            "chunks": stats.get("chunks", 0),
+            "wall_s": round(wall, 4),
+            "rows_per_s": round(rows / wall, 1) if wall else None,
+            "stages": {name: _stage_report(stages[name]) for name in STAGES if name in stages},
+            **({"error": stats["error"]} if "error" in stats else {}),
+        }
+    report["duckdb_file_bytes"] = os.path.getsize(duckdb_file) if os.path.exists(duckdb_file) else 0
+    return report
+
+
+def _print_variant(name: str, report: dict):
+    print(f"\n[{name}]")
+    print(f"{'tabela':<20}{'etapa':<15}{'linhas':>10}{'seg':>10}{'linhas/s':>12}{'MB':>10}")
+    for table_name in BENCH_TABLES:
+        table = report.get(table_name)
+        if not table:
+            continue
+        for stage, entry in table["stages"].items():
+            print(f"{table_name:<20}{stage:<15}{entry['rows']:>10}{entry['wall_s']:>10.3f}"
+                  f"{entry['rows_per_s'] or 0:>12.0f}{entry['bytes'] / 1e6:>10.2f}")
+        print(f"{table_name:<20}{'total':<15}{table['rows']:>10}{table['wall_s']:>10.3f}{table['rows_per_s'] or 0:>12.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de vazão do ETL (por etapa).")
+    parser.add_argument("--db-url", help="Postgres existente (senão sobe um local descartável).")
+    parser.add_argument("--skip-seed", action="store_true", help="Não cria esquema nem dados (banco já populado).")
+    parser.add_argument("--months", type=float, default=0.5, help="Meses de vendas gerados (~2.700 vendas/dia).")
+    parser.add_argument("--stores", type=int, default=50)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--customers", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-size", type=int, default=100000)
+    parser.add_argument("--compare", action="store_true", help="Roda também as consultas do etl_rapido.py.")
+    parser.add_argument("--mart", default="etl_bench.duckdb", help="Arquivo .duckdb de saída (sobrescrito).")
+    parser.add_argument("--output", default="etl_bench_report.json")
+    args = parser.parse_args()
+
+    local = None
+    db_url = args.db_url
+    try:
+        if not db_url:
+            local = LocalPostgres()
+            db_url = local.start()
+            print(f"Postgres local em {local.data_dir}")
+
+        dataset = None
+        if not args.skip_seed:
+            dataset = seed_database(db_url, args.months, args.stores, args.products, args.items,
+                                    args.customers, args.seed)
+
+        variants = {"etl": {"fct_sales": etl.FCT_SALES_QUERY, "fct_product_sales": etl.FCT_PRODUCT_SALES_QUERY}}
+        if args.compare:
+            import etl_rapido
+            variants["etl_rapido"] = {
+                "fct_sales": etl_rapido.FCT_SALES_QUERY, "fct_product_sales": etl_rapido.FCT_PRODUCT_SALES_QUERY,
+            }
+
+        results = {}
+        for name, queries in variants.items():
+            root, ext = os.path.splitext(args.mart)
+            results[name] = bench_variant(db_url, queries, f"{root}_{name}{ext}" if len(variants) > 1 else args.mart,
+                                          args.chunk_size)
+            _print_variant(name, results[name])
+    finally:
+        if local is not None:
+            local.stop()
+
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "postgres": "local" if local is not None else "external", "chunk_size": args.chunk_size,
+            "months": args.months, "stores": args.stores, "products": args.products, "items": args.items,
+            "customers": args.customers, "seed": args.seed,
+        },
+        "dataset": dataset,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nRelatório: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
-import os
-import duckdb
-import pandas as pd
-import psycopg2
-from dotenv import load_dotenv
+"""
+ETL com limitação de dados: as mesmas etapas do etl.py (geração nova,
+esquema estrela, rollups, validação e publicação), mas extraindo só as
+vendas com id <= 50000. Útil para subir o projeto rápido.
+"""
+import etl
 
 # --- QUERY 1: FCT_SALES (Grão: Venda) ---
 # Usada para KPIs de alto nível: Faturamento, Descontos, Pagamentos, Clientes, Entrega
@@ -44,8 +45,10 @@ WITH sales_base AS (
         s.delivery_seconds,
 
         -- Dimensões
+        s.store_id,
         st.name AS store_name,
         st.city AS store_city,
+        s.channel_id,
         ch.name AS channel_name,
         ch.type AS channel_type, -- 'P' Presencial, 'D' Delivery
         s.customer_id,
@@ -103,7 +106,9 @@ sales_dims AS (
         s.created_at AS sale_created_at,
         TO_CHAR(s.created_at, 'YYYY-MM') AS mes_ano,
         DATE(s.created_at) AS data_venda,
+        s.store_id,
         st.name AS store_name,
+        s.channel_id,
         ch.name AS channel_name,
         ch.type AS channel_type,
         da.neighborhood AS delivery_neighborhood
@@ -133,94 +138,9 @@ JOIN
 ;
 """
 
-def process_etl_in_chunks(db_url: str, duckdb_file: str, query: str, table_name: str, chunk_size: int = 100000):
-    """
-    Executa o ETL processando os dados em "chunks" (pedaços)
-    para evitar o esgotamento de memória RAM.
-    """
-    print(f"\nIniciando processamento para: {table_name}")
-    
-    conn_pg = None
-    conn_duckdb = None
-    
-    try:
-        conn_pg = psycopg2.connect(db_url)
-        conn_duckdb = duckdb.connect(database=duckdb_file, read_only=False)
-        
-        is_first_chunk = True
-        
-        print(f"Iniciando extração em chunks de {chunk_size} linhas...")
-        
-        chunk_iterator = pd.read_sql_query(
-            query,
-            conn_pg,
-            chunksize=chunk_size
-        )
-        
-        total_rows = 0
-        
-        for i, chunk_df in enumerate(chunk_iterator):
-            if chunk_df.empty:
-                print(f"Chunk {i+1} está vazio. Finalizando.")
-                break
-                
-            print(f"  > Processando Chunk {i+1} ({len(chunk_df)} linhas)...")
-            conn_duckdb.register('chunk_temp', chunk_df)
-            
-            if is_first_chunk:
-                conn_duckdb.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM chunk_temp")
-                print(f"  ✓ Tabela '{table_name}' criada com o primeiro chunk.")
-                is_first_chunk = False
-            else:
-                conn_duckdb.execute(f"INSERT INTO {table_name} SELECT * FROM chunk_temp")
-                print(f"  ✓ Chunk {i+1} anexado à tabela '{table_name}'.")
-            
-            total_rows += len(chunk_df)
-
-        if total_rows == 0:
-             print("Nenhum dado foi processado.")
-             return
-
-        count_result = conn_duckdb.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()
-        if count_result:
-            print(f"✓ Verificação: {count_result[0]} linhas totais na tabela '{table_name}'.")
-        
-    except Exception as e:
-        print(f"\n--- ERRO DURANTE O PROCESSO ETL ({table_name}) ---")
-        print(f"Erro: {e}")
-    
-    finally:
-        if conn_pg:
-            conn_pg.close()
-        if conn_duckdb:
-            conn_duckdb.close()
-
 def main():
-    """Função principal do pipeline ETL."""
-    load_dotenv() 
-    
-    DB_URL = os.getenv("DATABASE_URL")
-    if not DB_URL:
-        print("Erro: DATABASE_URL não definida no .env")
-        return
-
-    DUCKDB_FILE = 'analytics.duckdb'
-    
-    if os.path.exists(DUCKDB_FILE):
-        print(f"Removendo arquivo DuckDB antigo: {DUCKDB_FILE}")
-        os.remove(DUCKDB_FILE)
-
-    # --- RODA O ETL PARA AS DUAS TABELAS ---
-    # 1. Tabela de Vendas (Grão: Venda)
-    process_etl_in_chunks(DB_URL, DUCKDB_FILE, FCT_SALES_QUERY, table_name='fct_sales')
-    
-    # 2. Tabela de Produtos Vendidos (Grão: Produto)
-    process_etl_in_chunks(DB_URL, DUCKDB_FILE, FCT_PRODUCT_SALES_QUERY, table_name='fct_product_sales')
-    
-    print("\n--- Processo ETL v3 Concluído ---")
-    print(f"Arquivo '{DUCKDB_FILE}' atualizado com 2 tabelas.")
-    print("Conexão com PostgreSQL fechada.")
-    print("Conexão com DuckDB fechada.")
+    """Roda o pipeline do etl.py com as consultas amostradas."""
+    etl.main(fct_sales_query=FCT_SALES_QUERY, fct_product_sales_query=FCT_PRODUCT_SALES_QUERY)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
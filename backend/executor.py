@@ -0,0 +1,131 @@
+import asyncio
+import contextvars
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from metrics import metrics, phase
+
+# --- Configuração do Executor ---
+# Threads que executam queries no DuckDB (cada thread tem o seu cursor).
+QUERY_MAX_WORKERS = int(os.getenv("QUERY_MAX_WORKERS", str(os.cpu_count() or 4)))
+# Quantas queries podem estar "em voo" (rodando) ao mesmo tempo.
+QUERY_MAX_IN_FLIGHT = int(os.getenv("QUERY_MAX_IN_FLIGHT", str(QUERY_MAX_WORKERS)))
+# Quanto tempo (s) uma requisição espera por uma vaga antes de receber 503.
+QUERY_QUEUE_TIMEOUT = float(os.getenv("QUERY_QUEUE_TIMEOUT", "5"))
+
+
+class QueryExecutor:
+    """
+    Tira as queries (bloqueantes) do event loop.
+
+    Cada chamada ocupa uma "vaga" de um limite de queries em voo. Se não
+    houver vaga dentro de 'queue_timeout' segundos a requisição recebe 503
+    em vez de ficar empilhada no servidor.
+    """
+
+    def __init__(self, max_workers: int = QUERY_MAX_WORKERS,
+                 max_in_flight: int = QUERY_MAX_IN_FLIGHT,
+                 queue_timeout: float = QUERY_QUEUE_TIMEOUT):
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="duckdb-query")
+        self._slots = weakref.WeakKeyDictionary()  # Um semáforo por event loop
+        self.in_flight = 0
+
+    def _slots_for_loop(self, loop) -> asyncio.Semaphore:
+        slots = self._slots.get(loop)
+        if slots is None:
+            slots = self._slots[loop] = asyncio.Semaphore(self.max_in_flight)
+        return slots
+
+    def _release(self, slots: asyncio.Semaphore):
+        self.in_flight -= 1
+        slots.release()
+
+    async def run(self, fn, *args):
+        """Executa fn(*args) no pool de threads e aguarda o resultado."""
+        loop = asyncio.get_running_loop()
+        slots = self._slots_for_loop(loop)
+
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=503,
+                detail="Servidor ocupado: muitas consultas em andamento. Tente novamente.",
+                headers={"Retry-After": str(max(1, round(self.queue_timeout)))},
+            )
+
+        self.in_flight += 1
+        try:
+            # O contexto (ex.: o trace da requisição) acompanha a query no thread
+            future = self._pool.submit(contextvars.copy_context().run, fn, *args)
+        except BaseException:
+            self._release(slots)
+            raise
+
+        # A vaga só é devolvida quando a query termina DE FATO no thread,
+        # mesmo que o cliente desconecte e a requisição seja cancelada.
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release, slots))
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class SingleFlight:
+    """
+    Coalescência de chamadas idênticas em voo ("single-flight").
+
+    Enquanto uma chamada com a mesma chave está rodando, as próximas não
+    disparam outra: aguardam a mesma execução e recebem o mesmo resultado
+    (ou o mesmo erro). A execução não é cancelada se quem a disparou
+    desistir (cliente desconectou): as outras requisições ainda esperam por ela.
+    """
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()  # event loop -> {chave: task}
+        self.executions = 0
+        self.coalesced = 0
+
+    def _calls_for_loop(self, loop) -> dict:
+        calls = self._calls.get(loop)
+        if calls is None:
+            calls = self._calls[loop] = {}
+        return calls
+
+    @staticmethod
+    def _finished(calls: dict, key, task: asyncio.Task):
+        if calls.get(key) is task:
+            del calls[key]
+        # Marca a exceção como lida, mesmo sem ninguém esperando
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, key, label: str, coro_fn, *args):
+        """Aguarda coro_fn(*args), compartilhando a execução com chamadas de mesma chave."""
+        calls = self._calls_for_loop(asyncio.get_running_loop())
+        task = calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+            metrics.observe_coalesced(label)
+            with phase("coalesced"):
+                return await asyncio.shield(task)
+
+        self.executions += 1
+        task = asyncio.ensure_future(coro_fn(*args))
+        calls[key] = task
+        task.add_done_callback(lambda t: self._finished(calls, key, t))
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        return sum(len(calls) for calls in self._calls.values())
+
+
+executor = QueryExecutor()
+single_flight = SingleFlight()
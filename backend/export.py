@@ -0,0 +1,199 @@
+"""
+Exportação de fatias dos fatos (/api/v2/export).
+
+A fatia é lida do DuckDB em record batches (Arrow) e cada batch é
+codificado e enviado assim que fica pronto: a memória fica constante,
+independente do tamanho da exportação. Se o cliente desconectar, a query
+é interrompida no DuckDB.
+"""
+import csv
+import io
+import os
+import threading
+import zlib
+from typing import Optional
+
+from fastapi import HTTPException
+
+from encoding import dumps, pa
+from star import denormalized_sql
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # Sem pyarrow: exportação indisponível (ver encoding.py)
+    pq = None
+
+# --- Configuração da Exportação ---
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "50000"))
+# Exportações simultâneas (cada uma segura um cursor enquanto envia)
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+
+EXPORT_TABLES = {
+    "sales": "fct_sales",
+    "product_sales": "fct_product_sales",
+}
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+
+def acquire_slot():
+    """Reserva uma vaga de exportação (503 se não houver)."""
+    if not _slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=503,
+            detail="Muitas exportações em andamento. Tente novamente.",
+            headers={"Retry-After": "5"},
+        )
+
+
+def release_slot():
+    _slots.release()
+
+
+def build_export_sql(table: str, store_name: Optional[str], date_from, date_to,
+                     channel_name: Optional[str]) -> tuple:
+    """SELECT da fatia pedida, com os filtros como parâmetros (?)."""
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=400, detail=f"Tabela inválida: '{table}'. Use {sorted(EXPORT_TABLES)}.")
+    where, params = [], []
+    for condition, value in (
+        ("store_name = ?", store_name),
+        ("data_venda >= ?", date_from),
+        ("data_venda <= ?", date_to),
+        ("channel_name = ?", channel_name),
+    ):
+        if value is not None:
+            where.append(condition)
+            params.append(value)
+
+    sql = f"SELECT * FROM {denormalized_sql(EXPORT_TABLES[table])} AS f"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql, params
+
+
+class _ChunkSink(io.RawIOBase):
+    """Arquivo "de mentira": guarda o que o ParquetWriter escreve até ser drenado."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class _CsvEncoder:
+    def __init__(self):
+        self._header_sent = False
+
+    def encode(self, batch) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not self._header_sent:
+            writer.writerow(batch.schema.names)
+            self._header_sent = True
+        columns = [column.to_pylist() for column in batch.columns]
+        writer.writerows(zip(*columns))
+        return buffer.getvalue().encode("utf-8")
+
+    def close(self) -> bytes:
+        return b""
+
+
+class _NdjsonEncoder:
+    def encode(self, batch) -> bytes:
+        return b"".join(dumps(row) + b"\n" for row in batch.to_pylist())
+
+    def close(self) -> bytes:
+        return b""
+
+
+class _ParquetEncoder:
+    """Um row group por batch; o rodapé sai no close()."""
+
+    def __init__(self):
+        self._sink = _ChunkSink()
+        self._writer = None
+
+    def encode(self, batch) -> bytes:
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self._sink, batch.schema, compression="zstd")
+        self._writer.write_batch(batch)
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        if self._writer is not None:
+            self._writer.close()
+        return self._sink.drain()
+
+
+_ENCODERS = {
+    "csv": _CsvEncoder,
+    "ndjson": _NdjsonEncoder,
+    "parquet": _ParquetEncoder,
+}
+
+
+class ExportStream:
+    """
+    Iterador bloqueante sobre os bytes da exportação (um pedaço por batch).
+    Usa um cursor próprio, fechado em close(); interrupt() pode ser chamado
+    de outro thread para parar a query no meio.
+    """
+
+    def __init__(self, cursor, sql: str, params: list, fmt: str, gzip: bool = False,
+                 batch_rows: int = EXPORT_BATCH_ROWS):
+        if pa is None or pq is None:
+            raise HTTPException(status_code=406, detail="Exportação indisponível: instale 'pyarrow' no servidor.")
+        self._cursor = cursor
+        self._encoder = _ENCODERS[fmt]()
+        self._compressor = zlib.compressobj(wbits=31) if gzip else None
+        self._reader = cursor.execute(sql, params).fetch_record_batch(batch_rows)
+        self._finished = False
+        self.rows = 0
+
+    def _compress(self, data: bytes, final: bool = False) -> bytes:
+        if self._compressor is None:
+            return data
+        data = self._compressor.compress(data)
+        return data + self._compressor.flush() if final else data
+
+    def next_chunk(self) -> Optional[bytes]:
+        """Próximo pedaço já codificado, ou None no fim."""
+        while not self._finished:
+            try:
+                batch = self._reader.read_next_batch()
+            except StopIteration:
+                self._finished = True
+                return self._compress(self._encoder.close(), final=True)
+            self.rows += batch.num_rows
+            data = self._compress(self._encoder.encode(batch))
+            if data:
+                return data
+        return None
+
+    def interrupt(self):
+        self._cursor.interrupt()
+
+    def close(self):
+        self._cursor.close()
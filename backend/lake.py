@@ -0,0 +1,206 @@
+"""
+Data lake em Parquet com os fatos do mart (fct_sales e fct_product_sales).
+
+Com LAKE_ENABLED, o ETL exporta os fatos da geração publicada para
+LAKE_DIR/<versão>/<tabela>/mes_ano=<mês>/[store_name=<loja>/]*.parquet
+(particionamento Hive), comprimidos com zstd e ordenados por loja e data
+dentro de cada partição: o min/max que cada row group guarda no rodapé
+do arquivo fica estreito. O manifest.json (trocado com os.replace) aponta
+a versão publicada.
+
+Com LAKE_SERVE, a API responde LAKE_QUERIES direto dos arquivos, numa
+conexão DuckDB em memória por thread: o filtro de mes_ano (e de loja, se
+particionado por loja) descarta diretórios inteiros, e o de loja descarta
+row groups pelas estatísticas. Nada é aberto para escrita nem fica
+travado: vários nós da API podem ler o mesmo diretório compartilhado.
+"""
+import json
+import os
+import shutil
+import threading
+from typing import Optional
+
+import duckdb
+
+from aggregates import FACTS, AggregateQuery, compile_aggregate
+from encoding import QueryResult
+from star import denormalized_sql
+
+# --- Configuração ---
+LAKE_DIR = os.getenv("LAKE_DIR", "lake")
+# O ETL exporta o lake
+LAKE_ENABLED = os.getenv("LAKE_ENABLED", "false").lower() in ("1", "true", "yes")
+# A API responde LAKE_QUERIES pelo lake (quando há um lake publicado)
+LAKE_SERVE = os.getenv("LAKE_SERVE", "false").lower() in ("1", "true", "yes")
+# Particiona também por loja (mais arquivos, menores)
+LAKE_PARTITION_BY_STORE = os.getenv("LAKE_PARTITION_BY_STORE", "false").lower() in ("1", "true", "yes")
+LAKE_ROW_GROUP_SIZE = int(os.getenv("LAKE_ROW_GROUP_SIZE", "122880"))
+MANIFEST_FILE = "manifest.json"
+
+LAKE_TABLES = ("fct_sales", "fct_product_sales")
+# Relatórios respondidos pelo lake (filtrados por mês e/ou loja)
+LAKE_QUERIES = ("sales_by_day_stacked", "sales_by_day_stacked_for_store", "sales_by_channel_detail")
+
+
+def _partition_by(partition_by_store: bool) -> tuple:
+    return ("mes_ano", "store_name") if partition_by_store else ("mes_ano",)
+
+
+def _sql_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _published_version(lake_dir: str) -> Optional[str]:
+    """Versão apontada pelo manifesto em disco, ou None."""
+    try:
+        with open(os.path.join(lake_dir, MANIFEST_FILE), "rb") as f:
+            return json.loads(f.read())["version"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_lake(conn, version: str, mart_version: str, lake_dir: str = LAKE_DIR,
+               partition_by_store: bool = LAKE_PARTITION_BY_STORE,
+               row_group_size: int = LAKE_ROW_GROUP_SIZE) -> dict:
+    """
+    Exporta LAKE_TABLES do mart aberto em 'conn' para lake_dir/<version>/
+    e publica o manifesto. 'mart_version' é a versão que a API lê do mart.
+    Devolve o manifesto.
+
+    A versão publicada antes fica em disco até a próxima publicação: um nó
+    que ainda leu o manifesto antigo continua achando os arquivos. As demais
+    (inclusive exportações que falharam no meio) são removidas.
+    """
+    previous = _published_version(lake_dir)
+    version_dir = os.path.join(lake_dir, version)
+    shutil.rmtree(version_dir, ignore_errors=True)
+    os.makedirs(version_dir)
+    partition_by = _partition_by(partition_by_store)
+
+    tables = {}
+    for table_name in LAKE_TABLES:
+        table_dir = os.path.join(version_dir, table_name)
+        conn.execute(f"""
+            COPY (SELECT * FROM {denormalized_sql(table_name)} AS f ORDER BY mes_ano, store_name, data_venda)
+            TO {_sql_literal(table_dir)} (
+                FORMAT PARQUET, PARTITION_BY ({', '.join(partition_by)}),
+                COMPRESSION ZSTD, ROW_GROUP_SIZE {int(row_group_size)}
+            )
+        """)
+        files = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(table_dir) for name in names if name.endswith(".parquet")
+        ]
+        tables[table_name] = {
+            "rows": conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0],
+            "files": len(files),
+            "bytes": sum(os.path.getsize(f) for f in files),
+        }
+
+    manifest = {
+        "version": version,
+        "mart_version": mart_version,
+        "partition_by": list(partition_by),
+        "tables": tables,
+    }
+    _write_atomic(os.path.join(lake_dir, MANIFEST_FILE),
+                  json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+
+    # Limpa as versões antigas (fica a publicada antes desta)
+    for old in os.listdir(lake_dir):
+        if old not in (version, previous) and os.path.isdir(os.path.join(lake_dir, old)):
+            shutil.rmtree(os.path.join(lake_dir, old), ignore_errors=True)
+    return manifest
+
+
+class ParquetLake:
+    """
+    Leitura do lake publicado. O manifesto é relido quando muda em disco;
+    cada thread tem a sua conexão DuckDB em memória (só lê os arquivos).
+    """
+
+    def __init__(self, lake_dir: str = LAKE_DIR, enabled: bool = LAKE_SERVE):
+        self.lake_dir = lake_dir
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._manifest_signature = None
+        self._manifest = None
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.lake_dir, MANIFEST_FILE)
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self._manifest_path())
+            signature = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            signature = None
+        if signature == self._manifest_signature:
+            return
+
+        with self._lock:
+            if signature == self._manifest_signature:
+                return
+            manifest = None
+            if signature is not None:
+                try:
+                    with open(self._manifest_path(), "rb") as f:
+                        manifest = json.loads(f.read())
+                except (OSError, ValueError):
+                    manifest = None
+            self._manifest = manifest
+            self._manifest_signature = signature
+
+    def current_version(self) -> Optional[str]:
+        """Versão do mart (como a API a vê) do lake publicado, ou None."""
+        if not self.enabled:
+            return None
+        self._refresh()
+        return self._manifest["mart_version"] if self._manifest else None
+
+    def serves(self, query_name: str) -> bool:
+        return query_name in LAKE_QUERIES and self.current_version() is not None
+
+    def _cursor(self) -> duckdb.DuckDBPyConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = duckdb.connect(database=":memory:")
+            self._local.conn = conn
+        return conn
+
+    def table_sql(self, table_name: str, manifest: dict) -> str:
+        """read_parquet da tabela na versão do manifesto (partições como VARCHAR)."""
+        pattern = os.path.join(self.lake_dir, manifest["version"], table_name, "**", "*.parquet")
+        hive_types = ", ".join(f"'{column}': VARCHAR" for column in manifest["partition_by"])
+        return f"read_parquet({_sql_literal(pattern)}, hive_partitioning = true, hive_types = {{{hive_types}}})"
+
+    def execute(self, query: AggregateQuery, params: Optional[list] = None) -> QueryResult:
+        """Roda a query sobre os arquivos do fato (filtros empurrados para o scan)."""
+        self._refresh()
+        manifest = self._manifest
+        if manifest is None:
+            raise RuntimeError(f"nenhum lake publicado em '{self.lake_dir}'")
+        sql = compile_aggregate(query, table=self.table_sql(FACTS[query.fact].table, manifest))
+        # O SQL só lê os arquivos: o perfil roda numa conexão em memória nova
+        return QueryResult.run(self._cursor(), sql, params, lambda: duckdb.connect(database=":memory:"))
+
+    def stats(self) -> dict:
+        self._refresh()
+        manifest = self._manifest
+        return {
+            "enabled": self.enabled,
+            "version": manifest["version"] if manifest else None,
+            "partition_by": manifest["partition_by"] if manifest else [],
+            "tables": manifest["tables"] if manifest else {},
+        }
+
+
+parquet_lake = ParquetLake()
@@ -0,0 +1,219 @@
+"""
+Modo híbrido ("hoje"): vendas que ainda não estão no Data Mart.
+
+O mart só enxerga o que existia na última execução do ETL. No modo
+híbrido a API busca no Postgres SÓ as vendas depois da marca d'água do
+mart (MAX(sale_created_at)), já agregadas pelas dimensões do relatório,
+e soma essas parciais às do mart.
+
+Limites para o Postgres nunca deixar o relatório lento:
+- janela máxima (LIVE_MAX_WINDOW_HOURS): nunca lê mais do que isso para trás;
+  se o mart estiver mais atrasado que a janela, responde só com o mart (somar
+  uma fatia truncada deixaria um buraco silencioso entre mart e Postgres);
+- orçamento (LIVE_BUDGET_MS): statement_timeout da query ao vivo;
+- pool sem espera: se não houver conexão livre, responde só com o mart;
+- as conexões são abertas por um thread de fundo, nunca na requisição (o
+  connect_timeout do libpq é em segundos inteiros, maior que o orçamento).
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Optional
+
+import psycopg2
+from psycopg2 import extensions, pool
+
+from metrics import logger, phase
+
+# --- Configuração do Modo Híbrido ---
+LIVE_MAX_WINDOW_HOURS = float(os.getenv("LIVE_MAX_WINDOW_HOURS", "24"))
+LIVE_BUDGET_MS = int(os.getenv("LIVE_BUDGET_MS", "300"))
+LIVE_POOL_SIZE = int(os.getenv("LIVE_POOL_SIZE", "4"))
+# Depois de uma falha de conexão, fica esse tempo (s) sem tentar o Postgres
+LIVE_RETRY_SECONDS = float(os.getenv("LIVE_RETRY_SECONDS", "30"))
+# connect_timeout (s) das conexões abertas pelo thread de fundo
+LIVE_CONNECT_TIMEOUT_S = int(os.getenv("LIVE_CONNECT_TIMEOUT_S", "5"))
+
+# Dimensões do fato 'sales' que a query ao vivo sabe reproduzir
+LIVE_DIMENSIONS = {
+    "store_name": "st.name",
+    "store_city": "st.city",
+    "channel_name": "ch.name",
+    "channel_type": "ch.type",
+    "mes_ano": "TO_CHAR(s.created_at, 'YYYY-MM')",
+    "data_venda": "DATE(s.created_at)",
+}
+
+# Mesmas colunas aditivas (e na mesma ordem) de FACTS['sales'].rollup_columns
+LIVE_ADDITIVE_COLUMNS = {
+    "faturamento": "SUM(s.total_amount)",
+    "total_vendas": "COUNT(s.id)",
+    "total_descontos": "SUM(s.total_discount)",
+    "delivery_seconds_sum": "SUM(s.delivery_seconds)",
+    "delivery_count": "COUNT(s.delivery_seconds)",
+}
+
+
+class PostgresPool:
+    """
+    Conexões psycopg2 reaproveitadas entre requisições. Um thread de fundo
+    (iniciado no primeiro uso) abre até 'max_connections' e reabre as que
+    quebram; a requisição só pega uma conexão já aberta e, se não houver
+    nenhuma livre, não espera.
+    """
+
+    def __init__(self, dsn: str, max_connections: int = LIVE_POOL_SIZE):
+        self.dsn = dsn
+        self.max_connections = max_connections
+        self._idle = []   # abertas e livres
+        self._open = 0    # abertas (livres + emprestadas)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+        self._down_until = 0.0
+
+    def start(self):
+        """Inicia o thread que abre as conexões (idempotente)."""
+        with self._lock:
+            if self._thread is None and self.dsn and not self._closed:
+                self._thread = threading.Thread(target=self._maintain, name="postgres-connect", daemon=True)
+                self._thread.start()
+
+    def _maintain(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                missing = self.max_connections - self._open
+            wait = self._down_until - time.monotonic()
+            if missing <= 0 or wait > 0:
+                self._wake.wait(timeout=wait if missing > 0 else None)
+                self._wake.clear()
+                continue
+            try:
+                conn = psycopg2.connect(self.dsn, connect_timeout=LIVE_CONNECT_TIMEOUT_S)
+            except psycopg2.Error as e:
+                logger.warning(f"Postgres indisponível para o modo híbrido ({e}).")
+                self.mark_down()
+                continue
+            with self._lock:
+                if self._closed:
+                    conn.close()
+                    return
+                self._idle.append(conn)
+                self._open += 1
+
+    def available(self) -> bool:
+        return bool(self.dsn) and time.monotonic() >= self._down_until
+
+    def mark_down(self):
+        self._down_until = time.monotonic() + LIVE_RETRY_SECONDS
+
+    def _release(self, conn, broken: bool):
+        with self._lock:
+            if not broken and not self._closed:
+                self._idle.append(conn)
+                return
+            self._open -= 1
+        conn.close()
+        self._wake.set()
+
+    @contextmanager
+    def connection(self):
+        """Empresta uma conexão já aberta. Lança pool.PoolError se não houver livre."""
+        self.start()
+        with self._lock:
+            if not self._idle:
+                raise pool.PoolError("nenhuma conexão livre com o Postgres")
+            conn = self._idle.pop()
+        broken = False
+        try:
+            yield conn
+            conn.rollback()
+        except psycopg2.Error:
+            broken = conn.closed != 0
+            if not broken:
+                conn.rollback()
+            raise
+        finally:
+            self._release(conn, broken)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn in idle:
+            conn.close()
+        self._wake.set()
+
+
+def supports(columns) -> bool:
+    """A query ao vivo consegue agrupar/filtrar por essas colunas?"""
+    return all(c in LIVE_DIMENSIONS for c in columns)
+
+
+_watermarks = {}
+
+
+def mart_watermark(cursor, version) -> datetime:
+    """Venda mais recente do mart (lida uma vez por versão)."""
+    watermark = _watermarks.get(version)
+    if watermark is None:
+        watermark = cursor.execute("SELECT MAX(sale_created_at) FROM fct_sales").fetchone()[0]
+        _watermarks.clear()
+        _watermarks[version] = watermark
+    return watermark
+
+
+def live_since(watermark: datetime) -> Optional[datetime]:
+    """
+    Início da fatia ao vivo (a marca d'água do mart). None se a marca d'água
+    for mais antiga que a janela máxima: a fatia não cobriria as vendas entre
+    o mart e o início da janela, então o relatório sai só com o mart.
+    """
+    window_start = datetime.now() - timedelta(hours=LIVE_MAX_WINDOW_HOURS)
+    if watermark is None or watermark < window_start:
+        return None
+    return watermark
+
+
+def fetch_live_partial(pg_pool: PostgresPool, columns: list, since: datetime):
+    """
+    Parciais aditivas (colunas de rollup) das vendas depois de 'since',
+    agrupadas por 'columns'. Retorna None se o Postgres não responder
+    dentro do orçamento (o relatório sai só com o mart).
+    """
+    if not pg_pool.available():
+        return None
+
+    select = [f"{LIVE_DIMENSIONS[c]} AS {c}" for c in columns]
+    select += [f"{expr} AS {name}" for name, expr in LIVE_ADDITIVE_COLUMNS.items()]
+    sql = f"""
+    SELECT {", ".join(select)}
+    FROM sales s
+    JOIN stores st ON s.store_id = st.id
+    JOIN channels ch ON s.channel_id = ch.id
+    WHERE s.sale_status_desc = 'COMPLETED'
+      AND s.created_at > %s
+    """
+    if columns:
+        sql += " GROUP BY " + ", ".join(str(i + 1) for i in range(len(columns)))
+
+    try:
+        with phase("postgres"), pg_pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SET LOCAL statement_timeout = %s", [LIVE_BUDGET_MS])
+            cur.execute(sql, [since])
+            rows = cur.fetchall()
+    except (pool.PoolError, psycopg2.Error) as e:
+        if isinstance(e, psycopg2.OperationalError) and not isinstance(e, extensions.QueryCanceledError):
+            pg_pool.mark_down()
+        logger.warning(f"fatia ao vivo indisponível ({e}). Respondendo só com o mart.")
+        return None
+
+    # Sem vendas novas: SUM/COUNT sem GROUP BY devolvem uma linha "vazia"
+    return [row for row in rows if row[len(columns) + 1]]
@@ -0,0 +1,527 @@
+"""
+Teste de carga HTTP da API (auto-contido).
+
+1. Gera um analytics.duckdb SINTÉTICO do tamanho pedido (mesmo esquema do
+   ETL: fct_sales, fct_product_sales, dim_customers) e roda as mesmas
+   etapas de pós-processamento do etl.py (rollups, rankings, RFM, amostra,
+   sketches HLL, snapshots do dashboard). Não precisa de Postgres.
+2. Sobe a API (uvicorn) apontando para esse arquivo, ou usa --url.
+3. N usuários virtuais percorrem cenários realistas (home do dashboard,
+   funil da loja, drill-downs, comparação de períodos, consulta semântica,
+   lote, exportação e o monitoramento: cache, slow queries e /metrics)
+   durante --duration segundos. Todo endpoint GET/POST da v2 entra em algum
+   cenário.
+4. Grava um JSON com p50/p95/p99, vazão e taxa de erro, no total e por
+   endpoint.
+
+Uso:
+    python loadtest.py --rows 500000 --concurrency 16 --duration 60
+    python loadtest.py --skip-build --url http://localhost:8001 --mix funnel=1
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+import duckdb
+
+import etl
+
+CATEGORIES = ["Burgers", "Pizzas", "Pratos", "Combos", "Sobremesas", "Bebidas"]
+CHANNELS = [  # (nome, tipo, peso) - mesmos pesos do generate_data.py
+    ("Presencial", "P", 40), ("iFood", "D", 30), ("Rappi", "D", 15),
+    ("Uber Eats", "D", 8), ("WhatsApp", "D", 5), ("App Próprio", "D", 2),
+]
+PAYMENT_TYPES = ["Cartão de Crédito", "Cartão de Débito", "PIX", "Dinheiro", "Vale Refeição"]
+# Hora do dia -> peso (picos no almoço e no jantar)
+HOUR_WEIGHTS = {h: 2 for h in range(0, 6)}
+HOUR_WEIGHTS.update({h: 8 for h in range(6, 11)})
+HOUR_WEIGHTS.update({h: 35 for h in range(11, 15)})
+HOUR_WEIGHTS.update({h: 10 for h in range(15, 19)})
+HOUR_WEIGHTS.update({h: 40 for h in range(19, 23)})
+HOUR_WEIGHTS[23] = 5
+
+DEFAULT_MIX = "dashboard=4,funnel=3,drilldown=2,compare=1,query=1,batch=1,export=0.2,monitor=0.2"
+
+
+# --- 1. Mart sintético ---
+
+def _weighted_list(pairs) -> str:
+    """Lista SQL com cada valor repetido pelo seu peso (sorteio por índice)."""
+    values = [value for value, weight in pairs for _ in range(weight)]
+    return "[" + ", ".join(repr(v) if isinstance(v, str) else str(v) for v in values) + "]"
+
+
+def snapshot_dir_for(mart_path: str) -> str:
+    """Diretório dos snapshots do mart sintético (ao lado do arquivo)."""
+    return os.path.splitext(os.path.abspath(mart_path))[0] + "_snapshots"
+
+
+def build_synthetic_mart(path: str, rows: int, stores: int = 50, months: int = 6, seed: float = 0.42,
+                         snapshot_dir: str = None):
+    """
+    Gera o mart sintético em 'path' (arquivo novo, trocado no fim). Os
+    snapshots vão para 'snapshot_dir' (padrão: snapshot_dir_for(path)),
+    não para o SNAPSHOT_DIR relativo ao diretório atual.
+    """
+    snapshot_dir = snapshot_dir or snapshot_dir_for(path)
+    tmp_path = path + ".building"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    customers = max(rows // 5, 100)
+    products = 120
+    days = months * 30
+    hours = _weighted_list(HOUR_WEIGHTS.items())
+    channels = _weighted_list((i, w) for i, (_, _, w) in enumerate(CHANNELS))
+    channel_names = "[" + ", ".join(repr(c[0]) for c in CHANNELS) + "]"
+    channel_types = "[" + ", ".join(repr(c[1]) for c in CHANNELS) + "]"
+    payments = "[" + ", ".join(repr(p) for p in PAYMENT_TYPES) + "]"
+    weekdays = "['Domingo', 'Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta', 'Sábado']"
+
+    print(f"Gerando mart sintético: {rows} vendas, {stores} lojas, {months} meses -> {path}")
+    start = time.perf_counter()
+    conn = duckdb.connect(tmp_path)
+    conn.execute(f"SELECT setseed({seed})")
+    conn.execute(f"""
+    CREATE TABLE fct_sales AS
+    WITH base AS (
+        SELECT
+            i AS sale_id,
+            TIMESTAMP '2025-05-01'
+                + INTERVAL (CAST(floor(random() * {days}) AS INTEGER)) DAY
+                + INTERVAL ({hours}[CAST(floor(random() * len({hours})) AS INTEGER) + 1]) HOUR
+                + INTERVAL (CAST(floor(random() * 3600) AS INTEGER)) SECOND AS sale_created_at,
+            {channels}[CAST(floor(random() * len({channels})) AS INTEGER) + 1] AS channel_idx,
+            CAST(floor(pow(random(), 1.6) * {stores}) AS INTEGER) + 1 AS store_idx,
+            random() AS r_amount, random() AS r_customer, random() AS r_misc
+        FROM range({rows}) t(i)
+    )
+    SELECT
+        sale_id,
+        sale_created_at,
+        CAST(dayofweek(sale_created_at) AS DOUBLE) AS dia_da_semana,
+        {weekdays}[dayofweek(sale_created_at) + 1] AS dia_da_semana_nome,
+        strftime(sale_created_at, '%Y-%m') AS mes_ano,
+        CAST(hour(sale_created_at) AS DOUBLE) AS hora_do_dia,
+        CAST(sale_created_at AS DATE) AS data_venda,
+        CASE
+            WHEN hour(sale_created_at) BETWEEN 0 AND 5 THEN 'Madrugada'
+            WHEN hour(sale_created_at) BETWEEN 6 AND 11 THEN 'Manhã'
+            WHEN hour(sale_created_at) BETWEEN 12 AND 17 THEN 'Almoço'
+            ELSE 'Jantar'
+        END AS periodo_do_dia,
+        'COMPLETED' AS sale_status_desc,
+        CAST(round(25 + r_amount * r_amount * 200, 2) AS DECIMAL(10, 2)) AS sale_total_amount,
+        CAST(CASE WHEN r_misc < 0.15 THEN round(r_amount * 20, 2) ELSE 0 END AS DECIMAL(10, 2)) AS total_discount,
+        CASE WHEN r_misc < 0.15 THEN 'Cupom' END AS discount_reason,
+        CAST(CASE WHEN {channel_types}[channel_idx + 1] = 'D' THEN 5 + round(r_misc * 10, 2) ELSE 0 END AS DECIMAL(10, 2)) AS delivery_fee,
+        CAST(0 AS DECIMAL(10, 2)) AS service_tax_fee,
+        CAST(300 + floor(r_misc * 1500) AS INTEGER) AS production_seconds,
+        CASE WHEN {channel_types}[channel_idx + 1] = 'D'
+             THEN CAST(900 + floor(r_amount * 1800 + r_misc * 900) AS INTEGER) END AS delivery_seconds,
+        store_idx AS store_id,
+        'Loja ' || store_idx AS store_name,
+        'Cidade ' || (store_idx % 8 + 1) AS store_city,
+        channel_idx + 1 AS channel_id,
+        {channel_names}[channel_idx + 1] AS channel_name,
+        {channel_types}[channel_idx + 1] AS channel_type,
+        CASE WHEN r_customer < 0.7 THEN CAST(floor(pow(r_customer / 0.7, 2) * {customers}) AS INTEGER) + 1 END AS customer_id,
+        CASE WHEN {channel_types}[channel_idx + 1] = 'D' THEN 'Bairro ' || CAST(floor(r_misc * 60) AS INTEGER) + 1 END AS delivery_neighborhood,
+        CASE WHEN {channel_types}[channel_idx + 1] = 'D' THEN 'Cidade ' || (store_idx % 8 + 1) END AS delivery_city,
+        {payments}[CAST(floor(r_misc * {len(PAYMENT_TYPES)}) AS INTEGER) + 1] AS payment_type
+    FROM base
+    ORDER BY sale_created_at
+    """)
+    conn.execute(f"""
+    CREATE TABLE fct_product_sales AS
+    WITH items AS (
+        SELECT s.*, unnest(range(CAST(1 + floor(random() * 3) AS BIGINT))) AS k
+        FROM fct_sales s
+    ),
+    picked AS (
+        SELECT *, CAST(floor(pow(random(), 2) * {products}) AS INTEGER) + 1 AS product_id,
+               CAST(1 + floor(random() * 2) AS INTEGER) AS quantity
+        FROM items
+    )
+    SELECT
+        sale_id, sale_created_at, mes_ano, data_venda, store_id, store_name, channel_id, channel_name, channel_type,
+        delivery_neighborhood,
+        product_id,
+        {repr(CATEGORIES)}[product_id % {len(CATEGORIES)} + 1] || ' ' || product_id AS product_name,
+        {repr(CATEGORIES)}[product_id % {len(CATEGORIES)} + 1] AS product_category,
+        CAST(quantity AS DOUBLE) AS product_quantity,
+        CAST(10 + product_id % 50 AS DECIMAL(10, 2)) AS product_base_price,
+        CAST((10 + product_id % 50) * quantity AS DECIMAL(10, 2)) AS product_total_price,
+        NULL::VARCHAR AS items_names
+    FROM picked
+    """)
+    conn.execute(f"""
+    CREATE TABLE dim_customers AS
+    SELECT i AS customer_id, 'Cliente ' || i AS nome_cliente, '(81) 9' || lpad(CAST(i AS VARCHAR), 8, '0') AS contato
+    FROM range(1, {customers} + 1) t(i)
+    """)
+
+    version = datetime.now().strftime("%Y%m%d%H%M%S")
+    for table in ("fct_sales", "fct_product_sales", "dim_customers"):
+        count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        etl.record_mart_version(conn, table, version, count)
+    conn.close()
+
+    # Mesmas etapas do etl.py depois da carga
+    etl.build_star_schema(tmp_path, mart_version=version)
+    etl.build_rollups(tmp_path, mart_version=version)
+    etl.build_rankings(tmp_path, mart_version=version)
+    etl.build_customer_rfm(tmp_path, mart_version=version)
+    etl.build_sample(tmp_path, mart_version=version)
+    etl.build_hll_sketches(tmp_path, mart_version=version)
+    etl.build_snapshots(tmp_path, mart_version=version, snapshot_dir=snapshot_dir)
+
+    os.replace(tmp_path, path)
+    print(f"✓ Mart sintético pronto em {time.perf_counter() - start:.1f}s ({path}).")
+
+
+# --- 2. Servidor ---
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mart_path: str, port: int, snapshot_dir: str = None) -> subprocess.Popen:
+    env = dict(os.environ, DUCKDB_FILE=os.path.abspath(mart_path), LOG_LEVEL="WARNING",
+               SNAPSHOT_DIR=snapshot_dir or snapshot_dir_for(mart_path))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base_url + "/", timeout=1).read()
+            return process
+        except (urllib.error.URLError, ConnectionError):
+            if process.poll() is not None:
+                raise RuntimeError("A API não subiu (veja o log acima).")
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("A API não respondeu em 30s.")
+
+
+# --- 3. Cenários ---
+
+class Client:
+    """Cliente HTTP de um usuário virtual: mede e registra cada requisição."""
+
+    def __init__(self, base_url: str, results: list, lock: threading.Lock, use_etag: bool, timeout: float):
+        self.base_url = base_url
+        self.results = results
+        self.lock = lock
+        self.use_etag = use_etag
+        self.timeout = timeout
+        self.etags = {}
+
+    def request(self, label: str, path: str, params: dict = None, body: dict = None):
+        url = self.base_url + path
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        headers = {"Accept-Encoding": "identity"}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        if self.use_etag and url in self.etags:
+            headers["If-None-Match"] = self.etags[url]
+
+        start = time.perf_counter()
+        status, payload = 0, b""
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers),
+                                        timeout=self.timeout) as response:
+                payload = response.read()
+                status = response.status
+                if self.use_etag and response.headers.get("ETag"):
+                    self.etags[url] = response.headers["ETag"]
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except (urllib.error.URLError, OSError):
+            status = 0
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self.lock:
+            self.results.append((label, status, elapsed_ms, len(payload)))
+        if status == 200 and payload:
+            try:
+                return json.loads(payload)
+            except ValueError:
+                return None
+        return None
+
+
+def _pick(values, fallback):
+    return random.choice(values) if values else fallback
+
+
+def scenario_dashboard(client: Client, ctx: dict):
+    """Home do dashboard: KPIs + gráficos principais."""
+    client.request("kpi_summary", "/api/v2/reports/kpi_summary")
+    client.request("sales_by_store", "/api/v2/reports/sales_by_store")
+    client.request("sales_by_channel", "/api/v2/reports/sales_by_channel")
+    client.request("sales_by_month", "/api/v2/reports/sales_by_month")
+    client.request("top_products_by_revenue", "/api/v2/reports/top_products_by_revenue")
+    client.request("worst_products_by_revenue", "/api/v2/reports/worst_products_by_revenue")
+    client.request("sales_by_payment_type", "/api/v2/reports/sales_by_payment_type")
+
+
+def scenario_funnel(client: Client, ctx: dict):
+    """Funil da loja: lista -> KPIs da loja -> meses -> dia a dia -> produtos/canais do mês."""
+    stores = client.request("stores_list", "/api/v2/data/stores_list") or []
+    store = _pick([s["store_name"] for s in stores], "Loja 1")
+    client.request("kpi_summary_for_store", "/api/v2/reports/kpi_summary_for_store", {"store_name": store})
+    months = client.request("sales_by_month_for_store", "/api/v2/reports/sales_by_month_for_store",
+                            {"store_name": store}) or []
+    month = _pick([m["mes_ano"] for m in months], "2025-06")
+    client.request("sales_by_day_stacked", "/api/v2/reports/sales_by_day_stacked",
+                   {"mes_ano": month, "store_name": store})
+    client.request("batch(store_month_detail)", "/api/v2/batch", body={"reports": [
+        {"report": "top_products_by_store", "params": {"store_name": store, "mes_ano": month}},
+        {"report": "sales_by_channel_detail", "params": {"store_name": store, "mes_ano": month}},
+    ]})
+
+
+def scenario_drilldown(client: Client, ctx: dict):
+    """Drill-downs avulsos e relatórios mais pesados."""
+    channel = random.choice(CHANNELS)[0]
+    store = f"Loja {random.randint(1, ctx['stores'])}"
+    month = f"2025-{random.randint(5, 10):02d}"
+    client.request("top_products_by_channel", "/api/v2/reports/top_products_by_channel", {"channel_name": channel})
+    client.request("top_products_by_store", "/api/v2/reports/top_products_by_store",
+                   random.choice([{"store_name": store}, {"store_name": store, "mes_ano": month}]))
+    client.request("sales_by_channel_detail", "/api/v2/reports/sales_by_channel_detail",
+                   {"store_name": store, "mes_ano": month})
+    client.request("delivery_by_neighborhood", "/api/v2/reports/delivery_by_neighborhood",
+                   {"order_by_asc": random.choice(["true", "false"])})
+    client.request("customer_segmentation", "/api/v2/reports/customer_segmentation",
+                   {"at_risk": random.choice(["true", "false"])})
+    client.request("unique_customers", "/api/v2/reports/unique_customers",
+                   {"group_by": random.choice(["store_name", "channel_name", "mes_ano"])})
+    client.request("sales_by_store(approx)", "/api/v2/reports/sales_by_store", {"approx": "true"})
+
+
+def scenario_compare(client: Client, ctx: dict):
+    """Comparação de um mês contra o anterior (geral, por loja ou por canal)."""
+    month = random.randint(6, 10)
+    params = {"date_from": f"2025-{month:02d}-01", "date_to": f"2025-{month:02d}-28",
+              "vs": random.choice(["previous_period", "previous_month"])}
+    params.update(random.choice([
+        {}, {"store_name": f"Loja {random.randint(1, ctx['stores'])}"}, {"channel_name": random.choice(CHANNELS)[0]},
+    ]))
+    client.request("compare", "/api/v2/reports/compare", params)
+
+
+def scenario_query(client: Client, ctx: dict):
+    """Dashboard personalizado: modelo da UI + /api/v2/query."""
+    client.request("query_model", "/api/v2/query/model")
+    dimensions = random.choice([["store_name"], ["channel_name", "mes_ano"], ["forma_pagamento"], ["hora_do_dia"]])
+    client.request("query", "/api/v2/query", body={
+        "fact": "sales",
+        "dimensions": dimensions,
+        "measures": random.sample(["faturamento", "total_vendas", "ticket_medio", "tempo_entrega"], 2),
+        "limit": 100,
+    })
+
+
+def scenario_batch(client: Client, ctx: dict):
+    """Home carregada numa requisição só."""
+    client.request("batch(dashboard)", "/api/v2/batch", body={"reports": [
+        {"report": name} for name in
+        ("kpi_summary", "sales_by_store", "sales_by_channel", "sales_by_month", "sales_by_payment_type")
+    ]})
+
+
+def scenario_export(client: Client, ctx: dict):
+    """Exportação de um mês de uma loja."""
+    month = random.randint(5, 10)
+    client.request("export", "/api/v2/export", {
+        "store_name": f"Loja {random.randint(1, ctx['stores'])}",
+        "date_from": f"2025-{month:02d}-01", "date_to": f"2025-{month:02d}-28",
+        "format": random.choice(["csv", "ndjson"]),
+    })
+
+
+def scenario_monitor(client: Client, ctx: dict):
+    """Monitoramento: contadores do cache, slow queries e scrape do Prometheus."""
+    client.request("cache_stats", "/api/v2/cache/stats")
+    client.request("slow_queries", "/api/v2/admin/slow_queries", {"limit": 5})
+    client.request("metrics", "/metrics")
+
+
+SCENARIOS = {
+    "dashboard": scenario_dashboard,
+    "funnel": scenario_funnel,
+    "drilldown": scenario_drilldown,
+    "compare": scenario_compare,
+    "query": scenario_query,
+    "batch": scenario_batch,
+    "export": scenario_export,
+    "monitor": scenario_monitor,
+}
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Cenário desconhecido: '{name}'. Use {sorted(SCENARIOS)}.")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+# --- 4. Execução e relatório ---
+
+def _percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return round(sorted_values[index], 3)
+
+
+def _summary(samples: list, duration: float) -> dict:
+    latencies = sorted(ms for _, status, ms, _ in samples)
+    errors = sum(1 for _, status, _, _ in samples if status == 0 or status >= 400)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "throughput_rps": round(len(samples) / duration, 2) if duration else 0.0,
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "max_ms": round(latencies[-1], 3) if latencies else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        "bytes": sum(size for _, _, _, size in samples),
+        "status": {str(s): sum(1 for _, status, _, _ in samples if status == s)
+                   for s in sorted({status for _, status, _, _ in samples})},
+    }
+
+
+def run_load(base_url: str, concurrency: int, duration: float, mix: dict, stores: int,
+             use_etag: bool = False, timeout: float = 30.0, warmup: float = 0.0) -> dict:
+    results, lock = [], threading.Lock()
+    scenario_counts = {name: 0 for name in mix}
+    names, weights = list(mix), list(mix.values())
+
+    def user(deadline: float):
+        client = Client(base_url, results, lock, use_etag, timeout)
+        ctx = {"stores": stores}
+        while time.monotonic() < deadline:
+            name = random.choices(names, weights)[0]
+            SCENARIOS[name](client, ctx)
+            with lock:
+                scenario_counts[name] += 1
+
+    if warmup:
+        print(f"Aquecendo por {warmup:.0f}s...")
+        _run_users(user, concurrency, warmup)
+        results.clear()
+        scenario_counts.update({name: 0 for name in mix})
+
+    print(f"Carga: {concurrency} usuários, {duration:.0f}s, mix {mix}")
+    start = time.perf_counter()
+    _run_users(user, concurrency, duration)
+    elapsed = time.perf_counter() - start
+
+    by_endpoint = {}
+    for sample in results:
+        by_endpoint.setdefault(sample[0], []).append(sample)
+    return {
+        "duration_s": round(elapsed, 3),
+        "scenarios": scenario_counts,
+        "totals": _summary(results, elapsed),
+        "endpoints": {label: _summary(samples, elapsed) for label, samples in sorted(by_endpoint.items())},
+    }
+
+
+def _run_users(user, concurrency: int, duration: float):
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=user, args=(deadline,), daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga da Analytics API v2.")
+    parser.add_argument("--mart", default="loadtest.duckdb", help="Arquivo do mart sintético.")
+    parser.add_argument("--rows", type=int, default=200000, help="Vendas no mart sintético.")
+    parser.add_argument("--stores", type=int, default=50)
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--skip-build", action="store_true", help="Reaproveita o --mart existente.")
+    parser.add_argument("--url", help="API já rodando (senão sobe uma com o --mart).")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=5, help="Segundos de aquecimento (fora do relatório).")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Pesos dos cenários (padrão: {DEFAULT_MIX}).")
+    parser.add_argument("--etag", action="store_true", help="Reenvia If-None-Match como um navegador.")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="loadtest_report.json")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    mix = parse_mix(args.mix)
+
+    if not args.skip_build and not args.url:
+        build_synthetic_mart(args.mart, args.rows, args.stores, args.months, seed=(args.seed % 100) / 100)
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        port = _free_port()
+        server = start_server(args.mart, port)
+        base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        report = run_load(base_url, args.concurrency, args.duration, mix, args.stores,
+                          use_etag=args.etag, timeout=args.timeout, warmup=args.warmup)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    report = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "url": args.url or "local", "mart": args.mart, "rows": args.rows, "stores": args.stores,
+            "months": args.months, "concurrency": args.concurrency, "duration_s": args.duration,
+            "mix": mix, "etag": args.etag,
+        },
+        **report,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    totals = report["totals"]
+    print(f"\n{totals['requests']} requisições | {totals['throughput_rps']} req/s | "
+          f"p50 {totals['p50_ms']}ms p95 {totals['p95_ms']}ms p99 {totals['p99_ms']}ms | "
+          f"erros {totals['error_rate']:.2%}")
+    print(f"Relatório: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
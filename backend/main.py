@@ -1,17 +1,41 @@
-import duckdb
+import asyncio
+import calendar
+import itertools
 import os                 
-import psycopg2           
-import pandas as pd
-from fastapi import FastAPI, HTTPException
+from datetime import date, timedelta
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Literal, Optional
 from dotenv import load_dotenv 
 
+from aggregates import FACTS, ROLLUPS_BY_TABLE, AggregateQuery, Rollup, aggregate_router, compile_aggregate, compile_comparison, compile_partial, filter_parts, required_columns
+from batch import BatchItem, BatchReport, BatchRequest, execute_group, group_by_source
+from cache import HTTP_CACHE_CONTROL, MISS, etag_matches, make_etag, report_cache
+from database import mart
+from encoding import (FORMAT_ARROW, QueryResult, accepted_encodings, dumps, encode_response, json_payload,
+                      response_format)
+from executor import executor, single_flight
+from metrics import logger, mark_streaming, metrics, phase, record_rows
+import export
+import hll
+from approx import SAMPLE_TABLE, EstimateQuery, Ratio, Total, compile_estimate
+import live
+from lake import parquet_lake
+from slowlog import slow_queries
+from snapshots import SNAPSHOT_QUERIES, snapshot_store
+from shards import shard_set
+from semantic import SemanticQuery, check_cost, compile_semantic_query
+
 load_dotenv()
 POSTGRES_DB_URL = os.getenv("DATABASE_URL")
 if not POSTGRES_DB_URL:
     print("ALERTA: DATABASE_URL do Postgres não encontrada no .env")
 
+# Conexões com o Postgres reaproveitadas entre requisições
+pg_pool = live.PostgresPool(POSTGRES_DB_URL)
+
 # --- Configuração da API ---
 app = FastAPI(
     title="Analytics API v2 (Curada)",
@@ -28,421 +52,890 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# --- Conexão com o DuckDB ---
-DUCKDB_FILE = 'analytics.duckdb'
+# Respostas que só dependem da versão do mart + parâmetros (ETag / 304)
+HTTP_CACHED_PREFIXES = ("/api/v2/reports/", "/api/v2/data/")
+# Relatórios que dependem da data de hoje, além dos dados do mart
+HTTP_DAILY_PATHS = ("/api/v2/reports/customer_segmentation",)
+
+def with_lake_version(version: Optional[str]) -> Optional[str]:
+    """
+    Versão dos dados servidos (cache e ETag). Com o lake servindo
+    relatórios, a versão dele entra também: o ETL publica o mart antes de
+    exportar o lake e, nesse intervalo, os relatórios do lake ainda são da
+    geração anterior. Quando o lake novo chega a versão muda de novo.
+    """
+    lake_version = parquet_lake.current_version()
+    if lake_version is None or lake_version == version:
+        return version
+    if version is None:
+        return lake_version
+    return f"{version}+lake{lake_version}"
+
+def _http_version(path: str) -> Optional[str]:
+    """Versão do ETag: a dos dados servidos e, nos relatórios diários, a data de hoje."""
+    # Antes do mart ser aberto (ou num nó só com o lake), a versão vem dos snapshots ou do lake
+    version = with_lake_version(mart.current_version() or snapshot_store.current_version())
+    if version is not None and path in HTTP_DAILY_PATHS:
+        return f"{version}@{date.today().isoformat()}"
+    return version
+
+@app.middleware("http")
+async def http_cache(request: Request, call_next):
+    """
+    ETag = versão do mart + parâmetros. Se o cliente já tem essa versão
+    (If-None-Match), responde 304 sem ir ao DuckDB. O modo híbrido fica de
+    fora: a fatia ao vivo muda a cada venda.
+    """
+    if request.method != "GET" or not request.url.path.startswith(HTTP_CACHED_PREFIXES) \
+            or request.query_params.get("mode") == "hybrid":
+        return await call_next(request)
+
+    accept = request.headers.get("accept", "")
+    version = _http_version(request.url.path)
+    if version is not None:
+        etag = make_etag(version, request.url.path, request.url.query, accept)
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": HTTP_CACHE_CONTROL})
+
+    response = await call_next(request)
+
+    # Só marca a resposta se o mart não mudou durante a requisição
+    # (version None = o mart foi (re)aberto por esta própria requisição)
+    served_version = _http_version(request.url.path)
+    if response.status_code == 200 and served_version is not None and version in (None, served_version):
+        response.headers["ETag"] = make_etag(served_version, request.url.path, request.url.query, accept)
+        response.headers["Cache-Control"] = HTTP_CACHE_CONTROL
+        vary = response.headers.get("Vary")
+        response.headers["Vary"] = f"{vary}, Accept" if vary else "Accept"
+    return response
+
+def _route_label(request: Request) -> str:
+    # Rótulo = rota (ex.: /api/v2/reports/sales_by_store), não a URL crua
+    return getattr(request.scope.get("route"), "path", "unmatched")
+
+async def _finish_after_body(body_iterator, request: Request, trace, status: int):
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        metrics.finish_request(trace, _route_label(request), status)
+
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    """Latência, status e fases de cada requisição (/metrics + log estruturado)."""
+    trace = metrics.start_request(request.method, request.url.path, request.url.query)
+    try:
+        response = await call_next(request)
+    except BaseException:
+        metrics.finish_request(trace, _route_label(request), 500)
+        raise
+    if trace.streaming:
+        # Export: as linhas só são conhecidas quando o stream termina
+        response.body_iterator = _finish_after_body(response.body_iterator, request, trace, response.status_code)
+    else:
+        metrics.finish_request(trace, _route_label(request), response.status_code)
+    return response
+
+@app.on_event("startup")
+def open_postgres():
+    # Conecta em segundo plano: o modo híbrido nunca paga o connect na requisição
+    pg_pool.start()
+
+@app.on_event("shutdown")
+def close_mart():
+    executor.shutdown()
+    shard_set.shutdown()
+    slow_queries.shutdown()
+    mart.close()
+    pg_pool.close()
+
+# --- Queries dos Relatórios ---
+# Todas as queries ficam declaradas aqui, com parâmetros posicionais (?),
+# e são executadas pelo nome. Nenhum valor vindo da requisição é
+# concatenado no SQL.
+# (As queries em SQL "puro" abaixo usam colunas que não estão nos rollups.)
+
+def _customer_stats_query(order_clause: str, at_risk: bool) -> str:
+    # customer_rfm é montada pelo ETL (nome, contato, vendas e última compra).
+    # Dias sem comprar e o flag em_risco dependem da data de hoje (o ?):
+    # calculados na consulta, não congelados no dia do ETL.
+    where_clause = "WHERE em_risco" if at_risk else ""
+    return f"""
+    WITH rfm AS (
+        SELECT
+            *,
+            CAST(? AS DATE) - ultima_compra_data AS dias_sem_comprar,
+            total_vendas >= 3 AND CAST(? AS DATE) - ultima_compra_data > 30 AS em_risco
+        FROM customer_rfm
+    )
+    SELECT
+        nome_cliente,
+        contato,
+        total_vendas,
+        ultima_compra_data
+    FROM rfm
+    {where_clause}
+    ORDER BY total_vendas {order_clause}, customer_id
+    LIMIT 100;
+    """
+
+def _delivery_by_neighborhood_query(order_clause: str) -> str:
+    return f"""
+    SELECT
+        delivery_neighborhood,
+        AVG(delivery_seconds / 60) AS tempo_medio_min,
+        COUNT(sale_id) AS total_entregas
+    FROM fct_sales
+    WHERE channel_id IN (SELECT channel_id FROM dim_channel WHERE channel_type = 'D')
+      AND delivery_neighborhood IS NOT NULL
+    GROUP BY delivery_neighborhood
+    HAVING total_entregas > 5
+    ORDER BY tempo_medio_min {order_clause}
+    LIMIT 20;
+    """
+
+# Relatórios de agregação: o SQL é gerado pelo AggregateRouter, que lê a
+# menor tabela (rollup ou fato) que tenha as dimensões e filtros pedidos.
+# Os filtros viram parâmetros (?) na ordem em que aparecem.
+# (product_name no ORDER BY desempata produtos com o mesmo faturamento,
+# para o resultado não depender da tabela escolhida.)
+_TOP_PRODUCTS = dict(
+    dimensions=("product_name",),
+    measures=("faturamento", "quantidade"),
+    order_by=(("faturamento", "DESC"), ("product_name", "ASC")),
+    limit=20,
+)
+
+QUERIES = {
+    # Relatórios da página inicial: definidos em snapshots.py, que também
+    # os renderiza no fim do ETL
+    **SNAPSHOT_QUERIES,
+
+    "stores_list": AggregateQuery(
+        "sales", dimensions=("store_name",), order_by=(("store_name", "ASC"),)
+    ),
+
+    "sales_by_day_stacked": AggregateQuery(
+        "sales",
+        dimensions=("data_venda", "channel_name"),
+        measures=("faturamento",),
+        filters=("mes_ano",),
+        order_by=(("data_venda", "ASC"), ("channel_name", "ASC")),
+    ),
+
+    "sales_by_day_stacked_for_store": AggregateQuery(
+        "sales",
+        dimensions=("data_venda", "channel_name"),
+        measures=("faturamento",),
+        filters=("mes_ano", "store_name"),
+        order_by=(("data_venda", "ASC"), ("channel_name", "ASC")),
+    ),
+
+    "delivery_by_neighborhood_worst": _delivery_by_neighborhood_query("DESC"),
+    "delivery_by_neighborhood_best": _delivery_by_neighborhood_query("ASC"),
+
+    "sales_by_month_for_store": AggregateQuery(
+        "sales",
+        dimensions=("mes_ano",),
+        measures=("faturamento",),
+        filters=("store_name",),
+        order_by=(("mes_ano", "ASC"),),
+    ),
+
+    "top_products_by_channel": AggregateQuery("product_sales", filters=("channel_name",), **_TOP_PRODUCTS),
+    "top_products_by_store": AggregateQuery("product_sales", filters=("store_name",), **_TOP_PRODUCTS),
+    "top_products_by_store_month": AggregateQuery(
+        "product_sales", filters=("store_name", "mes_ano"), **_TOP_PRODUCTS
+    ),
+
+    "kpi_summary_for_store": AggregateQuery(
+        "sales",
+        measures=(
+            ("faturamento", "faturamento_total"),
+            "ticket_medio",
+            "total_vendas",
+            ("tempo_entrega", "avg_tempo_entrega_min"),
+        ),
+        filters=("store_name",),
+    ),
+
+    "sales_by_channel_detail": AggregateQuery(
+        "sales",
+        dimensions=("channel_name",),
+        measures=("faturamento",),
+        filters=("store_name", "mes_ano"),
+        order_by=(("faturamento", "DESC"),),
+    ),
+
+    "customer_stats_top": _customer_stats_query("DESC", at_risk=False),
+    "customer_stats_bottom": _customer_stats_query("ASC", at_risk=False),
+    "customer_stats_top_at_risk": _customer_stats_query("DESC", at_risk=True),
+    "customer_stats_bottom_at_risk": _customer_stats_query("ASC", at_risk=True),
+}
+
+# Versões aproximadas (?approx=true): estimativas sobre a amostra
+# estratificada (loja × mês) que o ETL guarda em smp_sales.
+APPROX_QUERIES = {
+    "sales_by_store": EstimateQuery(
+        "store_name",
+        measures=(Total("faturamento", "sale_total_amount"), Total("total_vendas", "1")),
+        order_by="faturamento DESC",
+    ),
+    "sales_by_month": EstimateQuery(
+        "mes_ano", measures=(Total("faturamento", "sale_total_amount"),), order_by="mes_ano ASC"
+    ),
+}
+for _order in ("DESC", "ASC"):
+    APPROX_QUERIES[f"delivery_by_neighborhood_{'worst' if _order == 'DESC' else 'best'}"] = EstimateQuery(
+        "delivery_neighborhood",
+        measures=(
+            Ratio("tempo_medio_min", "COALESCE(delivery_seconds / 60, 0)",
+                  "CASE WHEN delivery_seconds IS NULL THEN 0 ELSE 1 END"),
+            Total("total_entregas", "1"),
+        ),
+        where="channel_type = 'D' AND delivery_neighborhood IS NOT NULL",
+        having="total_entregas > 5",
+        order_by=f"tempo_medio_min {_order}",
+        limit=20,
+    )
+
+QUERIES.update({f"{name}_approx": compile_estimate(query) for name, query in APPROX_QUERIES.items()})
+
+def _execute_query(query_name: str, params: Optional[list] = None) -> QueryResult:
+    """Roda uma query (pelo nome) no DuckDB. Bloqueante: roda no executor."""
+    try:
+        cursor = mart.cursor()
+        query = QUERIES[query_name]
+        if isinstance(query, AggregateQuery):
+            version = mart.cursor_version()
+            plan = aggregate_router.plan(query, cursor, version)
+            if shard_set.available(cursor, version, mart.served_file, aggregate_router.table_rows(cursor, version)) \
+                    and shard_set.serves(query, params, plan.table):
+                return shard_set.execute(query, params)
+            return QueryResult.run(cursor, plan.sql, params, mart.new_cursor)
+        return QueryResult.run(cursor, query, params, mart.new_cursor)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar o Data Mart: {str(e)}")
+
+def _execute_lake(query_name: str, params: Optional[list] = None) -> QueryResult:
+    """Roda uma query (pelo nome) nos arquivos Parquet do lake. Bloqueante: roda no executor."""
+    try:
+        return parquet_lake.execute(QUERIES[query_name], params)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar o data lake: {str(e)}")
+
+async def _execute_and_store(cache_key: tuple, version, fn, *args):
+    result = await executor.run(fn, *args)
+    report_cache.put(cache_key, version, result)
+    return result
+
+async def run_cached(cache_key: tuple, fn, *args):
+    """
+    Devolve o resultado do cache (se a versão do mart não mudou) ou
+    executa fn(*args) no executor e guarda o resultado.
+    Requisições iguais que chegam enquanto a query roda (mesmo relatório,
+    parâmetros e versão do mart) aguardam essa mesma execução.
+    """
+    version = with_lake_version(mart.current_version())
+    result = report_cache.get(cache_key, version)
+    if result is MISS:
+        result = await single_flight.run(
+            (version, cache_key), str(cache_key[0]), _execute_and_store, cache_key, version, fn, *args
+        )
+    return result
+
+async def run_query(query_name: str, params: Optional[list] = None, fmt: str = "records"):
+    """Helper para rodar uma query no DuckDB (fora do event loop) e retornar no formato pedido."""
+    if parquet_lake.serves(query_name):
+        result = await run_cached((query_name, tuple(params or ()), "lake"), _execute_lake, query_name, params)
+    else:
+        result = await run_cached((query_name, tuple(params or ())), _execute_query, query_name, params)
+    return encode_response(result, fmt)
+
+# --- Modo Híbrido: mart + vendas de hoje (Postgres) ---
+
+_hybrid_ids = itertools.count(1)
+
+def _execute_hybrid(query_name: str, params: Optional[list] = None) -> tuple:
+    """
+    Soma as parciais do mart com as vendas posteriores à marca d'água do
+    mart, lidas ao vivo do Postgres. Se a fatia ao vivo não vier dentro do
+    orçamento, responde só com o mart. Bloqueante: roda no executor.
+    Retorna (resultado, marca d'água, se a fatia ao vivo entrou).
+    """
+    query = QUERIES[query_name]
+    cursor = mart.cursor()
+    version = mart.cursor_version()
+    watermark = live.mart_watermark(cursor, version)
+    columns = sorted(required_columns(query))
+
+    live_rows = None
+    since = live.live_since(watermark)
+    if since is None:
+        logger.warning(f"mart atrasado além de {live.LIVE_MAX_WINDOW_HOURS:g}h (marca d'água {watermark}). Respondendo só com o mart.")
+    elif live.supports(columns):
+        live_rows = live.fetch_live_partial(pg_pool, columns, since)
+    if not live_rows:
+        return _execute_query(query_name, params), watermark, live_rows is not None
 
-def run_query(query: str):
-    """Helper para rodar uma query no DuckDB e retornar como JSON."""
     try:
-        conn = duckdb.connect(database=DUCKDB_FILE, read_only=True)
-        result = conn.execute(query).df().to_dict(orient='records')
-        conn.close()
-        return result
+        plan = aggregate_router.plan(query, cursor, version)
+        source = ROLLUPS_BY_TABLE.get(plan.table)
+        hybrid_table = f"hybrid_{next(_hybrid_ids)}"
+        # Parciais do mart já filtradas (como nos shards); as linhas ao vivo
+        # vêm sem filtro e são filtradas na agregação final, junto com elas
+        cursor.execute(f"CREATE OR REPLACE TEMP TABLE {hybrid_table} AS "
+                       + compile_partial(query.fact, columns, source, query.filters), params or [])
+        placeholders = ", ".join(["?"] * len(live_rows[0]))
+        cursor.executemany(f"INSERT INTO {hybrid_table} VALUES ({placeholders})", live_rows)
+        try:
+            sql = compile_aggregate(query, source=Rollup(hybrid_table, query.fact, tuple(columns)))
+            return QueryResult.run(cursor, sql, params), watermark, True
+        finally:
+            cursor.execute(f"DROP TABLE IF EXISTS {hybrid_table}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao consultar o Data Mart: {str(e)}")
 
+async def run_report(query_name: str, params: Optional[list] = None, fmt: str = "records", mode: str = "mart"):
+    """
+    run_query com o modo 'hybrid' opcional. O modo híbrido não usa cache
+    (a fatia ao vivo muda a cada venda) e informa nos headers se ela entrou.
+    """
+    if mode != "hybrid":
+        return await run_query(query_name, params, fmt=fmt)
+    result, watermark, live_included = await executor.run(_execute_hybrid, query_name, params)
+    response = encode_response(result, fmt)
+    response.headers["X-Data-Mode"] = "hybrid" if live_included else "mart"
+    if watermark is not None:
+        response.headers["X-Mart-Watermark"] = watermark.isoformat()
+    return response
+
+async def run_dashboard_report(query_name: str, fmt: str, accept_encoding: Optional[str], mode: str = "mart"):
+    """
+    Relatório da página inicial: o snapshot que o ETL deixou pronto (já
+    comprimido, sem DuckDB) quando ele vale para o mart atual; senão, o
+    caminho normal.
+    """
+    if mode == "mart":
+        response = snapshot_store.response(query_name, fmt, accept_encoding)
+        if response is not None:
+            return response
+    return await run_report(query_name, fmt=fmt, mode=mode)
+
+def _sample_available() -> bool:
+    cursor = mart.cursor()
+    return SAMPLE_TABLE in aggregate_router.table_rows(cursor, mart.cursor_version())
+
+async def run_approx(query_name: str, fmt: str = "records"):
+    """
+    Versão aproximada do relatório (estimativa + '<métrica>_margem_erro').
+    O header X-Approximate diz se a resposta veio da amostra; marts sem
+    amostra respondem o valor exato.
+    """
+    if not await executor.run(_sample_available):
+        response = await run_query(query_name, fmt=fmt)
+        response.headers["X-Approximate"] = "false"
+        return response
+    response = await run_query(f"{query_name}_approx", fmt=fmt)
+    response.headers["X-Approximate"] = "true"
+    return response
+
+# "mart" = só o Data Mart; "hybrid" = mart + vendas depois do último ETL
+DataMode = Literal["mart", "hybrid"]
+
 # --- Endpoints de Relatórios (Mapeados para o seu Roadmap) ---
 
 @app.get("/api/v2/reports/kpi_summary")
-async def get_kpi_summary():
-    """Retorna os KPIs principais (Cards)."""
-    query = """
-    SELECT
-        SUM(sale_total_amount) AS faturamento_total,
-        AVG(sale_total_amount) AS ticket_medio,
-        COUNT(sale_id) AS total_vendas,
-        AVG(delivery_seconds / 60) AS avg_tempo_entrega_min,
-        SUM(total_discount) AS total_descontos
-    FROM fct_sales;
+async def get_kpi_summary(mode: DataMode = "mart", fmt: str = Depends(response_format),
+                          accept_encoding: Optional[str] = Header(None)):
+    """
+    Retorna os KPIs principais (Cards).
+    mode=hybrid inclui as vendas feitas depois do último ETL.
     """
-    return run_query(query)
+    return await run_dashboard_report("kpi_summary", fmt, accept_encoding, mode=mode)
 
 
 @app.get("/api/v2/data/stores_list")
-async def get_stores_list():
+async def get_stores_list(fmt: str = Depends(response_format)):
     """
     Retorna uma lista simples de todos os nomes de lojas.
     Para o seu novo 'Select-box'.
     """
-    query = """
-    SELECT DISTINCT store_name
-    FROM fct_sales
-    ORDER BY store_name;
-    """
-    return run_query(query)
+    return await run_query("stores_list", fmt=fmt)
 
 
 @app.get("/api/v2/reports/sales_by_store")
-async def get_sales_by_store():
+async def get_sales_by_store(mode: DataMode = "mart", approx: bool = False, fmt: str = Depends(response_format),
+                             accept_encoding: Optional[str] = Header(None)):
     """QUAL LOJA VENDEU MAIS/MENOS"""
-    query = """
-    SELECT
-        store_name,
-        SUM(sale_total_amount) AS faturamento,
-        COUNT(sale_id) AS total_vendas
-    FROM fct_sales
-    GROUP BY store_name
-    ORDER BY faturamento DESC;
-    """
-    return run_query(query)
+    if approx:
+        return await run_approx("sales_by_store", fmt=fmt)
+    return await run_dashboard_report("sales_by_store", fmt, accept_encoding, mode=mode)
 
 @app.get("/api/v2/reports/sales_by_channel")
-async def get_sales_by_channel():
+async def get_sales_by_channel(mode: DataMode = "mart", fmt: str = Depends(response_format),
+                               accept_encoding: Optional[str] = Header(None)):
     """QUAL CANAL VENDEU MAIS/MENOS"""
-    query = """
-    SELECT
-        channel_name,
-        SUM(sale_total_amount) AS faturamento,
-        COUNT(sale_id) AS total_vendas
-    FROM fct_sales
-    GROUP BY channel_name
-    ORDER BY faturamento DESC;
-    """
-    return run_query(query)
+    return await run_dashboard_report("sales_by_channel", fmt, accept_encoding, mode=mode)
 
 @app.get("/api/v2/reports/sales_by_month")
-async def get_sales_by_month():
+async def get_sales_by_month(mode: DataMode = "mart", approx: bool = False, fmt: str = Depends(response_format),
+                             accept_encoding: Optional[str] = Header(None)):
     """QUAL MÊS EU VENDI MAIS/MENOS"""
-    query = """
-    SELECT
-        mes_ano,
-        SUM(sale_total_amount) AS faturamento
-    FROM fct_sales
-    GROUP BY mes_ano
-    ORDER BY mes_ano;
-    """
-    return run_query(query)
+    if approx:
+        return await run_approx("sales_by_month", fmt=fmt)
+    return await run_dashboard_report("sales_by_month", fmt, accept_encoding, mode=mode)
 
 @app.get("/api/v2/reports/top_products_by_revenue")
-async def get_top_products_by_revenue():
+async def get_top_products_by_revenue(fmt: str = Depends(response_format),
+                                      accept_encoding: Optional[str] = Header(None)):
     """QUAL PRODUTO MAIS VENDEU"""
-    query = """
-    SELECT
-        product_name,
-        SUM(product_total_price) AS faturamento
-    FROM fct_product_sales
-    GROUP BY product_name
-    ORDER BY faturamento DESC
-    LIMIT 20;
-    """
-    return run_query(query)
+    return await run_dashboard_report("top_products_by_revenue", fmt, accept_encoding)
 
 @app.get("/api/v2/reports/worst_products_by_revenue")
-async def get_worst_products_by_revenue():
+async def get_worst_products_by_revenue(fmt: str = Depends(response_format),
+                                        accept_encoding: Optional[str] = Header(None)):
     """
     QUAL PRODUTO MENOS VENDEU
     (O "oposto" do Top Produtos)
     """
-    query = """
-    SELECT
-        product_name,
-        SUM(product_total_price) AS faturamento
-    FROM fct_product_sales
-    GROUP BY product_name
-    ORDER BY faturamento ASC 
-    LIMIT 20;
-    """
-    return run_query(query)
+    return await run_dashboard_report("worst_products_by_revenue", fmt, accept_encoding)
 
 @app.get("/api/v2/reports/sales_by_payment_type")
-async def get_sales_by_payment_type():
+async def get_sales_by_payment_type(fmt: str = Depends(response_format),
+                                    accept_encoding: Optional[str] = Header(None)):
     """QUANTO EU VENDI EM..."""
-    query = """
-    SELECT
-        COALESCE(payment_type, 'Não Identificado') AS forma_pagamento,
-        SUM(sale_total_amount) AS faturamento
-    FROM fct_sales
-    GROUP BY forma_pagamento
-    ORDER BY faturamento DESC;
-    """
-    return run_query(query)
+    return await run_dashboard_report("sales_by_payment_type", fmt, accept_encoding)
 
 @app.get("/api/v2/reports/sales_by_day_stacked")
-async def get_sales_by_day_stacked(mes_ano: str, store_name: Optional[str] = None):
+async def get_sales_by_day_stacked(mes_ano: str, store_name: Optional[str] = None, mode: DataMode = "mart",
+                                   fmt: str = Depends(response_format)):
     """
     Feature: Gráfico clicável (Drill-down por mês).
     Retorna o faturamento por dia, empilhado por canal.
     AGORA TAMBÉM FILTRA POR LOJA, se 'store_name' for fornecido.
     """
-    print(f"Buscando dados de drill-down para: {mes_ano}, Loja: {store_name}")
     
-    # Lista de parâmetros para a query segura
-    params = [mes_ano]
-    
-    query = f"""
-    SELECT
-        data_venda,
-        channel_name,
-        SUM(sale_total_amount) AS faturamento
-    FROM fct_sales
-    WHERE mes_ano = ? 
-    """
-
-    # Adiciona o filtro de loja SÓ SE ele for passado
+    # Usa a variante com filtro de loja SÓ SE ele for passado
     if store_name:
-        query += " AND store_name = ? "
-        params.append(store_name)
-        
-    query += """
-    GROUP BY data_venda, channel_name
-    ORDER BY data_venda, channel_name;
-    """
-    
-    # --- Lógica de Execução com Parâmetros ---
-    try:
-        conn = duckdb.connect(database=DUCKDB_FILE, read_only=True)
-        # Passa a lista de parâmetros (1 ou 2)
-        result = conn.execute(query, params).df().to_dict(orient='records')
-        conn.close()
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao consultar o Data Mart: {str(e)}")
+        return await run_report("sales_by_day_stacked_for_store", [mes_ano, store_name], fmt=fmt, mode=mode)
+    return await run_report("sales_by_day_stacked", [mes_ano], fmt=fmt, mode=mode)
 
 @app.get("/api/v2/reports/delivery_by_neighborhood")
-async def get_delivery_by_neighborhood(order_by_asc: bool = False):
+async def get_delivery_by_neighborhood(order_by_asc: bool = False, approx: bool = False,
+                                       fmt: str = Depends(response_format)):
     """
     TEMPO MÉDIO POR BAIRRO
     Adicionado parâmetro 'order_by_asc' para Piores (False) ou Melhores (True).
+    approx=true responde pela amostra (com margem de erro).
     """
-    order_clause = "ASC" if order_by_asc else "DESC"
-    
-    query = f"""
-    SELECT
-        delivery_neighborhood,
-        AVG(delivery_seconds / 60) AS tempo_medio_min,
-        COUNT(sale_id) AS total_entregas
-    FROM fct_sales
-    WHERE channel_type = 'D' AND delivery_neighborhood IS NOT NULL
-    GROUP BY delivery_neighborhood
-    HAVING total_entregas > 5
-    ORDER BY tempo_medio_min {order_clause}
-    LIMIT 20;
-    """
-    return run_query(query)
+    query_name = "delivery_by_neighborhood_best" if order_by_asc else "delivery_by_neighborhood_worst"
+    if approx:
+        return await run_approx(query_name, fmt=fmt)
+    return await run_query(query_name, fmt=fmt)
 
 @app.get("/api/v2/reports/sales_by_month_for_store")
-async def get_sales_by_month_for_store(store_name: str):
+async def get_sales_by_month_for_store(store_name: str, fmt: str = Depends(response_format)):
     """
     Feature: Drill-down por Loja.
     Retorna o faturamento por mês para uma loja específica.
     """
-    print(f"Buscando dados de drill-down para a loja: {store_name}")
-    
-    query = f"""
-    SELECT
-        mes_ano,
-        SUM(sale_total_amount) AS faturamento
-    FROM fct_sales
-    WHERE store_name = ?  -- Filtra pela loja
-    GROUP BY mes_ano
-    ORDER BY mes_ano;
-    """
-    
-    try:
-        conn = duckdb.connect(database=DUCKDB_FILE, read_only=True)
-        # Passa o 'store_name' como um parâmetro seguro
-        result = conn.execute(query, [store_name]).df().to_dict(orient='records')
-        conn.close()
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao consultar o Data Mart: {str(e)}")
+    return await run_query("sales_by_month_for_store", [store_name], fmt=fmt)
 
 @app.get("/api/v2/reports/top_products_by_channel")
-async def get_top_products_by_channel(channel_name: str):
+async def get_top_products_by_channel(channel_name: str, fmt: str = Depends(response_format)):
     """
     Feature: Drill-down por Canal.
     Retorna o faturamento por produto para um canal específico.
     """
-    print(f"Buscando Top Produtos para o Canal: {channel_name}")
-    
-    query = f"""
-    SELECT
-        product_name,
-        SUM(product_total_price) AS faturamento,
-        SUM(product_quantity) AS quantidade
-    FROM fct_product_sales
-    WHERE channel_name = ?  -- Filtra pelo canal
-    GROUP BY product_name
-    ORDER BY faturamento DESC
-    LIMIT 20;
-    """
-    
-    try:
-        conn = duckdb.connect(database=DUCKDB_FILE, read_only=True)
-        result = conn.execute(query, [channel_name]).df().to_dict(orient='records')
-        conn.close()
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao consultar o Data Mart: {str(e)}")
+    return await run_query("top_products_by_channel", [channel_name], fmt=fmt)
 
 @app.get("/api/v2/reports/top_products_by_store")
-async def get_top_products_by_store(store_name: str, mes_ano: Optional[str] = None):
+async def get_top_products_by_store(store_name: str, mes_ano: Optional[str] = None, fmt: str = Depends(response_format)):
     """
     Feature B: Drill-down por Loja para Produtos.
     aceita um 'mes_ano' opcional para "cross-filtering".
     """
-    print(f"Buscando Top Produtos para Loja: {store_name}, Mês: {mes_ano}")
-    
-    params = [store_name] # Parâmetro 1 (obrigatório)
-    
-    query = f"""
-    SELECT
-        product_name,
-        SUM(product_total_price) AS faturamento,
-        SUM(product_quantity) AS quantidade
-    FROM fct_product_sales
-    WHERE store_name = ?  -- Filtra pela LOJA
-    """
     
     # --- (Cross-filter) ---
     if mes_ano:
-        query += " AND mes_ano = ? "
-        params.append(mes_ano) # Parâmetro 2 (opcional)
-        
-    query += """
-    GROUP BY product_name
-    ORDER BY faturamento DESC
-    LIMIT 20;
-    """
-    
-    try:
-        conn = duckdb.connect(database=DUCKDB_FILE, read_only=True)
-        # Passa a lista de parâmetros (1 ou 2)
-        result = conn.execute(query, params).df().to_dict(orient='records')
-        conn.close()
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao consultar o Data Mart: {str(e)}")
+        return await run_query("top_products_by_store_month", [store_name, mes_ano], fmt=fmt)
+    return await run_query("top_products_by_store", [store_name], fmt=fmt)
 
 @app.get("/api/v2/reports/kpi_summary_for_store")
-async def get_kpi_summary_for_store(store_name: str):
+async def get_kpi_summary_for_store(store_name: str, mode: DataMode = "mart", fmt: str = Depends(response_format)):
     """
     Feature: KPIs para o dashboard de detalhe da loja.
     """
-    print(f"Buscando KPIs para a Loja: {store_name}")
-    
-    query = f"""
-    SELECT
-        SUM(sale_total_amount) AS faturamento_total,
-        AVG(sale_total_amount) AS ticket_medio,
-        COUNT(sale_id) AS total_vendas,
-        AVG(delivery_seconds / 60) AS avg_tempo_entrega_min
-    FROM fct_sales
-    WHERE store_name = ?;
-    """
-    try:
-        conn = duckdb.connect(database=DUCKDB_FILE, read_only=True)
-        result = conn.execute(query, [store_name]).df().to_dict(orient='records')
-        conn.close()
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao consultar o Data Mart: {str(e)}")
+    return await run_report("kpi_summary_for_store", [store_name], fmt=fmt, mode=mode)
 
 @app.get("/api/v2/reports/sales_by_channel_detail")
-async def get_sales_by_channel_detail(store_name: str, mes_ano: str):
+async def get_sales_by_channel_detail(store_name: str, mes_ano: str, fmt: str = Depends(response_format)):
     """
     Drill-down Mês -> Canal
     Retorna o faturamento por canal PARA UMA LOJA E MÊS específicos.
     """
-    print(f"Buscando Vendas por Canal para Loja: {store_name}, Mês: {mes_ano}")
-    
-    params = [store_name, mes_ano]
-    
-    query = f"""
-    SELECT
-        channel_name,
-        SUM(sale_total_amount) AS faturamento
-    FROM fct_sales
-    WHERE store_name = ? AND mes_ano = ?
-    GROUP BY channel_name
-    ORDER BY faturamento DESC;
-    """
-    
+    return await run_query("sales_by_channel_detail", [store_name, mes_ano], fmt=fmt)
+
+# --- Comparação de Períodos ---
+
+COMPARE_MEASURES = (
+    ("faturamento", "faturamento_total"),
+    "ticket_medio",
+    "total_vendas",
+    ("tempo_entrega", "avg_tempo_entrega_min"),
+)
+
+def _shift_month(day: date, months: int) -> date:
+    """Mesmo dia N meses antes/depois (limitado ao último dia do mês)."""
+    month_index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(month_index, 12)
+    return date(year, month + 1, min(day.day, calendar.monthrange(year, month + 1)[1]))
+
+def resolve_periods(date_from: date, date_to: date, compare_from: Optional[date], compare_to: Optional[date],
+                    vs: str) -> tuple:
+    """((início, fim) atual, (início, fim) anterior). Erros de entrada viram 400."""
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from deve ser anterior ou igual a date_to.")
+    if (compare_from is None) != (compare_to is None):
+        raise HTTPException(status_code=400, detail="Informe compare_from e compare_to juntos.")
+    if compare_from is not None:
+        if compare_from > compare_to:
+            raise HTTPException(status_code=400, detail="compare_from deve ser anterior ou igual a compare_to.")
+        return (date_from, date_to), (compare_from, compare_to)
+    if vs == "previous_month":
+        return (date_from, date_to), (_shift_month(date_from, -1), _shift_month(date_to, -1))
+    # previous_period: mesmo número de dias, terminando na véspera de date_from
+    days = (date_to - date_from).days
+    return (date_from, date_to), (date_from - timedelta(days=days + 1), date_from - timedelta(days=1))
+
+def _execute_comparison(filters: tuple, params: list) -> QueryResult:
+    """Compara os dois períodos numa varredura do menor rollup que cobre os filtros. Bloqueante."""
+    query = AggregateQuery("sales", measures=COMPARE_MEASURES, filters=filters)
+    cursor = mart.cursor()
     try:
-        conn = duckdb.connect(database=DUCKDB_FILE, read_only=True)
-        result = conn.execute(query, params).df().to_dict(orient='records')
-        conn.close()
-        return result
+        source = ROLLUPS_BY_TABLE.get(aggregate_router.plan(query, cursor, mart.cursor_version()).table)
+        return QueryResult.run(cursor, compile_comparison(query, source), params, mart.new_cursor)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao consultar o Data Mart: {str(e)}")
 
+@app.get("/api/v2/reports/compare")
+async def compare_periods(
+    date_from: date,
+    date_to: date,
+    compare_from: Optional[date] = None,
+    compare_to: Optional[date] = None,
+    vs: Literal["previous_period", "previous_month"] = "previous_period",
+    store_name: Optional[str] = None,
+    channel_name: Optional[str] = None,
+    fmt: str = Depends(response_format),
+):
+    """
+    Feature: Comparar períodos e identificar tendências.
+    Faturamento, ticket médio, pedidos e tempo de entrega do período
+    [date_from, date_to] contra outro período: [compare_from, compare_to]
+    ou, sem eles, o período anterior de mesmo tamanho (vs=previous_period)
+    ou o mesmo período no mês anterior (vs=previous_month).
+    Uma linha por métrica com atual, anterior, delta e delta_pct.
+    """
+    current, previous = resolve_periods(date_from, date_to, compare_from, compare_to, vs)
+    filters, params = [], [*current, *previous]
+    for dimension, value in (("store_name", store_name), ("channel_name", channel_name)):
+        if value is not None:
+            filters.append(dimension)
+            params.append(value)
+    # Os dois períodos numa faixa só de data_venda (uma varredura)
+    filters += [("data_venda", ">="), ("data_venda", "<=")]
+    params += [min(current[0], previous[0]), max(current[1], previous[1])]
+
+    result = await run_cached(("compare", tuple(filters), tuple(params)), _execute_comparison, tuple(filters), params)
+    response = encode_response(result, fmt)
+    response.headers["X-Periodo-Atual"] = f"{current[0].isoformat()}/{current[1].isoformat()}"
+    response.headers["X-Periodo-Anterior"] = f"{previous[0].isoformat()}/{previous[1].isoformat()}"
+    return response
+
 @app.get("/api/v2/reports/customer_segmentation")
 async def get_customer_segmentation(
     order_by_asc: bool = False,
-    at_risk: bool = False
+    at_risk: bool = False,
+    fmt: str = Depends(response_format)
 ):
-    print(f"Buscando Clientes: order_by_asc={order_by_asc}, at_risk={at_risk}")
     
-    order_clause = "ASC" if order_by_asc else "DESC"
-    
-    having_clause = ""
+    query_name = "customer_stats_bottom" if order_by_asc else "customer_stats_top"
     if at_risk:
-        having_clause = """
-        HAVING 
-            COUNT(sale_id) >= 3 
-            AND MAX(DATE(sale_created_at)) < CURRENT_DATE - INTERVAL '30 days'
-        """
+        query_name += "_at_risk"
     
-    query_stats = f"""
-    SELECT
-        customer_id,
-        COUNT(sale_id) AS total_vendas,
-        MAX(DATE(sale_created_at)) AS ultima_compra_data
-    FROM fct_sales
-    WHERE customer_id IS NOT NULL
-    GROUP BY customer_id
-    {having_clause}
-    ORDER BY total_vendas {order_clause}
-    LIMIT 100;
+    # A data de hoje entra como parâmetro (e na chave do cache)
+    today = date.today()
+    return await run_query(query_name, [today, today], fmt=fmt)
+# --- Clientes Únicos (HyperLogLog) ---
+
+def _execute_unique_customers(group_by: Optional[str], filters: list, params: list) -> tuple:
     """
-    
-    conn_duckdb = None
-    conn_postgres = None
-    
+    Mescla os sketches HLL do recorte. Marts sem sketches respondem com a
+    contagem exata. Bloqueante: roda no executor. Retorna (resultado, aproximado?).
+    """
+    cursor = mart.cursor()
+    approximate = hll.HLL_TABLE in aggregate_router.table_rows(cursor, mart.cursor_version())
+    if approximate:
+        sql = hll.compile_unique_customers(group_by, filters)
+    else:
+        sql = hll.compile_exact_unique_customers(group_by, filters)
     try:
-        conn_duckdb = duckdb.connect(database=DUCKDB_FILE, read_only=True)
-        stats_df = conn_duckdb.execute(query_stats).fetchdf()
-        
-        if stats_df.empty:
-            return []
-
-        customer_ids = tuple(stats_df['customer_id'].tolist())
-
-        if not POSTGRES_DB_URL:
-            raise HTTPException(status_code=500, detail="DATABASE_URL do Postgres não configurada")
-        
-        conn_postgres = psycopg2.connect(POSTGRES_DB_URL)
-        cur = conn_postgres.cursor()
-        
-        query_details = """
-        SELECT
-            id,
-            customer_name,
-            COALESCE(phone_number, email) AS contato
-        FROM customers
-        WHERE id IN %s;
-        """
-        
-        cur.execute(query_details, (customer_ids,))
-        details_data = cur.fetchall()
-
-        details_df = pd.DataFrame(details_data, columns=['customer_id', 'nome_cliente', 'contato'])
-        
-        final_df = pd.merge(stats_df, details_df, on='customer_id')
-        
-        final_df = final_df[['nome_cliente', 'contato', 'total_vendas', 'ultima_compra_data']]
-        final_df['ultima_compra_data'] = final_df['ultima_compra_data'].astype(str)
-        
-        return final_df.to_dict(orient='records')
+        return QueryResult.run(cursor, sql, params, mart.new_cursor), approximate
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar o Data Mart: {str(e)}")
+
+@app.get("/api/v2/reports/unique_customers")
+async def get_unique_customers(
+    store_name: Optional[str] = None,
+    channel_name: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    group_by: Optional[Literal["store_name", "channel_name", "mes_ano", "data_venda"]] = None,
+    fmt: str = Depends(response_format),
+):
+    """
+    Feature: Clientes únicos por loja / canal / período.
+    Estimativa HyperLogLog (erro relativo em 'erro_relativo', ~0,8%),
+    calculada mesclando os sketches loja × dia × canal do ETL.
+    """
+    filters, params = [], []
+    for condition, value in (
+        ("store_name = ?", store_name),
+        ("channel_name = ?", channel_name),
+        ("data_venda >= ?", date_from),
+        ("data_venda <= ?", date_to),
+    ):
+        if value is not None:
+            filters.append(condition)
+            params.append(value)
 
+    result, approximate = await run_cached(
+        ("unique_customers", group_by, tuple(filters), tuple(params)),
+        _execute_unique_customers, group_by, filters, params,
+    )
+    response = encode_response(result, fmt)
+    response.headers["X-Approximate"] = "true" if approximate else "false"
+    return response
+
+# --- Consulta Semântica (dashboards personalizados) ---
+
+def _execute_semantic_query(query: AggregateQuery, params: list) -> QueryResult:
+    """Planeja (tabela + custo) e executa a consulta. Bloqueante: roda no executor."""
+    cursor = mart.cursor()
+    plan = aggregate_router.plan(query, cursor, mart.cursor_version())
+    check_cost(plan)
+    try:
+        return QueryResult.run(cursor, plan.sql, params, mart.new_cursor)
     except Exception as e:
-        print(f"ERRO SQL: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Erro ao gerar relatório de clientes: {str(e)}")
-    finally:
-        if conn_duckdb: conn_duckdb.close()
-        if conn_postgres: conn_postgres.close()
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar o Data Mart: {str(e)}")
+
+@app.post("/api/v2/query")
+async def run_semantic_query(body: SemanticQuery, fmt: str = Depends(response_format)):
+    """
+    Feature: Dashboards personalizados.
+    Recebe dimensões, métricas, filtros e limit (validados contra o modelo)
+    e responde pela menor tabela do mart que cobre o pedido.
+    """
+    query, params = compile_semantic_query(body)
+    result = await run_cached(("query", query, tuple(params)), _execute_semantic_query, query, params)
+    return encode_response(result, fmt)
+
+@app.get("/api/v2/query/model")
+async def get_query_model():
+    """O que pode ser pedido em /api/v2/query (para montar a UI)."""
+    return {
+        name: {
+            "dimensions": sorted(fact.dimensions),
+            "measures": sorted(fact.measures),
+        }
+        for name, fact in FACTS.items()
+    }
+# --- Execução em Lote (várias queries, uma requisição) ---
+# Relatório -> variantes. A variante usada é a que filtra exatamente
+# pelos parâmetros enviados (ex.: top_products_by_store com ou sem mes_ano).
+BATCH_REPORTS = {
+    "kpi_summary": ["kpi_summary"],
+    "stores_list": ["stores_list"],
+    "sales_by_store": ["sales_by_store"],
+    "sales_by_channel": ["sales_by_channel"],
+    "sales_by_month": ["sales_by_month"],
+    "top_products_by_revenue": ["top_products_by_revenue"],
+    "worst_products_by_revenue": ["worst_products_by_revenue"],
+    "sales_by_payment_type": ["sales_by_payment_type"],
+    "sales_by_day_stacked": ["sales_by_day_stacked", "sales_by_day_stacked_for_store"],
+    "sales_by_month_for_store": ["sales_by_month_for_store"],
+    "top_products_by_channel": ["top_products_by_channel"],
+    "top_products_by_store": ["top_products_by_store", "top_products_by_store_month"],
+    "kpi_summary_for_store": ["kpi_summary_for_store"],
+    "sales_by_channel_detail": ["sales_by_channel_detail"],
+}
+
+def resolve_batch_report(item: BatchReport) -> tuple:
+    """Converte {report, params} em (nome da query, parâmetros posicionais)."""
+    if item.report not in BATCH_REPORTS:
+        raise HTTPException(status_code=400, detail=f"Relatório não disponível em lote: '{item.report}'.")
+    sent = {k: v for k, v in item.params.items() if v is not None and v != ""}
+    for query_name in BATCH_REPORTS[item.report]:
+        names = [filter_parts(f)[0] for f in QUERIES[query_name].filters]
+        if set(names) == set(sent):
+            return query_name, [sent[n] for n in names]
+    raise HTTPException(status_code=400, detail=f"Parâmetros inválidos para '{item.report}': {sorted(sent)}")
+
+def _plan_batch(items: list) -> list:
+    """Escolhe a tabela de cada item e agrupa por tabela. Bloqueante: roda no executor."""
+    cursor = mart.cursor()
+    version = mart.cursor_version()
+    for item in items:
+        item.plan = aggregate_router.plan(item.query, cursor, version)
+    return group_by_source(items)
+
+def _run_batch_sql(cursor, sql: str, params: list, local: bool = False) -> QueryResult:
+    return QueryResult.run(cursor, sql, params, None if local else mart.new_cursor)
+
+def _execute_batch_group(group: list) -> dict:
+    """Executa um grupo (recorte compartilhado) no cursor deste thread."""
+    try:
+        return execute_group(mart.cursor(), group, _run_batch_sql)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar o Data Mart: {str(e)}")
+
+@app.post("/api/v2/batch")
+async def run_batch(body: BatchRequest, fmt: str = Depends(response_format)):
+    """
+    Feature: Vários relatórios numa requisição só (ex.: o detalhe do funil).
+    Relatórios que leem a mesma tabela com os mesmos filtros compartilham
+    uma única varredura; os demais grupos rodam em paralelo.
+    """
+    if fmt == FORMAT_ARROW:
+        raise HTTPException(status_code=400, detail="O lote responde em JSON (records ou columnar).")
+
+    resolved = [resolve_batch_report(item) for item in body.reports]
+    version = with_lake_version(mart.current_version())
+    results = [None] * len(resolved)
+    pending = []
+    for index, (query_name, params) in enumerate(resolved):
+        cached = report_cache.get((query_name, tuple(params)), version)
+        if cached is MISS:
+            pending.append(BatchItem(index, query_name, QUERIES[query_name], params))
+        else:
+            results[index] = cached
+
+    if pending:
+        groups = await executor.run(_plan_batch, pending)
+        outputs = await asyncio.gather(*(executor.run(_execute_batch_group, g) for g in groups))
+        for output in outputs:
+            for index, result in output.items():
+                results[index] = result
+                query_name, params = resolved[index]
+                report_cache.put((query_name, tuple(params)), version, result)
+
+    record_rows(sum(len(result) for result in results))
+    with phase("encode"):
+        payload = [
+            {"report": item.report, "params": item.params, "data": json_payload(result, fmt)}
+            for item, result in zip(body.reports, results)
+        ]
+        content = dumps(payload)
+    return Response(content=content, media_type="application/json")
+# --- Exportação (fatias dos fatos, em streaming) ---
+
+def _open_export(sql: str, params: list, fmt: str, gzip: bool) -> "export.ExportStream":
+    """Abre o cursor exclusivo e inicia a query. Bloqueante: roda fora do event loop."""
+    try:
+        return export.ExportStream(mart.new_cursor(), sql, params, fmt, gzip=gzip)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao consultar o Data Mart: {str(e)}")
+
+@app.get("/api/v2/export")
+async def export_facts(
+    request: Request,
+    table: Literal["sales", "product_sales"] = "sales",
+    store_name: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    channel_name: Optional[str] = None,
+    format: Literal["csv", "ndjson", "parquet"] = "csv",
+    accept_encoding: Optional[str] = Header(None),
+):
+    """
+    Feature: Exportar dados brutos (fct_sales / fct_product_sales).
+    Filtra por loja, período (data_venda) e canal e envia em streaming
+    (CSV, NDJSON ou Parquet). CSV/NDJSON saem em gzip se o cliente aceitar.
+    """
+    sql, params = export.build_export_sql(table, store_name, date_from, date_to, channel_name)
+    media_type, extension = export.EXPORT_FORMATS[format]
+    gzip = format != "parquet" and "gzip" in accepted_encodings(accept_encoding)
+
+    export.acquire_slot()
+    try:
+        stream = await run_in_threadpool(_open_export, sql, params, format, gzip)
+    except BaseException:
+        export.release_slot()
+        raise
+
+    async def body():
+        try:
+            while True:
+                if await request.is_disconnected():
+                    logger.info(f"export cancelada table={table} rows={stream.rows}")
+                    break
+                chunk = await run_in_threadpool(stream.next_chunk)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            # Para a query se ela ainda estiver rodando (cliente saiu no meio)
+            stream.interrupt()
+            stream.close()
+            export.release_slot()
+            record_rows(stream.rows)
+
+    headers = {"Content-Disposition": f'attachment; filename="{table}.{extension}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    mark_streaming()
+    return StreamingResponse(body(), media_type=media_type, headers=headers)
 # --- FIM DOS ENDPOINTS ---
 
+@app.get("/api/v2/cache/stats")
+async def get_cache_stats():
+    """Contadores do cache de relatórios (hits, misses, tamanho...), dos snapshots, dos shards e do lake."""
+    return {**report_cache.stats(), "snapshots": snapshot_store.stats(), "shards": shard_set.stats(),
+            "lake": parquet_lake.stats()}
+
+@app.get("/api/v2/admin/slow_queries")
+async def get_slow_queries(limit: int = 20, order_by: Literal["total_ms", "max_ms", "count"] = "total_ms"):
+    """
+    Queries acima de SLOW_QUERY_MS, das piores para as melhores, com SQL,
+    parâmetros, tempos e o perfil do DuckDB (plano + operadores).
+    """
+    return {
+        "threshold_ms": slow_queries.threshold_ms,
+        "total_slow": slow_queries.total,
+        "queries": slow_queries.top(limit, order_by),
+    }
+
+@app.delete("/api/v2/admin/slow_queries")
+async def clear_slow_queries():
+    slow_queries.clear()
+    return {"status": "ok"}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Métricas no formato texto do Prometheus."""
+    gauges = {
+        "api_queries_in_flight": ("Queries rodando no executor do DuckDB.", executor.in_flight),
+        "api_queries_shared_in_flight": ("Execuções em voo que aceitam requisições coalescidas.", single_flight.in_flight()),
+        "api_cache_entries": ("Entradas no cache de relatórios.", report_cache.stats()["entries"]),
+        "api_slow_queries": ("Queries acima de SLOW_QUERY_MS desde o início.", slow_queries.total),
+    }
+    return Response(content=metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def read_root():
-    return {"status": "Analytics API está no ar!"}
\ No newline at end of file
+    return {"status": "Analytics API está no ar!"}  
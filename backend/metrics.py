@@ -0,0 +1,225 @@
+"""
+Métricas e tracing da API (/metrics).
+
+- Histogramas de latência por endpoint e por fase (connect, execute,
+  fetch, encode, postgres), linhas devolvidas, queries coalescidas e
+  requisições/queries em voo, no formato texto do Prometheus.
+- Uma linha de log estruturada (chave=valor) por requisição, com o tempo
+  de cada fase.
+- Opcional: TRACE_FILE grava um JSON por requisição com os spans
+  (fase, início relativo e duração), para análise offline.
+
+As fases são medidas com 'with phase("execute"):' em qualquer ponto do
+código, inclusive nos threads do executor: o trace da requisição atual
+viaja num contextvar.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+# --- Configuração ---
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger("analytics")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.total += seconds
+        self.count += 1
+
+    def lines(self, name: str, labels: str) -> list:
+        sep = "," if labels else ""
+        lines, cumulative = [], 0
+        for bound, n in zip(LATENCY_BUCKETS, self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class RequestTrace:
+    """Spans de uma requisição (compartilhado entre o event loop e os threads)."""
+
+    def __init__(self, method: str, path: str, query: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.query = query
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self.spans = []
+        self.rows = 0
+        self.streaming = False  # corpo em streaming: o trace fecha quando ele termina
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, seconds: float):
+        with self._lock:
+            self.spans.append((name, start - self.start, seconds, threading.current_thread().name))
+
+    def phase_totals(self) -> dict:
+        totals = {}
+        for name, _, seconds, _ in self.spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+
+_current: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("request_trace", default=None)
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}      # endpoint -> Histogram
+        self.requests = {}     # (endpoint, status) -> n
+        self.rows = {}         # endpoint -> linhas devolvidas
+        self.phases = {}       # fase -> Histogram
+        self.coalesced = {}    # query -> requisições que aguardaram uma execução já em voo
+        self.in_flight = 0
+        self._trace_lock = threading.Lock()
+
+    def start_request(self, method: str, path: str, query: str) -> RequestTrace:
+        trace = RequestTrace(method, path, query)
+        _current.set(trace)
+        with self._lock:
+            self.in_flight += 1
+        return trace
+
+    def finish_request(self, trace: RequestTrace, endpoint: str, status: int):
+        seconds = time.perf_counter() - trace.start
+        with self._lock:
+            self.in_flight -= 1
+            self.latency.setdefault(endpoint, Histogram()).observe(seconds)
+            self.requests[(endpoint, status)] = self.requests.get((endpoint, status), 0) + 1
+            self.rows[endpoint] = self.rows.get(endpoint, 0) + trace.rows
+
+        fields = [
+            f"trace={trace.trace_id}", f"method={trace.method}", f"endpoint={endpoint}",
+            f"status={status}", f"ms={seconds * 1000:.1f}", f"rows={trace.rows}",
+            *(f"{name}_ms={total * 1000:.1f}" for name, total in trace.phase_totals().items()),
+            f"params={trace.query or '-'}",
+        ]
+        logger.info("request " + " ".join(fields))
+        if TRACE_FILE:
+            self._write_trace(trace, endpoint, status, seconds)
+
+    def _write_trace(self, trace: RequestTrace, endpoint: str, status: int, seconds: float):
+        record = {
+            "trace_id": trace.trace_id,
+            "start": trace.started_at,
+            "method": trace.method,
+            "endpoint": endpoint,
+            "path": trace.path,
+            "query": trace.query,
+            "status": status,
+            "duration_ms": round(seconds * 1000, 3),
+            "rows": trace.rows,
+            "spans": [
+                {"name": name, "offset_ms": round(offset * 1000, 3),
+                 "duration_ms": round(duration * 1000, 3), "thread": thread}
+                for name, offset, duration, thread in trace.spans
+            ],
+        }
+        with self._trace_lock:
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def observe_phase(self, name: str, seconds: float):
+        with self._lock:
+            self.phases.setdefault(name, Histogram()).observe(seconds)
+
+    def observe_coalesced(self, query: str):
+        with self._lock:
+            self.coalesced[query] = self.coalesced.get(query, 0) + 1
+
+    def render(self, gauges: dict) -> str:
+        """Texto no formato de exposição do Prometheus."""
+        with self._lock:
+            lines = [
+                "# HELP api_request_duration_seconds Latência das requisições por endpoint.",
+                "# TYPE api_request_duration_seconds histogram",
+            ]
+            for endpoint, hist in sorted(self.latency.items()):
+                lines += hist.lines("api_request_duration_seconds", f'endpoint="{endpoint}"')
+            lines += ["# HELP api_requests_total Requisições por endpoint e status.",
+                      "# TYPE api_requests_total counter"]
+            for (endpoint, status), n in sorted(self.requests.items()):
+                lines.append(f'api_requests_total{{endpoint="{endpoint}",status="{status}"}} {n}')
+            lines += ["# HELP api_rows_returned_total Linhas devolvidas por endpoint.",
+                      "# TYPE api_rows_returned_total counter"]
+            for endpoint, n in sorted(self.rows.items()):
+                lines.append(f'api_rows_returned_total{{endpoint="{endpoint}"}} {n}')
+            lines += ["# HELP api_phase_duration_seconds Tempo por fase (connect, execute, fetch, encode, postgres, coalesced, snapshot).",
+                      "# TYPE api_phase_duration_seconds histogram"]
+            for name, hist in sorted(self.phases.items()):
+                lines += hist.lines("api_phase_duration_seconds", f'phase="{name}"')
+            lines += ["# HELP api_queries_coalesced_total Requisições que reaproveitaram uma query idêntica em voo.",
+                      "# TYPE api_queries_coalesced_total counter"]
+            for query, n in sorted(self.coalesced.items()):
+                lines.append(f'api_queries_coalesced_total{{query="{query}"}} {n}')
+            lines += ["# HELP api_requests_in_flight Requisições em andamento.",
+                      "# TYPE api_requests_in_flight gauge",
+                      f"api_requests_in_flight {self.in_flight}"]
+        for name, (help_text, value) in gauges.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def phase(name: str):
+    """Mede uma fase: vai para o histograma da fase e para o trace da requisição."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe_phase(name, seconds)
+        trace = _current.get()
+        if trace is not None:
+            trace.add_span(name, start, seconds)
+
+
+def record_rows(n: int):
+    """Linhas devolvidas na resposta da requisição atual."""
+    trace = _current.get()
+    if trace is not None:
+        trace.rows += n
+
+
+def mark_streaming():
+    """
+    A resposta da requisição atual sai em streaming: a latência, as linhas e
+    a linha de log só fecham quando o corpo terminar de ser enviado.
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.streaming = True
@@ -0,0 +1,201 @@
+"""
+Publicação blue/green do Data Mart.
+
+O ETL nunca escreve no arquivo que a API está lendo: cada execução gera
+uma "geração" nova em MART_DIR (analytics-<versão>.duckdb), valida e só
+então publica, trocando atomicamente o link simbólico DUCKDB_FILE
+(analytics.duckdb -> marts/analytics-<versão>.duckdb) com os.replace.
+
+Do lado da API (database.py), o link é resolvido uma vez por abertura: as
+requisições novas passam a ler a geração nova e as que já estavam rodando
+terminam na antiga (o arquivo continua aberto mesmo depois de apagado).
+
+marts/manifest.json registra a geração publicada e as anteriores; as mais
+antigas que MART_KEEP_GENERATIONS são apagadas. Os shards de uma geração
+(analytics-<versão>.shard<i>.duckdb, ver shards.py) são validados,
+publicados e apagados junto com ela.
+"""
+import glob
+import json
+import os
+import re
+from datetime import datetime
+from typing import Optional
+
+import duckdb
+
+from database import DUCKDB_FILE, MART_VERSION_SQL
+from shards import SHARD_MAP_TABLE, SHARDED_TABLES, shard_path
+from star import DIMENSION_TABLES
+
+# --- Configuração ---
+MART_DIR = os.getenv("MART_DIR", "marts")
+# Gerações mantidas em disco (a publicada + as anteriores, para rollback)
+MART_KEEP_GENERATIONS = int(os.getenv("MART_KEEP_GENERATIONS", "3"))
+MANIFEST_FILE = "manifest.json"
+
+# Tabelas sem as quais a geração não é publicada
+REQUIRED_TABLES = ("fct_sales", "fct_product_sales", "dim_customers", *DIMENSION_TABLES)
+# Arquivo de uma geração (os shards dela não casam)
+GENERATION_FILE_RE = re.compile(r"^analytics-\d+\.duckdb$")
+
+
+class InvalidMartError(Exception):
+    """A geração nova não passou na validação (não é publicada)."""
+
+
+def generation_path(version: str, mart_dir: str = MART_DIR) -> str:
+    """Arquivo da geração 'version' (ainda não publicada)."""
+    return os.path.join(mart_dir, f"analytics-{version}.duckdb")
+
+
+def validate_mart(path: str, required_tables: tuple = REQUIRED_TABLES) -> str:
+    """
+    Confere a geração antes de publicar: abre, checa o catálogo, confere
+    que as tabelas obrigatórias têm linhas e que cada tabela registrada em
+    'mart_version' tem a contagem registrada. Devolve a versão (como a API lê).
+    """
+    try:
+        conn = duckdb.connect(database=path, read_only=True)
+    except duckdb.Error as e:
+        raise InvalidMartError(f"não foi possível abrir {path}: {e}")
+
+    try:
+        tables = {row[0] for row in conn.execute("SELECT table_name FROM duckdb_tables()").fetchall()}
+        if "mart_version" not in tables:
+            raise InvalidMartError("tabela 'mart_version' ausente")
+        missing = [t for t in required_tables if t not in tables]
+        if missing:
+            raise InvalidMartError(f"tabelas ausentes: {', '.join(missing)}")
+
+        for table_name, row_count in conn.execute("SELECT table_name, row_count FROM mart_version").fetchall():
+            if table_name not in tables:
+                raise InvalidMartError(f"'{table_name}' está em mart_version mas não existe")
+            actual = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+            if row_count is not None and actual != row_count:
+                raise InvalidMartError(f"'{table_name}': {actual} linhas, esperado {row_count}")
+            if table_name in required_tables and actual == 0:
+                raise InvalidMartError(f"'{table_name}' está vazia")
+
+        if SHARD_MAP_TABLE in tables:
+            _validate_shards(conn, path)
+        return conn.execute(MART_VERSION_SQL).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _validate_shards(conn, path: str):
+    """
+    Cada shard do mapa existe, passa na mesma conferência de contagens e,
+    somados, os shards têm exatamente as linhas dos fatos do mart completo.
+    """
+    n_shards = conn.execute(f"SELECT COALESCE(MAX(shard) + 1, 0) FROM {SHARD_MAP_TABLE}").fetchone()[0]
+    totals = dict.fromkeys(SHARDED_TABLES, 0)
+    for shard in range(n_shards):
+        shard_file = shard_path(path, shard)
+        if not os.path.exists(shard_file):
+            raise InvalidMartError(f"shard {shard} ausente: {shard_file}")
+        try:
+            for table_name in totals:
+                totals[table_name] += validate_shard(shard_file, table_name)
+        except InvalidMartError as e:
+            raise InvalidMartError(f"shard {shard}: {e}")
+
+    for table_name, total in totals.items():
+        expected = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+        if total != expected:
+            raise InvalidMartError(f"'{table_name}': {total} linhas nos shards, esperado {expected}")
+
+
+def validate_shard(shard_file: str, table_name: str) -> int:
+    """Confere as contagens registradas no shard; devolve as linhas de 'table_name'."""
+    conn = duckdb.connect(database=shard_file, read_only=True)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT table_name FROM duckdb_tables()").fetchall()}
+        if table_name not in tables or "mart_version" not in tables:
+            raise InvalidMartError(f"tabela '{table_name}' ou 'mart_version' ausente")
+        for name, row_count in conn.execute("SELECT table_name, row_count FROM mart_version").fetchall():
+            actual = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0] if name in tables else None
+            if actual is None or (row_count is not None and actual != row_count):
+                raise InvalidMartError(f"'{name}': {actual} linhas, esperado {row_count}")
+        return conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def read_manifest(mart_dir: str = MART_DIR) -> dict:
+    try:
+        with open(os.path.join(mart_dir, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"current": None, "generations": []}
+
+
+def _write_manifest(manifest: dict, mart_dir: str):
+    path = os.path.join(mart_dir, MANIFEST_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def publish(path: str, version: str, mart_version: str, link: str = DUCKDB_FILE, mart_dir: str = MART_DIR) -> dict:
+    """
+    Publica a geração: troca o link 'link' para 'path' numa operação só
+    (link temporário + os.replace). Um 'link' que ainda é arquivo comum
+    (marts antigos) é substituído da mesma forma.
+    """
+    target = os.path.relpath(os.path.abspath(path), os.path.dirname(os.path.abspath(link)))
+    tmp_link = f"{link}.tmp-{os.getpid()}"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(target, tmp_link)
+    os.replace(tmp_link, link)
+
+    manifest = read_manifest(mart_dir)
+    generations = [g for g in manifest["generations"] if g["version"] != version]
+    current = {
+        "version": version,
+        "file": os.path.basename(path),
+        "mart_version": mart_version,
+        "bytes": os.path.getsize(path),
+        "published_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    manifest = {"current": current, "generations": [current, *generations]}
+    _write_manifest(manifest, mart_dir)
+    return manifest
+
+
+def collect_garbage(keep: int = MART_KEEP_GENERATIONS, link: str = DUCKDB_FILE, mart_dir: str = MART_DIR) -> list:
+    """
+    Apaga as gerações além das 'keep' mais novas (nunca a publicada).
+    Quem ainda estiver lendo uma delas continua lendo: o arquivo só some
+    de fato quando a última conexão com ele fecha.
+    """
+    current = os.path.realpath(link) if os.path.lexists(link) else None
+    files = sorted((f for f in os.listdir(mart_dir) if GENERATION_FILE_RE.match(f)), reverse=True)
+    removed = []
+    for name in files[max(keep, 1):]:
+        path = os.path.join(mart_dir, name)
+        if os.path.realpath(path) == current:
+            continue
+        discard(path)
+        removed.append(name)
+
+    if removed:
+        manifest = read_manifest(mart_dir)
+        manifest["generations"] = [g for g in manifest["generations"] if g["file"] not in removed]
+        _write_manifest(manifest, mart_dir)
+    return removed
+
+
+def discard(path: Optional[str]):
+    """Remove uma geração (e os shards dela) que não vai ser publicada ou já saiu de uso."""
+    if not path:
+        return
+    root, ext = os.path.splitext(path)
+    shards = glob.glob(f"{glob.escape(root)}.shard*{ext}")
+    for file in (path, *shards):
+        for leftover in (file, f"{file}.wal"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
@@ -0,0 +1,114 @@
+"""
+Consulta "semântica" (/api/v2/query).
+
+O cliente pede dimensões, métricas e filtros pelo NOME; tudo é validado
+contra o modelo declarado em aggregates.py e compilado para SQL
+parametrizado. Nada do corpo da requisição é concatenado no SQL.
+"""
+import os
+from typing import List, Literal, Union
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+
+from aggregates import FACTS, FILTER_OPERATORS, AggregateQuery
+
+# --- Limites ---
+SEMANTIC_MAX_LIMIT = int(os.getenv("SEMANTIC_MAX_LIMIT", "5000"))
+# Teto de custo: linhas que a tabela escolhida (rollup ou fato) vai varrer.
+SEMANTIC_MAX_ROWS_SCANNED = int(os.getenv("SEMANTIC_MAX_ROWS_SCANNED", "5000000"))
+
+FilterValue = Union[str, int, float, bool]
+
+
+class QueryFilter(BaseModel):
+    dimension: str
+    op: Literal["=", "!=", ">", ">=", "<", "<=", "in"] = "="
+    value: Union[FilterValue, List[FilterValue]]
+
+
+class QueryOrder(BaseModel):
+    field: str
+    direction: Literal["asc", "desc"] = "desc"
+
+
+class SemanticQuery(BaseModel):
+    fact: Literal["sales", "product_sales"] = "sales"
+    dimensions: List[str] = []
+    measures: List[str] = Field(..., min_length=1)
+    filters: List[QueryFilter] = []
+    order_by: List[QueryOrder] = []
+    limit: int = Field(100, ge=1, le=SEMANTIC_MAX_LIMIT)
+
+
+def _invalid(message: str):
+    raise HTTPException(status_code=400, detail=message)
+
+
+def compile_semantic_query(body: SemanticQuery) -> tuple:
+    """
+    Valida o pedido contra o modelo e devolve (AggregateQuery, params).
+    Erros de validação viram 400 com a lista do que é permitido.
+    """
+    fact = FACTS[body.fact]
+
+    for dimension in body.dimensions:
+        if dimension not in fact.dimensions:
+            _invalid(f"Dimensão inválida: '{dimension}'. Permitidas: {sorted(fact.dimensions)}")
+    for measure in body.measures:
+        if measure not in fact.measures:
+            _invalid(f"Métrica inválida: '{measure}'. Permitidas: {sorted(fact.measures)}")
+    if len(set(body.dimensions)) != len(body.dimensions) or len(set(body.measures)) != len(body.measures):
+        _invalid("Dimensões e métricas não podem se repetir.")
+
+    filters, params = [], []
+    for flt in body.filters:
+        if flt.dimension not in fact.dimensions:
+            _invalid(f"Filtro em dimensão inválida: '{flt.dimension}'.")
+        if flt.op not in FILTER_OPERATORS:
+            _invalid(f"Operador inválido: '{flt.op}'.")
+        if flt.op == "in":
+            values = flt.value if isinstance(flt.value, list) else [flt.value]
+            if not values:
+                _invalid(f"O filtro 'in' em '{flt.dimension}' precisa de ao menos um valor.")
+            filters.append((flt.dimension, "in", len(values)))
+            params.extend(values)
+        else:
+            if isinstance(flt.value, list):
+                _invalid(f"O operador '{flt.op}' espera um único valor.")
+            filters.append(flt.dimension if flt.op == "=" else (flt.dimension, flt.op))
+            params.append(flt.value)
+
+    selected = set(body.dimensions) | set(body.measures)
+    order_by = []
+    for order in body.order_by:
+        if order.field not in selected:
+            _invalid(f"Ordenação por '{order.field}': o campo precisa estar nas dimensões ou métricas.")
+        order_by.append((order.field, order.direction.upper()))
+    if not order_by:
+        order_by = [(body.measures[0], "DESC")]
+    # Desempate estável pelas dimensões (o resultado não depende da tabela lida)
+    order_by += [(d, "ASC") for d in body.dimensions if d not in {o[0] for o in order_by}]
+
+    query = AggregateQuery(
+        body.fact,
+        dimensions=tuple(body.dimensions),
+        measures=tuple(body.measures),
+        filters=tuple(filters),
+        order_by=tuple(order_by),
+        limit=body.limit,
+    )
+    return query, params
+
+
+def check_cost(plan):
+    """Recusa a consulta se a tabela escolhida passar do teto de linhas."""
+    if plan.estimated_rows > SEMANTIC_MAX_ROWS_SCANNED:
+        raise HTTPException(
+            status_code=400,
+            detail=(
+                f"Consulta muito cara: ~{plan.estimated_rows} linhas em '{plan.table}' "
+                f"(máximo {SEMANTIC_MAX_ROWS_SCANNED}). Use menos dimensões ou dimensões "
+                f"cobertas pelos rollups."
+            ),
+        )
@@ -0,0 +1,188 @@
+"""
+Marts fragmentados (shards) por loja, com scatter-gather.
+
+Com MART_SHARDS > 1 o ETL, além do mart completo, grava um arquivo por
+shard ao lado da geração (analytics-<versão>.shard<i>.duckdb) com as
+linhas dos fatos das lojas daquele shard (crc32(store_name) % N), e os
+rollups e rankings de cada um. A tabela 'shard_map' (loja -> shard) fica
+no mart completo e é publicada junto com ele: a troca de versão continua
+atômica.
+
+A API responde pelos shards só os relatórios de agregação em que eles
+ganham do mart completo:
+- filtro de UMA loja (store_name = ?): vai só para o shard dela, com o
+  mesmo SQL do mart completo (inclusive os rankings prontos), sobre
+  tabelas ~N vezes menores;
+- sem rollup nem ranking no mart completo que cubra a query (ela varreria
+  o fato): cada shard calcula, em paralelo, as parciais aditivas (somas e
+  contagens, no formato de um rollup) e o resultado final é calculado
+  sobre a união delas: somas e contagens somadas, médias como soma/contagem
+  e top-K re-ranqueado sobre os totais já somados.
+Uma query global que um rollup ou ranking já responde fica no mart
+completo: o scatter-gather só somaria N consultas e o merge a ela.
+"""
+import contextvars
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Optional
+
+import duckdb
+
+from aggregates import FACTS, AggregateQuery, AggregateRouter, Rollup, compile_aggregate, compile_partial, filter_parts
+from database import MartConnection
+from encoding import QueryResult, arrow_table
+from metrics import logger, phase
+
+try:
+    import pyarrow as pa
+except ImportError:  # Sem pyarrow: os shards ficam desligados (a API usa o mart completo)
+    pa = None
+
+# --- Configuração ---
+# Shards gravados pelo ETL (0 ou 1 = sem shards)
+MART_SHARDS = int(os.getenv("MART_SHARDS", "0"))
+# A API usa os shards quando o mart publicado os tem
+SHARDS_ENABLED = os.getenv("SHARDS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Threads que consultam os shards em paralelo
+SHARD_FANOUT_WORKERS = int(os.getenv("SHARD_FANOUT_WORKERS", "8"))
+
+SHARD_MAP_TABLE = "shard_map"
+# Fatos divididos entre os shards (os dois têm store_name)
+SHARDED_TABLES = ("fct_sales", "fct_product_sales")
+
+
+def shard_of(store_name: str, n_shards: int) -> int:
+    """Shard da loja (estável entre execuções do ETL)."""
+    return zlib.crc32(store_name.encode("utf-8")) % n_shards
+
+
+def shard_path(generation_file: str, shard: int) -> str:
+    """Arquivo do shard 'shard' da geração 'generation_file'."""
+    root, ext = os.path.splitext(generation_file)
+    return f"{root}.shard{shard}{ext}"
+
+
+def _single_store(query: AggregateQuery, params: list) -> Optional[str]:
+    """Valor do filtro store_name = ? da query, se houver."""
+    position = 0
+    for flt in query.filters:
+        dimension, op, n_values = filter_parts(flt)
+        if dimension == "store_name" and op == "=":
+            return params[position]
+        position += n_values
+    return None
+
+
+@dataclass
+class Shard:
+    mart: MartConnection
+    router: AggregateRouter
+
+
+class ShardSet:
+    """
+    Os shards da geração do mart que está sendo servida. Trocam junto com
+    ela (as conexões antigas terminam as queries em andamento e são
+    liberadas quando os cursores saem de uso, como no MartConnection).
+    """
+
+    def __init__(self, enabled: bool = SHARDS_ENABLED, fanout_workers: int = SHARD_FANOUT_WORKERS):
+        self.enabled = enabled and pa is not None
+        self._lock = threading.Lock()
+        self._key = None
+        # (shards, {loja: shard}), trocados juntos: quem lê não trava
+        self._published = ([], {})
+        self._pool = ThreadPoolExecutor(max_workers=fanout_workers, thread_name_prefix="shard-query")
+        if enabled and pa is None:
+            logger.warning("pyarrow não instalado: shards desligados, usando o mart completo.")
+
+    def available(self, cursor, version, served_file: Optional[str], table_rows: dict) -> bool:
+        """
+        O mart servido tem shards? Carrega o mapa loja -> shard uma vez por
+        versão. 'cursor' é do mart completo; 'table_rows' é o catálogo dele.
+        """
+        if not self.enabled or served_file is None or SHARD_MAP_TABLE not in table_rows:
+            return False
+        key = (version, served_file)
+        if key == self._key:
+            return bool(self._published[0])
+        with self._lock:
+            if key != self._key:
+                rows = cursor.execute(f"SELECT store_name, shard FROM {SHARD_MAP_TABLE}").fetchall()
+                n_shards = max((shard for _, shard in rows), default=-1) + 1
+                shards = [
+                    Shard(MartConnection(shard_path(served_file, i)), AggregateRouter())
+                    for i in range(n_shards)
+                ]
+                self._published = (shards, dict(rows))
+                self._key = key
+        return bool(self._published[0])
+
+    @staticmethod
+    def serves(query: AggregateQuery, params: Optional[list], planned_table: str) -> bool:
+        """
+        Vale ir aos shards? Sim para a query de uma loja; para as demais, só
+        se no mart completo ela varreria o fato ('planned_table', a tabela
+        que o AggregateRouter escolheu lá).
+        """
+        if _single_store(query, list(params or [])) is not None:
+            return True
+        return planned_table == FACTS[query.fact].table
+
+    def execute(self, query: AggregateQuery, params: Optional[list] = None) -> QueryResult:
+        """Responde a query pelos shards (um só, se a query é de uma loja)."""
+        params = list(params or [])
+        shards, store_shard = self._published
+        store = _single_store(query, params)
+        if store is not None:
+            # Loja fora do mapa (sem vendas): qualquer shard responde "vazio"
+            shard = shards[store_shard.get(store, 0)]
+            cursor = shard.mart.cursor()
+            sql = shard.router.compile(query, cursor, shard.mart.cursor_version())
+            return QueryResult.run(cursor, sql, params, shard.mart.new_cursor)
+
+        fact = FACTS[query.fact]
+        columns = sorted({fact.dimension_columns.get(d, d) for d in query.dimensions})
+        futures = [
+            self._pool.submit(contextvars.copy_context().run, self._partial, shard, query, columns, params)
+            for shard in shards
+        ]
+        partials = [future.result() for future in futures]
+
+        # Gather: o relatório final sobre a união das parciais (já filtradas)
+        merged = duckdb.connect(database=":memory:")
+        try:
+            merged.register("shard_partials", pa.concat_tables(partials))
+            sql = compile_aggregate(replace(query, filters=()),
+                                    source=Rollup("shard_partials", query.fact, tuple(columns)))
+            return QueryResult.run(merged, sql)
+        finally:
+            merged.close()
+
+    @staticmethod
+    def _partial(shard: Shard, query: AggregateQuery, columns: list, params: list):
+        """Parciais aditivas da query num shard (menor rollup que cobre)."""
+        cursor = shard.mart.cursor()
+        source = shard.router.source_for(query, cursor, shard.mart.cursor_version())
+        with phase("shard"):
+            return arrow_table(cursor.execute(compile_partial(query.fact, columns, source, query.filters), params))
+
+    def stats(self) -> dict:
+        shards, store_shard = self._published
+        return {
+            "enabled": self.enabled,
+            "shards": len(shards),
+            "stores": len(store_shard),
+            "files": [shard.mart.database_file for shard in shards],
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        for shard in self._published[0]:
+            shard.mart.close()
+
+
+shard_set = ShardSet()
@@ -0,0 +1,145 @@
+"""
+Log de queries lentas.
+
+Toda query que passa de SLOW_QUERY_MS (execute + fetch) entra no log com
+SQL, parâmetros, tempos e linhas. Na primeira vez que uma query (SQL +
+parâmetros) fica lenta, ela é reexecutada UMA vez, fora do caminho da
+requisição, com o profiler do DuckDB ligado: o log guarda o plano físico,
+o tempo e as linhas de cada operador e o total de linhas varridas.
+
+Quem executa diz onde reexecutar (uma fábrica de cursor para o mesmo
+banco). Queries sobre dados que só existem naquela execução (tabelas
+temporárias do cursor, o DuckDB em memória do gather dos shards) entram
+no log sem perfil.
+
+/api/v2/admin/slow_queries lista as piores.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import mart
+from metrics import logger
+
+NOT_PROFILED = {"skipped": "lê dados locais da execução (tabela temporária ou DuckDB em memória)"}
+
+# --- Configuração ---
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+SLOW_QUERY_MAX_ENTRIES = int(os.getenv("SLOW_QUERY_MAX_ENTRIES", "100"))
+# Perfis na fila ao mesmo tempo (acima disso o perfil é descartado)
+SLOW_QUERY_MAX_PENDING_PROFILES = int(os.getenv("SLOW_QUERY_MAX_PENDING_PROFILES", "4"))
+
+
+def _flatten_operators(node: dict, depth: int = 0, out: list = None) -> list:
+    """Árvore do profiler -> lista de operadores (com a profundidade no plano)."""
+    out = [] if out is None else out
+    for child in node.get("children", []):
+        extra = child.get("extra_info", {})
+        out.append({
+            "depth": depth,
+            "operator": child.get("operator_name") or child.get("operator_type"),
+            "timing_ms": round(child.get("operator_timing", 0.0) * 1000, 3),
+            "rows": child.get("operator_cardinality", 0),
+            "rows_scanned": child.get("operator_rows_scanned", 0),
+            "table": extra.get("Table"),
+            "filters": extra.get("Filters"),
+        })
+        _flatten_operators(child, depth + 1, out)
+    return out
+
+
+def capture_profile(sql: str, params: list, cursor) -> dict:
+    """Reexecuta a query com o profiler ligado no cursor dado (e o fecha)."""
+    try:
+        plan = cursor.execute(f"EXPLAIN {sql}", params).fetchall()
+        cursor.execute("SET enable_profiling = 'no_output'")
+        cursor.execute(sql, params).fetchall()
+        profile = json.loads(cursor.get_profiling_information(format="json"))
+    finally:
+        cursor.close()
+
+    operators = _flatten_operators(profile)
+    return {
+        "plan": "\n".join(row[1] for row in plan),
+        "latency_ms": round(profile.get("latency", 0.0) * 1000, 3),
+        "rows_scanned": profile.get("cumulative_rows_scanned"),
+        "rows_returned": profile.get("rows_returned"),
+        "peak_memory_bytes": profile.get("system_peak_buffer_memory"),
+        "operators": operators,
+        "slowest_operators": sorted(operators, key=lambda o: o["timing_ms"], reverse=True)[:5],
+    }
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, max_entries: int = SLOW_QUERY_MAX_ENTRIES):
+        self.threshold_ms = threshold_ms
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._profiler = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-profile")
+        self._pending_profiles = 0
+        self.total = 0
+
+    def observe(self, sql: str, params, elapsed_ms: float, rows: int, profile_cursor=None):
+        """
+        Chamado depois de cada query; só registra as lentas. 'profile_cursor'
+        abre um cursor onde a query pode ser reexecutada (None = sem perfil).
+        """
+        if elapsed_ms < self.threshold_ms:
+            return
+        params = [p if isinstance(p, (int, float, str, bool, type(None))) else str(p) for p in (params or [])]
+        key = (sql, tuple(params))
+
+        with self._lock:
+            self.total += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.max_entries:
+                    # Sai a "menos pior" (menor tempo máximo)
+                    del self._entries[min(self._entries, key=lambda k: self._entries[k]["max_ms"])]
+                entry = self._entries[key] = {
+                    "sql": sql.strip(), "params": params, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                    "last_ms": 0.0, "rows": rows, "mart_version": mart.version,
+                    "profile": None if profile_cursor else NOT_PROFILED,
+                }
+            entry["count"] += 1
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            entry["last_ms"] = elapsed_ms
+            entry["last_seen"] = time.time()
+            entry["rows"] = rows
+            should_profile = (profile_cursor is not None and entry["count"] == 1
+                              and self._pending_profiles < SLOW_QUERY_MAX_PENDING_PROFILES)
+            if should_profile:
+                self._pending_profiles += 1
+
+        logger.warning(f"slow_query ms={elapsed_ms:.1f} rows={rows} sql={' '.join(sql.split())[:200]}")
+        if should_profile:
+            self._profiler.submit(self._profile, key, profile_cursor)
+
+    def _profile(self, key: tuple, profile_cursor):
+        try:
+            profile = capture_profile(key[0], list(key[1]), profile_cursor())
+        except Exception as e:
+            profile = {"error": str(e)}
+        with self._lock:
+            self._pending_profiles -= 1
+            if key in self._entries:
+                self._entries[key]["profile"] = profile
+
+    def top(self, limit: int = 20, order_by: str = "total_ms") -> list:
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda e: e[order_by], reverse=True)[:limit]
+            return [dict(e, avg_ms=round(e["total_ms"] / e["count"], 3)) for e in entries]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def shutdown(self):
+        self._profiler.shutdown(wait=False, cancel_futures=True)
+
+
+slow_queries = SlowQueryLog()
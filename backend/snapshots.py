@@ -0,0 +1,253 @@
+"""
+Snapshots estáticos do dashboard padrão.
+
+A página inicial sempre carrega os mesmos relatórios globais, sem
+parâmetros. No fim do ETL eles são renderizados em JSON (records e
+columnar), já comprimidos (gzip e, se houver o pacote 'brotli', br), em
+SNAPSHOT_DIR/<versão>/. O manifest.json aponta a versão publicada e o
+arquivo do mart (inode + mtime) para o qual ela vale.
+
+A API serve esses bytes direto da memória, sem DuckDB: nem o primeiro
+acesso depois de um deploy ou de um mart novo paga a consulta. Se o mart
+em disco não é o do manifesto, o snapshot é ignorado e o relatório segue
+o caminho normal.
+"""
+import gzip
+import json
+import os
+import shutil
+import threading
+from typing import Optional
+
+from fastapi.responses import Response
+
+from aggregates import AggregateQuery, aggregate_router
+from database import mart
+from encoding import (FORMAT_COLUMNAR, FORMAT_RECORDS, MEDIA_TYPES, QueryResult, accepted_encodings, dumps,
+                      json_payload)
+from metrics import phase, record_rows
+
+try:
+    import brotli
+except ImportError:  # Sem brotli: só gzip
+    brotli = None
+
+# --- Configuração ---
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_ENABLED = os.getenv("SNAPSHOT_ENABLED", "true").lower() in ("1", "true", "yes")
+# Versões mantidas em disco (a publicada + as anteriores)
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "2"))
+MANIFEST_FILE = "manifest.json"
+
+SNAPSHOT_FORMATS = (FORMAT_RECORDS, FORMAT_COLUMNAR)
+# Codificação -> extensão do arquivo ("identity" = JSON puro)
+ENCODINGS = {"br": ".br", "gzip": ".gz", "identity": ""}
+
+# Relatórios da página inicial (sem parâmetros). O SQL é o mesmo que a API
+# usaria: o AggregateRouter escolhe a tabela.
+SNAPSHOT_QUERIES = {
+    "kpi_summary": AggregateQuery(
+        "sales",
+        measures=(
+            ("faturamento", "faturamento_total"),
+            "ticket_medio",
+            "total_vendas",
+            ("tempo_entrega", "avg_tempo_entrega_min"),
+            "total_descontos",
+        ),
+    ),
+
+    "sales_by_store": AggregateQuery(
+        "sales",
+        dimensions=("store_name",),
+        measures=("faturamento", "total_vendas"),
+        order_by=(("faturamento", "DESC"),),
+    ),
+
+    "sales_by_channel": AggregateQuery(
+        "sales",
+        dimensions=("channel_name",),
+        measures=("faturamento", "total_vendas"),
+        order_by=(("faturamento", "DESC"),),
+    ),
+
+    "sales_by_month": AggregateQuery(
+        "sales", dimensions=("mes_ano",), measures=("faturamento",), order_by=(("mes_ano", "ASC"),)
+    ),
+
+    "top_products_by_revenue": AggregateQuery(
+        "product_sales",
+        dimensions=("product_name",),
+        measures=("faturamento",),
+        order_by=(("faturamento", "DESC"), ("product_name", "ASC")),
+        limit=20,
+    ),
+
+    "worst_products_by_revenue": AggregateQuery(
+        "product_sales",
+        dimensions=("product_name",),
+        measures=("faturamento",),
+        order_by=(("faturamento", "ASC"), ("product_name", "ASC")),
+        limit=20,
+    ),
+
+    "sales_by_payment_type": AggregateQuery(
+        "sales",
+        dimensions=("forma_pagamento",),
+        measures=("faturamento",),
+        order_by=(("faturamento", "DESC"),),
+    ),
+}
+
+
+def _compress(body: bytes) -> dict:
+    """Corpo em cada codificação disponível."""
+    encoded = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoded["br"] = brotli.compress(body, quality=11)
+    return encoded
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def render_snapshots(conn, version: str, mart_version: str, mart_signature, snapshot_dir: str = SNAPSHOT_DIR) -> dict:
+    """
+    Renderiza SNAPSHOT_QUERIES a partir do mart aberto em 'conn', grava os
+    arquivos em snapshot_dir/<version>/ e publica o manifesto (os.replace).
+    'mart_version' é a versão que a API lê do mart (ETag); 'mart_signature'
+    identifica o arquivo. Devolve o manifesto.
+    """
+    version_dir = os.path.join(snapshot_dir, version)
+    os.makedirs(version_dir, exist_ok=True)
+
+    reports = {}
+    for name, query in SNAPSHOT_QUERIES.items():
+        conn.execute(aggregate_router.compile(query, conn, mart_version))
+        result = QueryResult.from_cursor(conn)
+        files = {}
+        for fmt in SNAPSHOT_FORMATS:
+            for encoding, body in _compress(dumps(json_payload(result, fmt))).items():
+                file_name = f"{name}.{fmt}.json{ENCODINGS[encoding]}"
+                _write_atomic(os.path.join(version_dir, file_name), body)
+                files[f"{fmt}/{encoding}"] = {"file": file_name, "bytes": len(body)}
+        reports[name] = {"rows": len(result), "files": files}
+
+    manifest = {
+        "version": version,
+        "mart_version": mart_version,
+        "mart_signature": list(mart_signature) if mart_signature else None,
+        "reports": reports,
+    }
+    _write_atomic(os.path.join(snapshot_dir, MANIFEST_FILE),
+                  json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+
+    # Limpa as versões antigas (a API lê da memória, não do disco)
+    versions = sorted(
+        d for d in os.listdir(snapshot_dir)
+        if os.path.isdir(os.path.join(snapshot_dir, d)) and d != version
+    )
+    for old in versions[:max(len(versions) - (SNAPSHOT_KEEP - 1), 0)]:
+        shutil.rmtree(os.path.join(snapshot_dir, old), ignore_errors=True)
+    return manifest
+
+
+class SnapshotStore:
+    """
+    Snapshots publicados, em memória. O manifesto é relido quando muda em
+    disco; os arquivos da versão são carregados uma vez.
+    """
+
+    def __init__(self, snapshot_dir: str = SNAPSHOT_DIR, enabled: bool = SNAPSHOT_ENABLED):
+        self.snapshot_dir = snapshot_dir
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._manifest_signature = None
+        # (manifesto, {(relatório, formato, codificação): bytes}), trocados juntos
+        self._published = (None, {})
+        self.hits = 0
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.snapshot_dir, MANIFEST_FILE)
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self._manifest_path())
+            signature = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            signature = None
+        if signature == self._manifest_signature:
+            return
+
+        with self._lock:
+            if signature == self._manifest_signature:
+                return
+            manifest, bodies = None, {}
+            if signature is not None:
+                try:
+                    with open(self._manifest_path(), "rb") as f:
+                        manifest = json.loads(f.read())
+                    version_dir = os.path.join(self.snapshot_dir, manifest["version"])
+                    for name, report in manifest["reports"].items():
+                        for key, entry in report["files"].items():
+                            fmt, encoding = key.split("/")
+                            with open(os.path.join(version_dir, entry["file"]), "rb") as f:
+                                bodies[(name, fmt, encoding)] = f.read()
+                except (OSError, ValueError, KeyError):
+                    manifest, bodies = None, {}
+            self._published = (manifest, bodies)
+            self._manifest_signature = signature
+
+    def current_version(self) -> Optional[str]:
+        """
+        Versão do mart (como a API a vê) dos snapshots publicados, se eles
+        valem para o arquivo do mart que está em disco; senão, None.
+        """
+        if not self.enabled:
+            return None
+        self._refresh()
+        manifest = self._published[0]
+        if manifest is None or manifest.get("mart_signature") is None:
+            return None
+        if tuple(manifest["mart_signature"]) != mart.file_signature():
+            return None
+        return manifest["mart_version"]
+
+    def response(self, name: str, fmt: str, accept_encoding: Optional[str]) -> Optional[Response]:
+        """Resposta pronta do snapshot, ou None (sem snapshot válido para o pedido)."""
+        if fmt not in SNAPSHOT_FORMATS or self.current_version() is None:
+            return None
+        manifest, bodies = self._published
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ENCODINGS:
+            body = bodies.get((name, fmt, encoding))
+            if body is not None and encoding in accepted:
+                break
+        else:
+            return None
+
+        with phase("snapshot"):
+            self.hits += 1
+            record_rows(manifest["reports"][name]["rows"])
+            headers = {"Vary": "Accept-Encoding", "X-Snapshot": manifest["version"]}
+            if encoding != "identity":
+                headers["Content-Encoding"] = encoding
+            return Response(content=body, media_type=MEDIA_TYPES[fmt], headers=headers)
+
+    def stats(self) -> dict:
+        self._refresh()
+        manifest = self._published[0]
+        return {
+            "enabled": self.enabled,
+            "version": manifest["version"] if manifest else None,
+            "valid": self.current_version() is not None,
+            "reports": sorted(manifest["reports"]) if manifest else [],
+            "hits": self.hits,
+        }
+
+
+snapshot_store = SnapshotStore()
@@ -0,0 +1,203 @@
+"""
+Esquema estrela compacto dos fatos.
+
+O ETL carrega fct_sales e fct_product_sales como vêm do Postgres (nomes
+repetidos em todas as linhas, tipos inferidos pelo pandas) e depois os
+reescreve (build_star_sql):
+- loja, canal e produto ficam só com o id da origem (store_id, channel_id,
+  product_id), com nome e atributos em dim_store, dim_channel e dim_product
+  (uma linha por id);
+- a forma de pagamento (só a descrição, sem id no extrato) ganha uma chave
+  por valor (payment_type_key) em dim_payment_type; o valor nulo também
+  ganha chave;
+- rótulos de poucos valores que ficam no fato (dia da semana, período do
+  dia, status) viram ENUM, com os valores em ordem alfabética (ORDER BY
+  continua igual ao de VARCHAR);
+- as colunas numéricas recebem os tipos do Postgres (DECIMAL(10, 2) para
+  valores, INTEGER/TINYINT para ids, segundos e horas).
+
+As consultas de agregação agrupam pelas chaves e só juntam as dimensões no
+resultado já agregado (ver compile_partial em aggregates.py). Quem precisa
+das linhas com os nomes (amostra, sketches, exportação, lake) lê
+denormalized_sql.
+"""
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Dimension:
+    table: str
+    # Chave: o id da origem (já vem no fato) ou, com 'surrogate', uma chave
+    # gerada aqui, uma por valor de 'name' (só para dimensões sem atributos)
+    key: str
+    key_type: str
+    name: str
+    attributes: tuple = ()
+    surrogate: bool = False
+
+
+DIM_STORE = Dimension("dim_store", "store_id", "INTEGER", "store_name", ("store_city",))
+DIM_CHANNEL = Dimension("dim_channel", "channel_id", "INTEGER", "channel_name", ("channel_type",))
+DIM_PRODUCT = Dimension("dim_product", "product_id", "INTEGER", "product_name", ("product_category",))
+DIM_PAYMENT_TYPE = Dimension("dim_payment_type", "payment_type_key", "SMALLINT", "payment_type", surrogate=True)
+
+DIMENSIONS = (DIM_STORE, DIM_CHANNEL, DIM_PRODUCT, DIM_PAYMENT_TYPE)
+DIMENSION_TABLES = tuple(dim.table for dim in DIMENSIONS)
+
+# Fato -> dimensões que ele referencia (e quais colunas delas ele tinha).
+# A dimensão é montada a partir dos fatos que têm todas as colunas dela.
+FACT_DIMENSIONS = {
+    "fct_sales": (
+        (DIM_STORE, ("store_name", "store_city")),
+        (DIM_CHANNEL, ("channel_name", "channel_type")),
+        (DIM_PAYMENT_TYPE, ("payment_type",)),
+    ),
+    "fct_product_sales": (
+        (DIM_STORE, ("store_name",)),
+        (DIM_CHANNEL, ("channel_name", "channel_type")),
+        (DIM_PRODUCT, ("product_name", "product_category")),
+    ),
+}
+
+# Rótulos que ficam no fato, como ENUM
+ENUM_COLUMNS = {
+    "fct_sales": ("dia_da_semana_nome", "periodo_do_dia", "sale_status_desc"),
+    "fct_product_sales": (),
+}
+
+# Tipos explícitos (os do Postgres; o pandas entrega float64/object)
+COLUMN_TYPES = {
+    "sale_id": "INTEGER",
+    "dia_da_semana": "TINYINT",
+    "hora_do_dia": "TINYINT",
+    "sale_total_amount": "DECIMAL(10, 2)",
+    "total_discount": "DECIMAL(10, 2)",
+    "delivery_fee": "DECIMAL(10, 2)",
+    "service_tax_fee": "DECIMAL(10, 2)",
+    "production_seconds": "INTEGER",
+    "delivery_seconds": "INTEGER",
+    "customer_id": "INTEGER",
+    "product_quantity": "DOUBLE",
+    "product_base_price": "DOUBLE",
+    "product_total_price": "DOUBLE",
+}
+
+# Ordem física dos fatos: data primeiro (filtros de período pulam blocos)
+FACT_ORDER = ("data_venda", "store_id")
+
+
+def lookups(fact_table: str) -> dict:
+    """Coluna de rótulo -> dimensão onde ela está, para o fato dado."""
+    return {
+        column: dim
+        for dim, columns in FACT_DIMENSIONS.get(fact_table, ())
+        for column in columns
+    }
+
+
+def _enum_type(column: str) -> str:
+    return f"{column}_enum"
+
+
+def _dimension_columns(dim: Dimension) -> tuple:
+    return (dim.name, *dim.attributes)
+
+
+def build_star_sql(fact_columns: dict) -> list:
+    """
+    SQL que cria as dimensões e os tipos ENUM e reescreve os fatos no
+    formato compacto. 'fact_columns' = {fato: colunas como foram carregadas}.
+    """
+    for fact_table, loaded in fact_columns.items():
+        missing = [dim.key for dim, _ in FACT_DIMENSIONS[fact_table] if not dim.surrogate and dim.key not in loaded]
+        if missing:
+            raise ValueError(f"{fact_table} sem as colunas de id {missing} (extrato antigo?)")
+
+    statements = []
+    for dim in DIMENSIONS:
+        columns = _dimension_columns(dim)
+        sources = [
+            fact_table
+            for fact_table, entries in FACT_DIMENSIONS.items()
+            if fact_table in fact_columns and set(columns) <= set(dict(entries).get(dim, ()))
+        ]
+        if not sources:
+            continue
+        if dim.surrogate:
+            union = " UNION ".join(f"SELECT {dim.name} FROM {fact_table}" for fact_table in sources)
+            select = f"""
+        SELECT CAST(ROW_NUMBER() OVER (ORDER BY {dim.name} NULLS FIRST) AS {dim.key_type}) AS {dim.key}, {dim.name}
+        FROM (SELECT DISTINCT {dim.name} FROM ({union}))"""
+        else:
+            union = " UNION ".join(
+                f"SELECT CAST({dim.key} AS {dim.key_type}) AS {dim.key}, {', '.join(columns)} FROM {fact_table}"
+                for fact_table in sources
+            )
+            select = f"""
+        SELECT DISTINCT * FROM ({union})
+        WHERE {dim.key} IS NOT NULL"""
+        statements.append(f"""
+        CREATE OR REPLACE TABLE {dim.table} AS{select}
+        ORDER BY {dim.key};
+        """)
+
+    for fact_table, loaded in fact_columns.items():
+        for column in ENUM_COLUMNS.get(fact_table, ()):
+            if column in loaded:
+                statements.append(
+                    f"CREATE TYPE {_enum_type(column)} AS ENUM "
+                    f"(SELECT DISTINCT {column} FROM {fact_table} WHERE {column} IS NOT NULL ORDER BY {column});"
+                )
+
+    for fact_table, loaded in fact_columns.items():
+        entries = FACT_DIMENSIONS[fact_table]
+        labels = [c for _, columns in entries for c in columns if c in loaded]
+        casts = [
+            f"CAST(f.{c} AS {_enum_type(c) if c in ENUM_COLUMNS[fact_table] else COLUMN_TYPES[c]}) AS {c}"
+            for c in loaded
+            if c in COLUMN_TYPES or c in ENUM_COLUMNS[fact_table]
+        ]
+        casts += [f"CAST(f.{dim.key} AS {dim.key_type}) AS {dim.key}" for dim, _ in entries if not dim.surrogate]
+        select = "f.*"
+        if labels:
+            select += f" EXCLUDE ({', '.join(labels)})"
+        if casts:
+            select += f" REPLACE ({', '.join(casts)})"
+        surrogates = [dim for dim, _ in entries if dim.surrogate]
+        keys = "".join(f", {dim.table}.{dim.key}" for dim in surrogates)
+        joins = "\n        ".join(
+            f"LEFT JOIN {dim.table} ON f.{dim.name} IS NOT DISTINCT FROM {dim.table}.{dim.name}"
+            for dim in surrogates
+        )
+        statements += [
+            f"""
+        CREATE OR REPLACE TABLE {fact_table}__star AS
+        SELECT {select}{keys}
+        FROM {fact_table} f
+        {joins}
+        ORDER BY {", ".join(FACT_ORDER)};
+        """,
+            f"DROP TABLE {fact_table};",
+            f"ALTER TABLE {fact_table}__star RENAME TO {fact_table};",
+        ]
+    return statements
+
+
+def duplicate_keys_sql(dim: Dimension) -> str:
+    """Ids com mais de uma linha na dimensão (nome ou atributo diferente)."""
+    return f"SELECT {dim.key} FROM {dim.table} GROUP BY {dim.key} HAVING COUNT(*) > 1 ORDER BY {dim.key} LIMIT 5"
+
+
+def denormalized_sql(fact_table: str) -> str:
+    """
+    O fato com os nomes das dimensões de volta (mesmas colunas que o ETL
+    carregou), como subquery: FROM {denormalized_sql(...)} AS f.
+    """
+    entries = FACT_DIMENSIONS[fact_table]
+    surrogates = [dim.key for dim, _ in entries if dim.surrogate]
+    select = f"{fact_table}.*" + (f" EXCLUDE ({', '.join(surrogates)})" if surrogates else "")
+    labels = ", ".join(f"{dim.table}.{c}" for dim, columns in entries for c in columns)
+    joins = " ".join(
+        f"LEFT JOIN {dim.table} ON {fact_table}.{dim.key} = {dim.table}.{dim.key}" for dim, _ in entries
+    )
+    return f"(SELECT {select}, {labels} FROM {fact_table} {joins})"
@@ -0,0 +1,47 @@
+"""
+Fixtures dos testes: um mart sintético pequeno (o mesmo gerador do
+loadtest.py), construído uma vez por sessão com as etapas do ETL.
+"""
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MART_ROWS = 20000
+MART_STORES = 12
+MART_MONTHS = 3
+
+
+@pytest.fixture(scope="session")
+def mart_file(tmp_path_factory):
+    """Arquivo do mart sintético (fatos, esquema estrela e derivados)."""
+    import loadtest
+
+    workdir = tmp_path_factory.mktemp("mart")
+    path = str(workdir / "analytics-1.duckdb")
+    loadtest.build_synthetic_mart(path, rows=MART_ROWS, stores=MART_STORES, months=MART_MONTHS,
+                                  snapshot_dir=str(workdir / "snapshots"))
+    return path
+
+
+@pytest.fixture(scope="session")
+def sharded_mart_file(mart_file, tmp_path_factory):
+    """Cópia do mart sintético dividida em shards por loja."""
+    import etl
+
+    path = str(tmp_path_factory.mktemp("shards") / "analytics-1.duckdb")
+    shutil.copy(mart_file, path)
+    etl.build_shards(path, mart_version="1", n_shards=3)
+    return path
+
+
+@pytest.fixture(scope="session")
+def mart(mart_file):
+    from database import MartConnection
+
+    conn = MartConnection(mart_file)
+    yield conn
+    conn.close()
@@ -0,0 +1,27 @@
+"""
+Clientes em risco (customer_segmentation): calculados contra a data da
+consulta, não contra a do ETL.
+"""
+from datetime import timedelta
+
+from main import _customer_stats_query
+
+
+def test_at_risk_depends_on_the_query_date(mart):
+    cursor = mart.cursor()
+    first_sale, last_sale = cursor.execute(
+        "SELECT MIN(ultima_compra_data), MAX(ultima_compra_data) FROM customer_rfm"
+    ).fetchone()
+    frequent = cursor.execute("SELECT COUNT(*) FROM customer_rfm WHERE total_vendas >= 3").fetchone()[0]
+    assert frequent > 0
+
+    # Na última compra mais antiga, ninguém está há mais de 30 dias sem comprar
+    sql = _customer_stats_query("DESC", at_risk=True)
+    today = first_sale
+    assert cursor.execute(sql, [today, today]).fetchall() == []
+
+    # Um ano depois do fim dos dados, todo cliente frequente está em risco
+    today = last_sale + timedelta(days=365)
+    rows = cursor.execute(sql, [today, today]).fetchall()
+    assert len(rows) == min(frequent, 100)
+    assert all(total_vendas >= 3 for _, _, total_vendas, _ in rows)
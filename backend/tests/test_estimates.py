@@ -0,0 +1,47 @@
+"""
+Estimativas (amostra estratificada e HLL) contra as contagens exatas
+no mart sintético.
+"""
+import pytest
+
+import hll
+from main import QUERIES
+from star import denormalized_sql
+
+
+def _by_key(cursor, sql: str, params: list = ()) -> dict:
+    result = cursor.execute(sql, list(params))
+    columns = [d[0] for d in result.description]
+    return {row[0]: dict(zip(columns, row)) for row in result.fetchall()}
+
+
+@pytest.mark.parametrize("measure", ["faturamento", "total_vendas"])
+def test_sample_margin_covers_exact_total(mart, measure):
+    cursor = mart.cursor()
+    exact = _by_key(cursor, "SELECT store_name, SUM(sale_total_amount) AS faturamento, COUNT(*) AS total_vendas "
+                            f"FROM {denormalized_sql('fct_sales')} AS f GROUP BY store_name")
+    estimate = _by_key(cursor, QUERIES["sales_by_store_approx"])
+
+    assert estimate.keys() == exact.keys()
+    covered = [
+        abs(float(estimate[store][measure]) - float(exact[store][measure]))
+        <= estimate[store][f"{measure}_margem_erro"]
+        for store in exact
+    ]
+    # Margem de 95%: no máximo uma loja fora no mart de teste
+    assert sum(covered) >= len(covered) - 1
+
+
+@pytest.mark.parametrize("group_by, filters, params", [
+    (None, [], []),
+    ("store_name", [], []),
+    ("channel_name", ["mes_ano = ?"], ["2025-06"]),
+])
+def test_hll_within_relative_error(mart, group_by, filters, params):
+    cursor = mart.cursor()
+    exact = cursor.execute(hll.compile_exact_unique_customers(group_by, filters), params).fetchall()
+    estimate = cursor.execute(hll.compile_unique_customers(group_by, filters), params).fetchall()
+
+    assert [row[:-2] for row in estimate] == [row[:-1] for row in exact]
+    for (*_, estimated, relative_error), (*_, actual) in zip(estimate, exact):
+        assert abs(estimated - actual) <= 3 * relative_error * actual
@@ -0,0 +1,47 @@
+"""Coalescência de chamadas idênticas em voo (executor.SingleFlight)."""
+import asyncio
+
+import pytest
+
+from executor import SingleFlight
+
+
+def test_identical_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    async def report(value):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        return value * 2
+
+    async def scenario():
+        same = [flight.run("sales_by_store", "sales_by_store", report, 21) for _ in range(5)]
+        other = flight.run("sales_by_month", "sales_by_month", report, 1)
+        return await asyncio.gather(*same, other)
+
+    assert asyncio.run(scenario()) == [42] * 5 + [2]
+    assert sorted(calls) == [1, 21]
+    assert (flight.executions, flight.coalesced) == (2, 4)
+    assert flight.in_flight() == 0
+
+
+def test_waiters_get_the_same_error_and_the_key_is_released():
+    flight = SingleFlight()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        raise ValueError("mart indisponível")
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.run("k", "k", failing) for _ in range(3)), return_exceptions=True)
+        # Terminada a chamada, a próxima com a mesma chave executa de novo
+        with pytest.raises(ValueError):
+            await flight.run("k", "k", failing)
+        return results
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(e, ValueError) for e in results)
+    assert len(calls) == 2
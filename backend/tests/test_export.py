@@ -0,0 +1,31 @@
+"""Negociação do gzip da exportação (Accept-Encoding com q-values)."""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from encoding import accepted_encodings
+
+
+@pytest.mark.parametrize("header, gzip", [
+    (None, False),
+    ("gzip", True),
+    ("br, gzip;q=0.5", True),
+    ("gzip;q=0", False),
+    ("gzip; q=0.000, br", False),
+    ("identity", False),
+])
+def test_accepted_encodings(header, gzip):
+    assert ("gzip" in accepted_encodings(header)) == gzip
+    assert "identity" in accepted_encodings(header)
+
+
+@pytest.mark.parametrize("header, content_encoding", [("gzip", "gzip"), ("gzip;q=0", None)])
+def test_export_honors_gzip_q_value(mart, monkeypatch, header, content_encoding):
+    monkeypatch.setattr(main, "mart", mart)
+    client = TestClient(main.app)
+    response = client.get("/api/v2/export", params={"store_name": "Loja 1", "format": "csv"},
+                          headers={"Accept-Encoding": header})
+    assert response.status_code == 200
+    assert response.headers.get("content-encoding") == content_encoding
+    # Cabeçalho + linhas da loja (o cliente descomprime o gzip)
+    assert len(response.text.splitlines()) > 1
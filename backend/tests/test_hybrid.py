@@ -0,0 +1,34 @@
+"""
+Modo híbrido: parciais do mart (filtradas) + fatia ao vivo. O Postgres é
+trocado por linhas fixas no formato de fetch_live_partial.
+"""
+from datetime import datetime
+
+import pytest
+
+import live
+import main
+
+
+@pytest.fixture
+def hybrid(mart, monkeypatch):
+    monkeypatch.setattr(main, "mart", mart)
+    monkeypatch.setattr(live, "live_since", lambda watermark: datetime.now())
+    # Uma venda de 100,00 na Loja 1 e outra de 50,00 na Loja 2, depois do mart
+    live_rows = [
+        ("Loja 1", 100.0, 1, 0.0, None, 0),
+        ("Loja 2", 50.0, 1, 0.0, None, 0),
+    ]
+    monkeypatch.setattr(live, "fetch_live_partial", lambda pg_pool, columns, since: live_rows)
+    return mart
+
+
+def test_hybrid_adds_only_the_filtered_store(hybrid):
+    mart_only = main._execute_query("kpi_summary_for_store", ["Loja 1"])
+    result, _, live_included = main._execute_hybrid("kpi_summary_for_store", ["Loja 1"])
+
+    assert live_included
+    before = dict(zip(mart_only.columns, mart_only.rows[0]))
+    after = dict(zip(result.columns, result.rows[0]))
+    assert after["total_vendas"] == before["total_vendas"] + 1
+    assert float(after["faturamento_total"]) == pytest.approx(float(before["faturamento_total"]) + 100.0)
@@ -0,0 +1,86 @@
+"""
+Publicação blue/green (publish.py): troca do link, rollback para uma
+geração anterior, limpeza e a API seguindo o link.
+"""
+import os
+import shutil
+
+import duckdb
+import pytest
+
+from database import MartConnection
+from etl import record_mart_version
+from publish import (InvalidMartError, collect_garbage, generation_path, publish, read_manifest,
+                     validate_mart)
+
+
+@pytest.fixture
+def generations(mart_file, tmp_path):
+    """Três gerações (cópias do mart sintético com versões diferentes) num MART_DIR temporário."""
+    mart_dir = str(tmp_path / "marts")
+    os.makedirs(mart_dir)
+    paths = {}
+    for version in ("20260101000000", "20260102000000", "20260103000000"):
+        path = generation_path(version, mart_dir=mart_dir)
+        shutil.copy(mart_file, path)
+        conn = duckdb.connect(path)
+        try:
+            count = conn.execute("SELECT COUNT(*) FROM fct_sales").fetchone()[0]
+            record_mart_version(conn, "fct_sales", version, count)
+        finally:
+            conn.close()
+        paths[version] = (path, validate_mart(path))
+    return mart_dir, str(tmp_path / "analytics.duckdb"), paths
+
+
+def test_publish_and_rollback_follow_the_link(generations):
+    mart_dir, link, paths = generations
+    (first, first_api), (second, second_api) = paths["20260101000000"], paths["20260102000000"]
+    assert first_api != second_api
+
+    publish(first, "20260101000000", first_api, link=link, mart_dir=mart_dir)
+    mart = MartConnection(link)
+    try:
+        mart.cursor()
+        assert mart.cursor_version() == first_api
+
+        publish(second, "20260102000000", second_api, link=link, mart_dir=mart_dir)
+        assert os.path.realpath(link) == os.path.realpath(second)
+        assert mart.current_version() is None  # o link mudou: reabre no próximo uso
+        mart.cursor()
+        assert mart.cursor_version() == second_api
+
+        # Rollback = publicar de novo a geração anterior
+        manifest = publish(first, "20260101000000", first_api, link=link, mart_dir=mart_dir)
+        assert manifest["current"]["version"] == "20260101000000"
+        assert [g["version"] for g in manifest["generations"]] == ["20260101000000", "20260102000000"]
+        mart.cursor()
+        assert mart.cursor_version() == first_api
+    finally:
+        mart.close()
+
+
+def test_collect_garbage_keeps_the_published_generation(generations):
+    mart_dir, link, paths = generations
+    for version, (path, api_version) in paths.items():
+        publish(path, version, api_version, link=link, mart_dir=mart_dir)
+    # Rollback para a mais antiga: ela fica mesmo fora das 'keep' mais novas
+    oldest, oldest_api = paths["20260101000000"]
+    publish(oldest, "20260101000000", oldest_api, link=link, mart_dir=mart_dir)
+
+    removed = collect_garbage(keep=1, link=link, mart_dir=mart_dir)
+
+    assert removed == ["analytics-20260102000000.duckdb"]
+    assert os.path.exists(oldest) and os.path.exists(paths["20260103000000"][0])
+    assert {g["version"] for g in read_manifest(mart_dir)["generations"]} == {"20260101000000", "20260103000000"}
+
+
+def test_validate_rejects_incomplete_generation(tmp_path):
+    path = str(tmp_path / "analytics-20260101000000.duckdb")
+    conn = duckdb.connect(path)
+    conn.execute("CREATE TABLE fct_sales AS SELECT 1 AS sale_id")
+    record_mart_version(conn, "fct_sales", "20260101000000", 1)
+    conn.close()
+
+    with pytest.raises(InvalidMartError, match="tabelas ausentes"):
+        validate_mart(path)
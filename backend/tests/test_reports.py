@@ -0,0 +1,92 @@
+"""
+Os caminhos otimizados de cada relatório (rollup escolhido pelo router,
+fato no esquema estrela, shards) devolvem o mesmo que o SQL de referência: a
+agregação direta sobre os fatos com os nomes das dimensões.
+"""
+import decimal
+
+import pytest
+
+from aggregates import FACTS, AggregateQuery, AggregateRouter, compile_aggregate, filter_parts
+from main import QUERIES
+from shards import ShardSet
+from star import denormalized_sql
+
+AGGREGATE_QUERIES = sorted(name for name, query in QUERIES.items() if isinstance(query, AggregateQuery))
+
+# Valor de cada filtro (loja, mês e canal que existem no mart sintético)
+FILTER_VALUES = {"store_name": "Loja 1", "mes_ano": "2025-06", "channel_name": "iFood"}
+
+
+def _params(query: AggregateQuery) -> list:
+    return [FILTER_VALUES[filter_parts(flt)[0]] for flt in query.filters]
+
+
+def _normalize(rows, ordered: bool) -> list:
+    rows = [
+        tuple(round(float(v), 4) if isinstance(v, (float, decimal.Decimal)) else v for v in row)
+        for row in rows
+    ]
+    return rows if ordered else sorted(rows, key=repr)
+
+
+def _baseline(cursor, query: AggregateQuery) -> list:
+    table = denormalized_sql(FACTS[query.fact].table) + " AS f"
+    rows = cursor.execute(compile_aggregate(query, table=table), _params(query)).fetchall()
+    return _normalize(rows, bool(query.order_by))
+
+
+@pytest.mark.parametrize("name", AGGREGATE_QUERIES)
+def test_routed_report_matches_baseline(mart, name):
+    query = QUERIES[name]
+    cursor = mart.cursor()
+    sql = AggregateRouter().compile(query, cursor, mart.cursor_version())
+    rows = cursor.execute(sql, _params(query)).fetchall()
+    assert _normalize(rows, bool(query.order_by)) == _baseline(cursor, query)
+
+
+@pytest.mark.parametrize("name", AGGREGATE_QUERIES)
+def test_star_fact_report_matches_baseline(mart, name):
+    query = QUERIES[name]
+    cursor = mart.cursor()
+    rows = cursor.execute(compile_aggregate(query), _params(query)).fetchall()
+    assert _normalize(rows, bool(query.order_by)) == _baseline(cursor, query)
+
+
+@pytest.fixture(scope="module")
+def shard_set(sharded_mart_file):
+    from database import MartConnection
+
+    full_mart = MartConnection(sharded_mart_file)
+    cursor = full_mart.cursor()
+    version = full_mart.cursor_version()
+    shards = ShardSet(enabled=True)
+    table_rows = AggregateRouter().table_rows(cursor, version)
+    assert shards.available(cursor, version, full_mart.served_file, table_rows)
+    yield shards, cursor
+    shards.shutdown()
+    full_mart.close()
+
+
+@pytest.mark.parametrize("name", AGGREGATE_QUERIES)
+def test_sharded_report_matches_baseline(shard_set, name):
+    shards, full_cursor = shard_set
+    query = QUERIES[name]
+    rows = shards.execute(query, _params(query)).rows
+    assert _normalize(rows, bool(query.order_by)) == _baseline(full_cursor, query)
+
+
+def test_shards_take_store_queries_and_fact_scans_only(shard_set):
+    _, full_cursor = shard_set
+    router = AggregateRouter()
+    covered = QUERIES["sales_by_store"]
+    store = QUERIES["kpi_summary_for_store"]
+    uncovered = AggregateQuery("sales", dimensions=("hora_do_dia", "delivery_neighborhood"), measures=("faturamento",))
+
+    def serves(query):
+        table = router.plan(query, full_cursor, "1").table
+        return ShardSet.serves(query, _params(query), table)
+
+    assert not serves(covered)
+    assert serves(store)
+    assert serves(uncovered)
@@ -0,0 +1,17 @@
+"""Validação do corpo de /api/v2/query antes de chegar ao DuckDB."""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from semantic import SEMANTIC_MAX_LIMIT
+
+
+@pytest.fixture(scope="module")
+def client():
+    return TestClient(main.app)
+
+
+@pytest.mark.parametrize("limit", [None, 0, SEMANTIC_MAX_LIMIT + 1])
+def test_invalid_limit_is_rejected(client, limit):
+    response = client.post("/api/v2/query", json={"measures": ["faturamento"], "limit": limit})
+    assert response.status_code == 422
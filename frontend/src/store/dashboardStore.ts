@@ -265,15 +265,23 @@ export const useDashboardStore = create<DashboardState>((set, get) => ({
     }));
 
     try {
-      const [productRes, channelRes] = await Promise.all([
-        fetch(`${API_BASE_URL}/reports/top_products_by_store?store_name=${encodeURIComponent(selectedStore)}&mes_ano=${mesAno}`),
-        fetch(`${API_BASE_URL}/reports/sales_by_channel_detail?store_name=${encodeURIComponent(selectedStore)}&mes_ano=${mesAno}`)
-      ]);
+      // Os dois relatórios do detalhe vêm numa requisição só (/batch)
+      const res = await fetch(`${API_BASE_URL}/batch`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          reports: [
+            { report: 'top_products_by_store', params: { store_name: selectedStore, mes_ano: mesAno } },
+            { report: 'sales_by_channel_detail', params: { store_name: selectedStore, mes_ano: mesAno } },
+          ],
+        }),
+      });
       
-      if (!productRes.ok || !channelRes.ok) throw new Error('Falha ao buscar relatórios detalhados');
+      if (!res.ok) throw new Error('Falha ao buscar relatórios detalhados');
 
-      const productData: DataRow[] = await productRes.json();
-      const channelData: DataRow[] = await channelRes.json();
+      const [productResult, channelResult]: { data: DataRow[] }[] = await res.json();
+      const productData: DataRow[] = productResult.data;
+      const channelData: DataRow[] = channelResult.data;
 
       set(state => ({
         vendasPorLoja: {